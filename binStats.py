@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse (COO style) store of per-bin statistics on a wind condition grid.
+Only the populated bins are kept: their combined (raveled) bin codes,
+sorted, with one value per bin for each statistic. With fine grids most
+bins are empty, so memory and loops scale with the number of populated
+bins instead of the size of the grid. A dense grid is only made when
+something (like a heatmap) needs one.
+"""
+import numpy as np
+import pandas as pd
+
+
+class binStats():
+
+    def __init__(self, codes, values, binNames, binEdges):
+        """
+        Parameters
+        ----------
+        codes : array-like of integers
+            Combined bin code of each populated bin, i.e. the bin positions
+            raveled in C order over the grid (see numpy.ravel_multi_index).
+
+        values : pandas data frame or dictionary
+            One column (or entry) per statistic, one value per code.
+
+        binNames : list of strings
+            Name of each grid dimension, e.g. ['directionBin', 'speedBin'].
+
+        binEdges : list of numpy arrays
+            Bin edges of each grid dimension, in the order of binNames.
+
+        Returns
+        -------
+        binStats object
+
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        values = pd.DataFrame(values)
+
+        # Keep the bins sorted so lookups can use binary search
+        order = np.argsort(codes, kind='stable')
+        self.codes = codes[order]
+        self.values = values.iloc[order].reset_index(drop=True)
+
+        self.binNames = list(binNames)
+        self.binEdges = [np.asarray(edges, dtype=float) for edges in binEdges]
+        self.binShape = tuple(edges.size-1 for edges in self.binEdges)
+
+    @property
+    def nnz(self):
+        """
+        Number of populated bins
+        """
+        return self.codes.size
+
+    @property
+    def density(self):
+        """
+        Fraction of the grid's bins that are populated
+        """
+        return self.nnz/max(int(np.prod(self.binShape)), 1)
+
+    def __getitem__(self, statistic):
+        """
+        Values of one statistic for the populated bins, in the order of codes
+        """
+        return self.values[statistic].to_numpy()
+
+    def coords(self):
+        """
+        Position of each populated bin along each dimension (tuple of arrays)
+        """
+        return np.unravel_index(self.codes, self.binShape)
+
+    def labels(self):
+        """
+        Lower bounds of the populated bins, as a dictionary keyed by binNames
+        """
+        return {name: edges[pos] for name, edges, pos in zip(self.binNames,
+                                                             self.binEdges,
+                                                             self.coords())}
+
+    def lookup(self, codes, statistic, fill=np.nan):
+        """
+        Values of a statistic for any bins (fill for unpopulated ones)
+
+        Parameters
+        ----------
+        codes : array-like of integers
+            Combined bin codes.
+
+        statistic : string
+            Name of the statistic.
+
+        fill : numeric, optional
+            Value for bins that aren't populated. The default is np.nan.
+
+        Returns
+        -------
+        numpy array
+
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        out = np.full(codes.shape, fill, dtype=float)
+        if self.nnz == 0:
+            return out
+
+        idx = np.clip(np.searchsorted(self.codes, codes), 0, self.nnz-1)
+        found = self.codes[idx] == codes
+        out[found] = self[statistic][idx[found]]
+
+        return out
+
+    def dense(self, statistic, fill=np.nan):
+        """
+        Dense grid of one statistic, for plotting.
+
+        Parameters
+        ----------
+        statistic : string or array-like
+            Name of the statistic, or one value per populated bin.
+
+        fill : numeric, optional
+            Value for bins that aren't populated. The default is np.nan.
+
+        Returns
+        -------
+        numpy array with shape binShape
+
+        """
+        values = self[statistic] if isinstance(statistic, str) else np.asarray(statistic)
+        grid = np.full(int(np.prod(self.binShape)), fill, dtype=float)
+        grid[self.codes] = values
+
+        return grid.reshape(self.binShape)
+
+    def toFrame(self):
+        """
+        Statistics as a data frame indexed by the bin lower bounds
+        """
+        labels = self.labels()
+        df = self.values.copy()
+        if len(self.binNames) == 1:
+            df.index = pd.Index(labels[self.binNames[0]], name=self.binNames[0])
+        else:
+            df.index = pd.MultiIndex.from_arrays([labels[name] for name in self.binNames],
+                                                 names=self.binNames)
+        return df
+
+
+def binStatsFromFrame(df, binNames, binEdges, columns=None):
+    """
+    Sparse statistics from a data frame indexed by bin lower bounds (like
+    the output of energyGain.TNOpowerRatio or averagePower).
+
+    Parameters
+    ----------
+    df : pandas data frame
+        Indexed by the lower bounds of the bins, with one row per bin.
+        Each index level is matched to the dimension in binNames that its
+        name starts with (so 'directionBins' and 'directionBinLowerBound'
+        both match 'directionBin').
+
+    binNames : list of strings
+        Names of the grid dimensions, e.g. ['directionBin', 'speedBin'].
+
+    binEdges : list of numpy arrays
+        Bin edges of each grid dimension, in the order of binNames.
+
+    columns : list of strings, optional
+        Statistics to keep. The default None keeps every column.
+
+    Returns
+    -------
+    binStats object
+        Rows with a missing bin are left out.
+
+    """
+    binEdges = [np.asarray(edges, dtype=float) for edges in binEdges]
+    positions = []
+    valid = np.ones(df.shape[0], dtype=bool)
+
+    for name, edges in zip(binNames, binEdges):
+        prefix = name.removesuffix('Bin').removesuffix('Bins')
+        levels = [level for level in df.index.names
+                  if level is not None and level.startswith(prefix)]
+        if not levels:
+            raise ValueError(f"No index level for '{name}'")
+
+        lowerBounds = np.asarray(df.index.get_level_values(levels[0]), dtype=float)
+        pos = np.clip(np.searchsorted(edges[:-1], lowerBounds), 0, edges.size-2)
+        missing = np.isnan(lowerBounds)
+        if np.any(~missing & (edges[pos] != lowerBounds)):
+            raise ValueError(f"'{levels[0]}' has values that aren't lower bounds of the bins")
+
+        valid &= ~missing
+        positions.append(pos)
+
+    codes = np.ravel_multi_index([pos[valid] for pos in positions],
+                                 tuple(edges.size-1 for edges in binEdges))
+    if np.unique(codes).size != codes.size:
+        raise ValueError("df must have one row per bin")
+    values = df if columns is None else df[columns]
+
+    return binStats(codes, values.loc[valid].reset_index(drop=True), binNames, binEdges)
@@ -10,11 +10,22 @@ and uncertainty on these metrics
 from flasc.dataframe_operations import dataframe_manipulations as dfm
 from timeit import default_timer
 import re
+import sys
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import numpy as np
 import seaborn as sns
 import pandas as pd
+from windClimate import windClimate, histogramPMF, histogramPMFnd
+from powerMatrix import powerMatrix, sortedTimeIndex, timeSlice, timeValue
+from binStats import binStatsFromFrame
+from powerGrid import powerGrid
+from pmfGrid import speedGridRange
+from powerStats import powerStats
+from qualityMask import qualityMask
+from scadaQuery import scadaQuery
+from resampleScada import resampleScada
+from resultCube import resultCube
 pd.options.mode.chained_assignment = None
 
 
@@ -27,12 +38,16 @@ class energyGain():
                  speedBins=None,
                  wdColScada='wd',
                  wsColScada='ws',
+                 otherBins=None,
                  wind=None,
                  wdColWind=None,
                  wsColWind=None,
                  testTurbines=[],
                  referenceTurbines=[],
-                 useReference=True):
+                 useReference=True,
+                 compact=False,
+                 clusterBins=False,
+                 resample=None):
         """
         Creates an energyGain object
 
@@ -72,10 +87,17 @@ class energyGain():
             'true' wind direction.
             Defaults to 'ws' (the column output by other FLASC functionality)
 
-        wind: pandas dataframe
+        otherBins : dictionary, optional
+            Bin edges for any other scada columns to stratify by (e.g. 
+            turbulence intensity, stability class or hour of day), keyed by
+            column name. See setBins. The default None only uses direction 
+            and speed.
+
+        wind: pandas dataframe or windClimate
             data frame with a column for wind direction measurements and/or a 
             column for mind speed measurements, taken at (assumed uniform) 
-            time stamps
+            time stamps. Can also be a windClimate object, which can be shared
+            by many energyGain objects (see setWind).
 
         wdColWind : string
             Name of the wind direction column in the wind condition time series
@@ -96,6 +118,25 @@ class energyGain():
             This will only be used if a method is called without specifying useReference in the call.
             The default is True.
 
+        compact : boolean, optional
+            Whether to store the data in compact types to save memory: 
+            float32 power, categorical control mode and turbine labels, and 
+            categorical wind condition bin columns backed by int16 codes. 
+            Sums and variances are still accumulated in float64. 
+            See setCompact and memoryReport. The default is False.
+
+        clusterBins : boolean, optional
+            Whether to sort the rows of the power matrix by wind condition bin
+            and control mode, so that per-bin work on the power matrix (see 
+            powerMatrix.binRows and binPowerQuantiles) gets each bin's rows as
+            one contiguous slice instead of searching all rows for every bin. 
+            See turbinePowerMatrix. The default is False.
+
+        resample : time difference (e.g. '10min'), optional
+            Averages the scada data over fixed windows of this length before
+            anything else is done with it (see setScada). 
+            The default None uses the scada data as is.
+
         Returns
         -------
         energyGain object
@@ -103,36 +144,57 @@ class energyGain():
         # Object attributes
         self.scada = None
         self.scadaLong = None
-        self.pmfJoint = None
-        self.pmfSpeed = None
-        self.pmfDirection = None
         self.testTurbines = None
         self.referenceTurbines = None
         self.allTurbines = None
         self.directionBins = None
         self.speedBins = None
+        self.otherBins = {}
         self.upstream = None
         self.wind = wind
+        self.wdColWind = wdColWind
+        self.wsColWind = wsColWind
+        self.gridSteps = None
         self.useReference = useReference
+        self.compact = compact
+        self.clusterBins = clusterBins
+        # windClimate built from self.wind or self.scada when no 
+        # windClimate object is provided (see __windClimate__)
+        self.__ownClimate__ = None
+        # Binned scada data, built on demand and shared by every method 
+        # that needs it (see binAdder and __invalidateBinned__)
+        self.__binned__ = {}
+        # Per-row data quality flags (see qualityFlags) and the flags
+        # every calculation requires or excludes (see setQualityFilter)
+        self.__quality__ = None
+        self.__qualityBins__ = {}
+        self.qualityRequire = []
+        self.qualityExclude = []
+        # Time stamp range of the data used for calculations (see setTimeRange)
+        self.timeRange = None
+        self.__timeIndex__ = None
+        # Wind time series columns matched to the scada rows (see alignWind)
+        self.windAlignment = None
+        self.__alignedWind__ = None
         
 
         # Setting attributes
-        self.setScada(scada, wdColScada, wsColScada)
+        self.setScada(scada, wdColScada, wsColScada, resample=resample)
         self.setTest(testTurbines)
         self.setReference(referenceTurbines)
         self.setUpstream(upstream)
-        # Calculates the pmf based on speed and direction bins
-        # and updates the PMF attribute
+        # PMFs for these bins are calculated lazily (see pmfJoint)
         self.setBins(directionBins=directionBins,
                      speedBins=speedBins,
                      wdColWind=wdColWind,
-                     wsColWind=wsColWind)
+                     wsColWind=wsColWind,
+                     otherBins=otherBins)
                      
         self.setWind(wind,
                      wdColWind=wdColWind,
                      wsColWind=wsColWind)
 
-    def setScada(self, df, wdCol='wd', wsCol='ws'):
+    def setScada(self, df, wdCol='wd', wsCol='ws', resample=None):
         """
         Setter method for scada data object attribute
 
@@ -149,12 +211,31 @@ class energyGain():
             name of the column that contains the 'reference'
             or 'consensus' wind speed data.
 
+        resample : time difference (e.g. '10min' or '1min'), optional
+            Averages the scada data over fixed windows of this length (see
+            resampleScada), e.g. to turn 1 Hz data into 10-minute averages.
+            wdCol and any 'wd_XXX' turbine direction columns are averaged as 
+            unit vectors, other numeric columns arithmetically, and control 
+            mode takes the most common value in each window.
+            The default None uses the data as is.
+
         Returns
         -------
         None.
 
         """
+        if df is not None and resample is not None:
+            wdCols = [wdCol] + [colname for colname in list(df) if re.match(r'^wd_\d+', colname)]
+            df = resampleScada(df, resample, wdCols=wdCols)
+
+        if df is not None and self.compact:
+            df = self.__compactScada__(df)
+
         self.scada = df
+        self.__quality__ = None
+        self.__timeIndex__ = None
+        self.__alignedWind__ = None
+        self.__invalidateBinned__()
         self.setWD(wdCol)
         self.setWS(wsCol)
 
@@ -163,20 +244,54 @@ class energyGain():
             # Infer the list of all turbines from the power columns in the data frame
             self.allTurbines = [int(re.sub("\D+", "", colname))
                                 for colname in list(df) if re.match('^pow_\d+', colname)]
-
-            # If there is no dedicated long term wind data frame,
-            # use this new scada data to calculate bin frequencies
-            if self.wind is None:
-                self.pmf = self.pmfCalculator(df,
-                                              speedBins=self.speedBins,
-                                              directionBins=self.directionBins)
         else:
             self.allTurbines = None
-            if self.wind is None:
-                self.pmf = None
+
+        # If there is no dedicated long term wind data frame,
+        # bin frequencies come from the scada data, so forget the old ones
+        if self.wind is None:
+            self.__ownClimate__ = None
+
+        return None
+
+    def setCompact(self, compact=True):
+        """
+        Turns the compact memory mode on or off (see the compact argument of
+        the constructor). Turning it on converts the scada data that's 
+        already stored; turning it off only affects data set afterwards.
+
+        Parameters
+        ----------
+        compact : boolean, optional
+            The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.compact = compact
+        if compact and self.scada is not None:
+            self.scada = self.__compactScada__(self.scada)
+        self.__invalidateBinned__()
 
         return None
 
+    def __compactScada__(self, df):
+        """
+        Shallow copy of scada data with float32 power columns and a 
+        categorical control mode column. Wind direction and speed are left
+        alone so rows don't change bins.
+        """
+        df = df.copy(deep=False)
+        for colname in list(df):
+            if re.match('^pow_\d+', colname) and df[colname].dtype != np.float32:
+                df[colname] = df[colname].astype(np.float32)
+        if 'control_mode' in df and not isinstance(df['control_mode'].dtype, pd.CategoricalDtype):
+            df['control_mode'] = df['control_mode'].astype('category')
+
+        return df
+
     def setUpstream(self, df):
         """
         Updates the upstream object attribute
@@ -199,15 +314,56 @@ class energyGain():
     def setWind(self,
                   dfWind,
                   wdColWind='wd',
-                  wsColWind='ws'):
+                  wsColWind='ws',
+                  gridSteps=None):
+
+        """
+        Updates the long term wind condition time series used for the PMFs.
+        PMFs are recalculated (lazily) the next time they are needed.
+
+        Parameters
+        ----------
+        dfWind : pandas dataframe or windClimate
+            data frame with a column for wind direction measurements and/or a 
+            column for mind speed measurements, taken at (assumed uniform) 
+            time stamps. None means the scada data will be used instead.
+            A windClimate object is used by reference: its PMFs are shared
+            with every other energyGain object using it, and wdColWind, 
+            wsColWind and gridSteps are taken from it instead.
+
+        wdColWind : string, optional
+            Name of the wind direction column in the wind condition time series
+
+        wsColWind : string, optional
+            Name of the wind speed column in the wind condition time series
+
+        gridSteps : tuple of 2 floats, optional
+            (direction step, speed step) of a fine grid to histogram the wind
+            time series on once (see pmfGrid). PMFs for any bins that line up 
+            with this grid are then read from it instead of re-histogramming
+            the time series, e.g. (0.1, 0.05). 
+            The default None always histograms the time series.
+
+        Returns
+        -------
+        None.
+
+        """
+        if isinstance(dfWind, windClimate):
+            wdColWind = dfWind.wdColWind
+            wsColWind = dfWind.wsColWind
+            gridSteps = dfWind.gridSteps
 
         self.wind = dfWind
-        # Calculates the pmf based on speed and direction bins
-        # and updates the PMF attribute
-        self.setBins(directionBins=self.directionBins,
-                     speedBins=self.speedBins,
-                     wdColWind=wdColWind,
-                     wsColWind=wsColWind)
+        self.wdColWind = wdColWind
+        self.wsColWind = wsColWind
+        self.gridSteps = gridSteps
+        self.__ownClimate__ = None
+
+        # Bins on aligned wind columns have to be rebuilt from the new series
+        if self.__alignedWind__ is not None:
+            self.__alignedWind__ = None
+            self.__invalidateBinned__()
 
         return None
 
@@ -229,6 +385,7 @@ class energyGain():
         """
 
         self.wdCol = colname
+        self.__invalidateBinned__()
         return None
 
     def setWS(self, colname):
@@ -247,6 +404,7 @@ class energyGain():
 
         """
         self.wsCol = colname
+        self.__invalidateBinned__()
 
         return None
 
@@ -255,11 +413,14 @@ class energyGain():
                 speedBins=None,
                 wdColWind=None,
                 wsColWind=None,
+                otherBins=None,
                 plot=False):
         """
-        Updates the object attributes for speed and direction bins,
-        re-calculates the pmf based on these updates, and updates the PMF 
-        attribute
+        Updates the object attributes for speed and direction bins 
+        (and the bins of any other variables).
+        The PMFs for these bins are calculated the first time they are needed
+        (see pmfJoint, pmfDirection, pmfSpeed) and remembered, 
+        so switching back to previously used bins is free.
 
         Parameters
         ----------
@@ -288,6 +449,14 @@ class energyGain():
             Name of the wind speed column in the wind condition time series
             Defaults to None in case you  want to ignore speed
 
+        otherBins : dictionary, optional
+            Bin edges (left edge inclusive, right edge exclusive, monotonic
+            INCREASING) for any other scada columns to stratify by, keyed by
+            column name, e.g. {'ti': np.array([0, 0.06, 0.1, 0.2])}. 
+            Each adds a '{column}Bin' dimension to the wind condition bins, 
+            which are combined into one bin code (see __binVars__). 
+            The default None means only direction and speed are used.
+
         plot : boolean, optional
             Whether you want to plot the experimental distribution using these wind bins.
             The default is False.
@@ -301,38 +470,15 @@ class energyGain():
         # Update default object attributes
         self.speedBins = speedBins
         self.directionBins = directionBins
+        self.otherBins = {col: np.asarray(edges, dtype=float)
+                          for col, edges in (otherBins or {}).items()}
+        self.__invalidateBinned__(binsOnly=True)
 
-        # If there is no dedicated long term wind condition time series,
-        # calculate PMF based on the data
-        if self.wind is None:
-            df = self.scada
-            wdColWind = self.wdCol
-            wsColWind = self.wsCol
-        else:
-            df = self.wind
-
-        # Calculate marginal and/or joint PMFs
-        if directionBins is not None:
-            # Marginal direction PMF
-            self.pmfDirection = self.pmfCalculator(dfWind=df,
-                                                   speedBins=None,
-                                                   directionBins=directionBins,
-                                                   wdColWind=wdColWind,
-                                                   wsColWind=None)
-            if speedBins is not None:
-                # Joint PMF
-                self.pmfJoint = self.pmfCalculator(dfWind=df,
-                                                   speedBins=speedBins,
-                                                   directionBins=directionBins,
-                                                   wdColWind=wdColWind,
-                                                   wsColWind=wsColWind)
-        else:
-            # Marginal Speed PMF
-            self.pmfSpeed = self.pmfCalculator(dfWind=df,
-                                               speedBins=speedBins,
-                                               directionBins=None,
-                                               wdColWind=None,
-                                               wsColWind=wsColWind)
+        # Only relevant if there is a dedicated long term wind time series
+        if wdColWind is not None:
+            self.wdColWind = wdColWind
+        if wsColWind is not None:
+            self.wsColWind = wsColWind
 
         # Plot the wind rose for the experimental data
         if plot:
@@ -342,6 +488,27 @@ class energyGain():
 
         return None
 
+    def __binVars__(self):
+        """
+        Every binned variable, in the order their bin positions are combined
+        into one bin code: direction, speed, then the other bins.
+
+        Returns
+        -------
+        list of tuples
+            (bin column name, scada column, bin edges)
+
+        """
+        binVars = []
+        if self.directionBins is not None:
+            binVars.append(('directionBin', self.wdCol, self.directionBins))
+        if self.speedBins is not None:
+            binVars.append(('speedBin', self.wsCol, self.speedBins))
+        for col, edges in self.otherBins.items():
+            binVars.append((f'{col}Bin', col, edges))
+
+        return binVars
+
     def setReference(self, lst):
         """
         Updates the list of reference turbines
@@ -360,6 +527,7 @@ class energyGain():
         """
         self.referenceTurbines = lst
         self.referenceTurbines.sort()
+        self.__invalidateBinned__(turbinesOnly=True)
         return None
 
     def setTest(self, lst):
@@ -380,6 +548,7 @@ class energyGain():
         """
         self.testTurbines = lst
         self.testTurbines.sort()
+        self.__invalidateBinned__(turbinesOnly=True)
         return None
 
     def pmfCalculator(self,
@@ -387,7 +556,8 @@ class energyGain():
                       speedBins=None,
                       directionBins=None,
                       wdColWind=None,
-                      wsColWind=None):
+                      wsColWind=None,
+                      returnDense=False):
         """
         Calculates the joint or marginal PMF based on the provided 
         wind condition bins
@@ -422,6 +592,12 @@ class energyGain():
             Name of the wind speed column in the wind condition time series
             Defaults to None in case you  want to ignore speed
 
+        returnDense : boolean, optional
+            Only used for the joint PMF. Whether to return the frequencies as a
+            dense 2D array (directions along the rows, speeds along the columns)
+            together with the bin edges instead of a pandas Series.
+            The default is False.
+
         Returns
         -------
         freq : pandas Series 
@@ -430,84 +606,104 @@ class energyGain():
             The support of the PMF may exclude some wind or speed values that
             were not contained in the bin specifications.
             This gets handled by a helper function.
+            If returnDense=True and both bins are given, this is instead a 
+            dictionary with the 2D array of frequencies ('pmf') and the 
+            edges used for each axis ('directionBins', 'speedBins').
+        """
+
+        return histogramPMF(dfWind=dfWind,
+                            speedBins=speedBins,
+                            directionBins=directionBins,
+                            wdColWind=wdColWind,
+                            wsColWind=wsColWind,
+                            returnDense=returnDense)
+
+    @property
+    def pmfJoint(self):
         """
+        Joint wind direction/speed PMF for the current bins (see pmfCalculator),
+        or None if either set of bins is missing. Calculated on first access.
+        """
+        if self.directionBins is None or self.speedBins is None:
+            return None
+        return self.__windClimate__().pmf(directionBins=self.directionBins,
+                                          speedBins=self.speedBins)
 
-        # If the correspinding bin variable for one of these is also None,
-        # then this update will get ignored
-        if wdColWind is None:
-            wdColWind = 'wd'
-        if wsColWind is None:
-            wsColWind = 'ws'
+    @property
+    def pmfDirection(self):
+        """
+        Marginal wind direction PMF for the current direction bins 
+        (see pmfCalculator), or None if there are no direction bins.
+        Calculated on first access.
+        """
+        if self.directionBins is None:
+            return None
+        return self.__windClimate__().pmf(directionBins=self.directionBins)
 
-        # This ensures that the frequencies are with respect to all wind data
-        # and not just the data that falls in the boundaries of the wind
-        # condition bins specified.
-        N = dfWind.shape[0]
+    @property
+    def pmfSpeed(self):
+        """
+        Marginal wind speed PMF for the current speed bins 
+        (see pmfCalculator), or None if there are no speed bins.
+        Calculated on first access.
+        """
+        if self.speedBins is None:
+            return None
+        return self.__windClimate__().pmf(speedBins=self.speedBins)
 
-        # PMF calculations
-        if speedBins is None:  # speed is None
+    @property
+    def pmfND(self):
+        """
+        Joint PMF over every binned variable (see __binVars__), as an array 
+        with one dimension per variable, or None if there are no bins. 
+        Frequencies come from the long term wind data if it has all of the 
+        binned columns, otherwise from the scada data. Calculated on first access.
+        """
+        binVars = self.__binVars__()
+        if not binVars:
+            return None
+
+        climate = self.__windClimate__()
+        windCols = {'directionBin': climate.wdColWind, 'speedBin': climate.wsColWind}
+        columns = [windCols.get(binCol, col) for binCol, col, edges in binVars]
+        edges = [edges for binCol, col, edges in binVars]
+
+        if climate.hasColumns(columns):
+            return climate.pmfND(columns, edges)
+
+        key = ('pmfND',)
+        if key not in self.__binned__:
+            self.__binned__[key] = histogramPMFnd(self.scada,
+                                                  [col for binCol, col, e in binVars],
+                                                  edges)
+        return self.__binned__[key]
+
+    def __windClimate__(self):
+        """
+        The windClimate that bin frequencies are calculated from: 
+        the one provided to setWind, or one built from the long term wind 
+        time series if there is one, otherwise from the scada data.
+        """
+        if isinstance(self.wind, windClimate):
+            return self.wind
 
-            if directionBins is None:  # Both are None
-                print("Specify wind direction and/or speed bins")
-                freqs = None
-            else:  # Just speed is None
-                
-                # Calculate PMF based on only wind direction
-                hist = np.histogram(self.wind[wdColWind],
-                                    bins=directionBins)
-                freqs = pd.Series(hist[0]/N)
-                freqs.index = hist[1][:-1] #omit rightmost edge
-                freqs.index.names = ["directionBins"]
-        else:  # Speed is not None
-
-            if directionBins is None:  # speed is not none but direction is none
-
-                # Assign bin edges
-                # Just the direction bin is None, so
-                # Calculate the PMF based on only wind speed
-                hist = np.histogram(self.wind[wsColWind],
-                                    bins=speedBins)
-                freqs = pd.Series(hist[0]/N)
-                freqs.index = hist[1][:-1]#omit rightmost edge
-                freqs.index.names = ["speedBins"]
-
-            else:  # Neither are None
-                # Get bin counts
-                hist = np.histogram2d(x=self.wind[wdColWind],
-                                      y=self.wind[wsColWind],
-                                      bins=(directionBins,
-                                            speedBins))
-
-                freqs = np.full(shape=0, fill_value=0)
-                speeds = np.full(shape=0, fill_value=np.nan)
-                directions = np.full(shape=0, fill_value=np.nan)
-
-                # Calculating joint PMF while keeping track of each variable
-                d = 0
-                nDirs = hist[1].size-1
-                nSpeeds = hist[2].size-1
-
-                while d < nDirs:
-                    direction = hist[1][d]
-                    s = 0
-
-                    while s < nSpeeds:
-                        speed = hist[2][s]
-                        # Calculate bin frequency
-                        prop = hist[0][d][s]/N
-                        freqs = np.concatenate((freqs, [prop]))
-                        speeds = np.concatenate((speeds, [speed]))
-                        directions = np.concatenate((directions, [direction]))
-                        s += 1
-
-                    d += 1
-
-                freqs = pd.Series(freqs)
-                freqs.index = pd.MultiIndex.from_arrays([directions, speeds],
-                                                       names=('directionBins',
-                                                              'speedBins'))
-
-        return freqs
+        if self.wind is None:
+            df, wdCol, wsCol, gridSteps = self.scada, self.wdCol, self.wsCol, None
+        else:
+            df, wdCol, wsCol, gridSteps = self.wind, self.wdColWind, self.wsColWind, self.gridSteps
+
+        climate = self.__ownClimate__
+        # The scada columns (or wind columns set by setBins) may have changed
+        if (climate is None or climate.wind is not df
+                or climate.wdColWind != (wdCol or 'wd')
+                or climate.wsColWind != (wsCol or 'ws')):
+            climate = windClimate(df,
+                                  wdColWind=wdCol,
+                                  wsColWind=wsCol,
+                                  gridSteps=gridSteps)
+            self.__ownClimate__ = climate
+
+        return climate
 
     # ***
     def pmf(self, direction=None, speed=None, df=None):
@@ -527,75 +723,266 @@ class energyGain():
             Speed value that you want to know the probability of occurence for.
             The default is None in case you only want to use direction.
 
+        df : pandas data frame, optional
+            Data frame with the wind condition bins as its index or MultiIndex
+            (e.g. the output of computeAll or TNOpowerRatio). If provided, 
+            direction and speed are ignored and the probabilities of every row
+            are returned at once (see pmfLookup).
+
         Returns
         -------
-        float
+        float or numpy array
             the estimated probability of occurence for the wind condition 
-            bin that contains the provided specs.
+            bin that contains the provided specs, or an array with one 
+            probability per row of df. Wind conditions outside of the 
+            wind condition bins have a probability of zero.
 
         """
         
         if df is not None:
-            vals = np.full(0,0)
-            for index in df.index:
-                if len(index)==2:
-                    prob = self.pmf(index[0],index[1])
-                else:
-                    # Fix this later!!
-                    None
-                vals = np.concatenate((vals,[prob]))
-            return vals
-                    
-        
+            return self.pmfLookup(index=df.index)
+
         if direction is None and speed is None:
             return 'Specify a speed and/or direction'
 
         if direction is not None:
+            direction = [direction]
+        if speed is not None:
+            speed = [speed]
 
-            dirIdx = np.digitize(direction, self.directionBins)-1
-            directionBin = self.directionBins[dirIdx]
-            key = directionBin
-            print("Direction bin:", directionBin)
-            pmf = self.pmfDirection
+        return self.pmfLookup(directions=direction, speeds=speed)[0]
 
-        if speed is not None:
-            speedIdx = np.digitize(speed, self.speedBins)-1
-            speedBin = self.speedBins[speedIdx]
-            key = speedBin
-            print("Speed bin:", speedBin)
-            pmf=self.pmfSpeed
-
-        if direction is not None and speed is not None:
-            if dirIdx >= (self.directionBins.size-1) and speedIdx >= (self.speedBins.size-1):
-                "Wind conditions out of bounds of the bins"
-                return None
-
-            if dirIdx >= (self.directionBins.size-1):
-                "Direction out of bounds of wind condition bins,"
-            # Joint PMF
-            key = (directionBin, speedBin)
-            pmf=self.pmfJoint
-
-        try:
-            prob = pmf[key]
-        except KeyError:
-            print("Frequencies not computed for this wind condition.")
-            print("Re-define wind condition bins to include this wind condition.")
-            prob = np.nan
-
-        return prob
+    def pmfLookup(self, directions=None, speeds=None, index=None):
+        """
+        Vectorized PMF lookup for many wind conditions at once. 
+        Uses the joint PMF if both directions and speeds are provided, 
+        otherwise the appropriate marginal PMF.
+
+        Parameters
+        ----------
+        directions : array-like of numerics, optional
+            Wind directions (or direction bin lower bounds) to look up.
+            The default is None in case you only want to use speed.
+
+        speeds : array-like of numerics, optional
+            Wind speeds (or speed bin lower bounds) to look up. Must be the same
+            length as directions if both are provided.
+            The default is None in case you only want to use direction.
+
+        index : pandas Index or MultiIndex, optional
+            Wind condition bins to look up, e.g. the index of the data frame 
+            returned by computeAll. Levels whose names start with 'direction'
+            or 'speed' are used as directions and speeds respectively. 
+            Levels named '{column}Bin' for any of the otherBins are looked 
+            up in the joint PMF of all the binned variables (pmfND), summed 
+            over the variables that aren't in the index.
+            An unnamed single-level index is matched to whichever bins are set.
+            Overrides directions and speeds.
+
+        Returns
+        -------
+        probs : numpy array
+            Probability of the wind condition bin containing each provided 
+            wind condition, aligned with the input. Wind conditions outside
+            of the wind condition bins (or missing) have a probability of zero.
+
+        """
+        if index is not None:
+            directions = None
+            speeds = None
+            for level, name in enumerate(index.names):
+                if name is None:
+                    continue
+                if name.startswith('direction'):
+                    directions = index.get_level_values(level)
+                elif name.startswith('speed'):
+                    speeds = index.get_level_values(level)
+
+            otherLevels = {col: name for name in index.names if name is not None
+                           for col in self.otherBins if name.startswith(f'{col}Bin')}
+            if otherLevels:
+                return self.__pmfLookupND__(index, directions, speeds, otherLevels)
+
+            if directions is None and speeds is None and index.nlevels == 1:
+                if self.directionBins is not None:
+                    directions = index
+                else:
+                    speeds = index
+
+        if directions is None and speeds is None:
+            raise ValueError("Specify wind directions and/or speeds")
+
+        # Position of each wind condition in the bins and whether it's inside them
+        if directions is not None:
+            dirIdx, dirValid = self.__binPositions__(directions, self.directionBins)
+        if speeds is not None:
+            speedIdx, speedValid = self.__binPositions__(speeds, self.speedBins)
+
+        if directions is not None and speeds is not None:
+            # Joint PMF is ordered with speed varying fastest within each direction
+            pmf = np.asarray(self.pmfJoint, dtype=float)
+            flatIdx = dirIdx*(self.speedBins.size-1) + speedIdx
+            valid = dirValid & speedValid
+        elif directions is not None:
+            pmf = np.asarray(self.pmfDirection, dtype=float)
+            flatIdx = dirIdx
+            valid = dirValid
+        else:
+            pmf = np.asarray(self.pmfSpeed, dtype=float)
+            flatIdx = speedIdx
+            valid = speedValid
+
+        probs = np.zeros(flatIdx.size, dtype=float)
+        probs[valid] = pmf[flatIdx[valid]]
+
+        return probs
+
+    def __pmfLookupND__(self, index, directions, speeds, otherLevels):
+        """
+        pmfLookup for an index that includes some of the otherBins.
+        Uses one raveled position per row in the (marginalized) pmfND.
+        """
+        pmf = self.pmfND
+        values = {'directionBin': directions, 'speedBin': speeds}
+        values.update({f'{col}Bin': index.get_level_values(name)
+                       for col, name in otherLevels.items()})
+
+        positions = []
+        absent = []
+        valid = np.ones(len(index), dtype=bool)
+        for axis, (binCol, col, edges) in enumerate(self.__binVars__()):
+            if values.get(binCol) is None:
+                absent.append(axis)
+                continue
+            idx, inBins = self.__binPositions__(values[binCol], edges)
+            positions.append(np.where(inBins, idx, 0))
+            valid &= inBins
+
+        # Marginalize over the variables the index doesn't have
+        pmf = pmf.sum(axis=tuple(absent)) if absent else pmf
+        flatIdx = np.ravel_multi_index(positions, pmf.shape)
+
+        probs = np.zeros(flatIdx.size, dtype=float)
+        probs[valid] = pmf.ravel()[flatIdx[valid]]
+
+        return probs
+
+    def alignWind(self, columns=None, tolerance=None, direction='backward',
+                  timeColWind='time', suffix='Wind'):
+        """
+        Matches the wind time series (e.g. met mast or lidar data, see 
+        setWind) to the scada rows by time stamp, like pandas.merge_asof, 
+        and attaches its columns to the scada rows so they can be binned.
+        The result is stored on the object (and rebuilt if the scada data or
+        wind time series change), and binAdder adds the aligned columns, 
+        named with the suffix, to the binned data. To bin on the wind 
+        series' direction instead of the scada's, use e.g. setWD('wdWind').
+
+        Parameters
+        ----------
+        columns : list of strings, optional
+            Columns of the wind time series to attach. 
+            The default None means the wind direction and speed columns.
+
+        tolerance : time difference (e.g. '5min'), optional
+            Largest time difference to match. Rows with no wind time stamp
+            that close get missing values. The default None means any.
+
+        direction : string, optional
+            'backward' (the last wind time stamp at or before each scada time
+            stamp), 'forward' (the first at or after) or 'nearest'.
+            The default is 'backward'.
+
+        timeColWind : string, optional
+            Name of the time stamp column of the wind time series. If it 
+            isn't a column, the index is used. The default is 'time'.
+
+        suffix : string, optional
+            Added to the wind column names, so they don't clash with the 
+            scada columns. The default is 'Wind' (e.g. 'wd' -> 'wdWind').
+
+        Returns
+        -------
+        pandas data frame
+            The aligned columns, with the scada data's index.
+
+        """
+        if self.wind is None:
+            raise ValueError("There is no wind time series to align (see setWind)")
+
+        alignment = {'columns': None if columns is None else list(columns),
+                     'tolerance': tolerance,
+                     'direction': direction,
+                     'timeColWind': timeColWind,
+                     'suffix': suffix}
+        if alignment != self.windAlignment:
+            self.windAlignment = alignment
+            self.__alignedWind__ = None
+            self.__invalidateBinned__()
+
+        return self.__windColumns__()
+
+    def __windColumns__(self):
+        """
+        The wind time series columns aligned to the scada rows 
+        (see alignWind), or None if there aren't any. Built on demand.
+        """
+        if self.windAlignment is None or self.wind is None or self.scada is None:
+            return None
+
+        if self.__alignedWind__ is None:
+            spec = self.windAlignment
+            df = self.__windClimate__().align(self.scada['time'],
+                                              columns=spec['columns'],
+                                              timeCol=spec['timeColWind'],
+                                              tolerance=spec['tolerance'],
+                                              direction=spec['direction'])
+            df.columns = [f"{col}{spec['suffix']}" for col in df.columns]
+            df.index = self.scada.index
+            self.__alignedWind__ = df
+
+        return self.__alignedWind__
+
+    def __binPositions__(self, values, edges):
+        """
+        Finds the (left edge inclusive) bin that each value falls in.
+
+        Parameters
+        ----------
+        values : array-like of numerics
+            Values to place in the bins.
+
+        edges : numpy array of numerics
+            Monotonic increasing bin edges.
+
+        Returns
+        -------
+        idx : numpy array of integers
+            Bin number of each value (0 is the leftmost bin). 
+            Only meaningful where valid is True.
+
+        valid : numpy array of booleans
+            Whether each value falls inside the bins.
+
+        """
+        values = np.asarray(values, dtype=float)
+        idx = np.searchsorted(edges, values, side='right') - 1
+        # Missing values get sorted past the last edge, so they are invalid too
+        valid = (idx >= 0) & (idx < edges.size-1)
+
+        return idx, valid
 
     def scadaLonger(self, turbs='all', df=None):
         
         
-        if df is None:
-            df = self.scada.copy()
-        
         if turbs == 'all':
             turbs = self.allTurbines
       
         powerColumns = ["pow_{:03.0f}".format(number) for number in turbs]
         keep = powerColumns + [self.wdCol, self.wsCol, "time"]
+        if df is None:
+            # Only the columns that get melted are read
+            df = self.query(filterBins=False, columns=keep).collect()
         df = df[keep].melt(value_vars=powerColumns,
                       value_name="power",
                       var_name="turbine", 
@@ -608,82 +995,499 @@ class energyGain():
                  filterBins = False):
         """
         Add columns for the lower bounds of the wind condition bins to scada data
-        (or a copy of the scada data)
+        (or a copy of the scada data), along with integer bin codes.
+        Uses the object's directionBins and speedBins attributes.
+
+        For each set of bins, two columns are added: 'directionBin' 
+        (or 'speedBin'), the lower bound of the bin each row falls in, and 
+        'directionBinCode' (or 'speedBinCode'), the bin number starting at 0 
+        for the leftmost bin. Rows outside of the bins (or with missing wind 
+        conditions) have a code of -1 and a missing lower bound.
 
         Parameters
         ----------
-        stepVars : string or list of strings, optional
-            The variable(s) you want to use for the wind condition bins.
-            Only options are "speed" and "direction". 
-            The default is both: ["direction", "speed"].
-
-        directionBins : numpy array of numerics, optional, optional
-            Edges for the wind direction in degrees. Bin membership is 
-            left edge inclusive, right edge exclusive. The default None means
-            we will ignore wind direction for any calculations that use 
-            wind conditions. Must be monotonic INCREASING (bins that share an 
-            edge do not need to have their edges be repeated) and on [0,360).
-            Rightmost bin edge is expected and will be used as a maximum cutoff for direction.
-            Defaults to using object's directionBins attribute.
-
-        speedBins : numpy array of numerics, optional, optional
-            Edges for the wind speed in m/s. Bin membership is 
-            left edge inclusive, right edge exclusive. The default None means
-            we will ignore wind speed for any calculations that use 
-            wind conditions. Must be monotonic INCREASING (bins that share an 
-            edge do not need to have their edges be repeated) and on [0,360).
-            Rightmost bin edge is expected and will be used as a maximum cutoff for speed.
-            Defaults to using object's speedBins attribute.
-
         copy : boolean, optional
             Whether you want to return a copy of the df with the new 
             wind condition columns (copy=True) or add the wind condition bins 
-            to the df directly (copy=False). The default is True.
+            to the df directly (copy=False). The copy is shallow: the existing
+            columns are shared with the scada data rather than duplicated.
+            The default is True.
 
-        df : pandas data frame, optional
-            The data frame to add the wind condition bins to. 
-            Defaults to using object's scada attribute
+        filterBins : boolean, optional
+            Whether to drop the rows that are outside of the wind condition 
+            bins or excluded by the quality filter (True, see qualityRows) or 
+            keep them, with rows outside the bins marked with a bin code of 
+            -1 (False). The default is False.
 
         Returns
         -------
         df : pandas Data Frame
             scada data wit the new wind condition bin columns.
+            When copy=True, this is the object's stored binned data, which
+            is only rebuilt after the scada data, bins, wind condition columns
+            or turbine lists change. Treat it as read-only.
 
         """
 
-        stepVars = []
-        
-        df = self.scada.copy()
-        
-        if self.directionBins is not None:
-            df = df.loc[(df[self.wdCol] < self.directionBins[-1]) &
-                        (df[self.wdCol] >= self.directionBins[0])]
-            stepVars.append('direction')
-            
-           
-        if self.speedBins is not None:
-            df = df.loc[(df[self.wsCol] < self.speedBins[-1]) &
-                        (df[self.wsCol] >= self.speedBins[0])]
-            stepVars.append('speed')
+        if copy and ('binAdder', filterBins) in self.__binned__:
+            return self.__binned__[('binAdder', filterBins)]
+
+        if copy and filterBins:
+            # Derived from the unfiltered binned data so there's only one binning pass
+            df = self.binAdder(copy=True, filterBins=False)
+            # Same rows as query and binAll: in the bins and through the quality filter
+            df = df.loc[self.qualityRows(require=self.__binFlags__())]
+            self.__binned__[('binAdder', True)] = df
+            return df
 
+        binVars = self.__binVars__()
 
-        if 'direction' in stepVars:
-            df['directionBin'] = self.directionBins[np.digitize(df[self.wdCol],
-                                                                bins=self.directionBins)]
-        if 'speed' in stepVars:
-            df['speedBin'] = self.speedBins[np.digitize(df[self.wsCol],
-                                                        bins=self.speedBins)]
-        
-        if not filterBins:
-            df = df.merge(self.scada, how='outer')
+        if copy:
+            # New columns don't affect self.scada, and nothing is duplicated
+            df = self.scada.copy(deep=False)
+        else:
+            df = self.scada
+
+        # Wind time series columns matched to each row can be binned too
+        aligned = self.__windColumns__()
+        if aligned is not None:
+            for col in aligned:
+                df[col] = aligned[col].to_numpy()
+
+        # One mask for every set of bins
+        inBins = np.ones(df.shape[0], dtype=bool)
+
+        for binCol, windCol, edges in binVars:
+            edges = np.asarray(edges, dtype=float)
+            codes = self.__binCodes__(df[windCol], edges)
+            inBins &= codes >= 0
+
+            df[f'{binCol}Code'] = codes
+            if self.compact:
+                # Lower bounds share the codes instead of a float column
+                df[binCol] = pd.Categorical.from_codes(codes, categories=edges[:-1])
+            else:
+                df[binCol] = np.where(codes >= 0, edges[codes], np.nan)
+
+        if filterBins:
+            df = df.loc[inBins]
         
         # Update self.scada if desired
         if not copy:
             self.scada = df
+            self.__invalidateBinned__()
+        else:
+            self.__binned__[('binAdder', filterBins)] = df
 
         # Return the copy with the bin columns
         return df
 
+    def query(self, filterBins=True, controlMode=None, columns=None):
+        """
+        Lazy query plan (see scadaQuery) over the binned scada data.
+        Nothing is binned, filtered or copied until the plan is collected, 
+        and then only the selected rows of the selected columns are copied.
+
+        Parameters
+        ----------
+        filterBins : boolean, optional
+            Whether to leave out the rows that are outside of the wind 
+            condition bins. The default is True. Rows that don't pass the 
+            quality filter (see setQualityFilter) are always left out.
+
+        controlMode : string, optional
+            Only keep the rows in this control mode. 
+            The default None keeps every control mode.
+
+        columns : list of strings, optional
+            Columns to read. The default None reads the columns the analysis
+            methods use: 'time', 'control_mode', the bin lower bound and 
+            code columns, and the power of the reference and test turbines.
+
+        Returns
+        -------
+        scadaQuery object
+
+        """
+        if columns is None:
+            columns = [col for col in ['time', 'control_mode'] if col in self.scada]
+            for binCol, windCol, edges in self.__binVars__():
+                columns += [binCol, f'{binCol}Code']
+            columns += ["pow_{:03.0f}".format(number) for number in self.referenceTurbines + self.testTurbines]
+
+        require = self.__filterFlags__()
+        if filterBins:
+            require += self.__binFlags__()
+        if controlMode is not None:
+            require.append(f'mode:{controlMode}')
+
+        return scadaQuery(lambda: self.binAdder(copy=True, filterBins=False),
+                          mask=self.qualityFlags,
+                          columns=columns,
+                          require=require,
+                          exclude=self.qualityExclude)
+
+    def qualityFlags(self):
+        """
+        Per-row data quality bitmask of the scada data (see qualityMask), 
+        with these flags kept up to date:
+            '{bin column}InRange' (e.g. 'directionBinInRange') for each 
+            binned variable, 'mode:{control mode}' for each control mode, 
+            and 'pow_XXXValid' (power isn't missing) for each turbine,
+            plus 'inTimeRange' while a time range is set (see setTimeRange).
+        Flags added with setQualityFlag are kept too. Only the bin flags
+        are updated when the bins change.
+
+        Returns
+        -------
+        qualityMask object
+
+        """
+        if self.__quality__ is None:
+            mask = qualityMask(self.scada.shape[0])
+            if 'control_mode' in self.scada:
+                codes, modes = pd.factorize(np.asarray(self.scada['control_mode']), sort=True)
+                for code, mode in enumerate(modes):
+                    mask.setFlag(f'mode:{mode}', codes == code)
+            for number in self.allTurbines:
+                colname = "pow_{:03.0f}".format(number)
+                mask.setFlag(f'{colname}Valid', self.scada[colname].notna().to_numpy())
+            if self.timeRange is not None:
+                mask.setFlag('inTimeRange', self.timeRows(*self.timeRange))
+            self.__quality__ = mask
+            self.__qualityBins__ = {}
+
+        mask = self.__quality__
+
+        # Bin flags come from the stored bin codes, and only change with the bins
+        binFlags = {f'{binCol}InRange': (windCol, np.asarray(edges, dtype=float).tobytes())
+                    for binCol, windCol, edges in self.__binVars__()}
+        for name in list(self.__qualityBins__):
+            if name not in binFlags:
+                mask.dropFlag(name)
+                del self.__qualityBins__[name]
+        stale = [name for name, spec in binFlags.items() if self.__qualityBins__.get(name) != spec]
+        if stale:
+            df = self.binAdder(copy=True, filterBins=False)
+            for name in stale:
+                binCol = name.removesuffix('InRange')
+                mask.setFlag(name, np.asarray(df[f'{binCol}Code']) >= 0)
+                self.__qualityBins__[name] = binFlags[name]
+
+        return mask
+
+    def __binFlags__(self):
+        """
+        Names of the quality flags for being inside each set of bins
+        """
+        return [f'{binCol}InRange' for binCol, windCol, edges in self.__binVars__()]
+
+    def setQualityFlag(self, name, values):
+        """
+        Adds (or replaces) a user defined quality flag, such as curtailment 
+        or icing. Rows with the flag can then be excluded (or required) 
+        everywhere with setQualityFilter.
+
+        Parameters
+        ----------
+        name : string
+            Name of the flag.
+
+        values : string or array-like of booleans
+            Name of a boolean scada column, or whether each scada row has the flag.
+
+        Returns
+        -------
+        None.
+
+        """
+        if isinstance(values, str):
+            values = self.scada[values]
+        self.qualityFlags().setFlag(name, np.asarray(values))
+
+        # Results filtered on this flag are out of date
+        if name in self.qualityRequire or name in self.qualityExclude:
+            self.__invalidateBinned__(turbinesOnly=True)
+
+        return None
+
+    def setQualityFilter(self, require=None, exclude=None):
+        """
+        Sets the quality flags used to select scada rows for every 
+        calculation (average power, power ratios, TNO statistics and the 
+        power index). Filtering is a bitwise AND of the row masks, so no 
+        data is copied until the selected rows are aggregated.
+
+        Parameters
+        ----------
+        require : list of strings, optional
+            Flags each row must have, e.g. ['pow_000Valid'].
+            The default None requires nothing.
+
+        exclude : list of strings, optional
+            Flags rows must not have, e.g. ['curtailment', 'icing'].
+            The default None excludes nothing.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.qualityRequire = list(require or [])
+        self.qualityExclude = list(exclude or [])
+        self.__invalidateBinned__(turbinesOnly=True)
+
+        return None
+
+    def qualityRows(self, require=(), exclude=()):
+        """
+        Boolean mask of the scada rows that pass the object's quality filter
+        (see setQualityFilter) plus any extra flags.
+
+        Parameters
+        ----------
+        require : list of strings, optional
+            Extra flags each row must have. The default is none.
+
+        exclude : list of strings, optional
+            Extra flags rows must not have. The default is none.
+
+        Returns
+        -------
+        numpy array of booleans
+
+        """
+        return self.qualityFlags().select(require=list(require) + self.__filterFlags__(),
+                                          exclude=list(exclude) + self.qualityExclude)
+
+    def __filterFlags__(self):
+        """
+        Flags every calculation requires: the quality filter's and the time range's
+        """
+        return self.qualityRequire + (['inTimeRange'] if self.timeRange is not None else [])
+
+    def timeRows(self, start=None, end=None):
+        """
+        Which scada rows have start <= time < end, found by binary search on
+        a sorted index of the 'time' column (built once per scada data).
+
+        Parameters
+        ----------
+        start : time stamp (or string), optional
+            The default None means from the first time stamp.
+
+        end : time stamp (or string), optional
+            The default None means through the last time stamp.
+
+        Returns
+        -------
+        numpy array of booleans
+
+        """
+        if self.__timeIndex__ is None:
+            self.__timeIndex__ = sortedTimeIndex(self.scada['time'].to_numpy())
+        order, times = self.__timeIndex__
+
+        rows = np.zeros(self.scada.shape[0], dtype=bool)
+        rows[order[timeSlice(times, start, end)]] = True
+
+        return rows
+
+    def setTimeRange(self, start=None, end=None):
+        """
+        Only uses the scada data with start <= time < end for every 
+        calculation (e.g. to compute computeAll or TNOpowerRatio for one 
+        week or month of a campaign), without making a new energyGain 
+        object or re-binning the data.
+
+        Parameters
+        ----------
+        start : time stamp (or string), optional
+            The default None means from the first time stamp.
+
+        end : time stamp (or string), optional
+            The default None means through the last time stamp.
+            Setting both to None uses all of the data again.
+
+        Returns
+        -------
+        None.
+
+        """
+        if start is None and end is None:
+            self.timeRange = None
+            if self.__quality__ is not None:
+                self.__quality__.dropFlag('inTimeRange')
+        else:
+            self.timeRange = (start, end)
+            self.qualityFlags().setFlag('inTimeRange', self.timeRows(start, end))
+        self.__invalidateBinned__(turbinesOnly=True)
+
+        return None
+
+    def memoryReport(self):
+        """
+        Memory used by each stored stage of the analysis, next to an estimate 
+        of what the same stage takes with the standard (non-compact) types. 
+        Stages that haven't been built yet are left out.
+
+        Returns
+        -------
+        pandas data frame
+            One row per stage ('scada', 'binned scada', 'power matrix', 
+            'long export') with the 'bytes', 'standardBytes' and 
+            'savedBytes' columns. For unfiltered binned scada only the added 
+            bin columns are counted, since the rest is shared with the scada data.
+
+        """
+        stages = {}
+        if self.scada is not None:
+            stages['scada'] = [self.__columnBytes__(self.scada[col]) for col in list(self.scada)]
+
+        for key, stored in self.__binned__.items():
+            if key[0] == 'binAdder':
+                # Without filtering, everything but the bin columns is shared with the scada data
+                cols = list(stored) if key[1] else [col for col in list(stored)
+                                                     if col.endswith('Bin') or col.endswith('BinCode')]
+                stage = 'binned scada'
+            elif key[0] == 'powerMatrix':
+                stages.setdefault('power matrix', []).extend(self.__powerMatrixBytes__(stored))
+                continue
+            elif key[0] == 'binAll' and key[-1]:
+                cols = list(stored)
+                stage = 'long export'
+            else:
+                continue
+            stages.setdefault(stage, []).extend(self.__columnBytes__(stored[col]) for col in cols)
+
+        report = pd.DataFrame({'bytes': [sum(b[0] for b in sizes) for sizes in stages.values()],
+                               'standardBytes': [sum(b[1] for b in sizes) for sizes in stages.values()]},
+                              index=pd.Index(list(stages), name='stage'))
+        report['savedBytes'] = report['standardBytes'] - report['bytes']
+
+        return report
+
+    def __columnBytes__(self, col):
+        """
+        Bytes used by one column, and the estimated bytes for the same 
+        column in the standard types (float64 numbers, Python string labels).
+        Strings are counted the way pandas counts them with deep=True.
+        """
+        actual = col.memory_usage(index=False, deep=True)
+
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            categories = col.cat.categories
+            if not pd.api.types.is_numeric_dtype(categories):
+                # Each row would hold a pointer to its own string
+                counts = np.bincount(col.cat.codes[col.cat.codes >= 0], minlength=categories.size)
+                sizes = np.array([sys.getsizeof(c) for c in categories])
+                standard = 8*col.size + int(np.sum(counts*sizes))
+            else:
+                standard = 8*col.size
+        elif col.dtype == np.float32:
+            standard = 2*actual
+        else:
+            standard = actual
+
+        return actual, standard
+
+    def __powerMatrixBytes__(self, pm):
+        """
+        Same as __columnBytes__, for each array of a powerMatrix
+        """
+        sizes = [(pm.power.nbytes, pm.power.size*8),
+                 (pm.binCode.nbytes, pm.binCode.nbytes),
+                 (pm.controlModeCodes.nbytes, pm.controlModeCodes.nbytes)]
+        sizes.extend((codes.nbytes, codes.nbytes) for codes in pm.binCodes.values())
+        if pm.time is not None:
+            sizes.append((pm.time.nbytes, pm.time.nbytes))
+
+        return sizes
+
+    def __invalidateBinned__(self, turbinesOnly=False, binsOnly=False):
+        """
+        Forgets the stored binned scada data (see binAdder and binAll), so it 
+        is rebuilt the next time it is needed. Called by every setter that
+        changes what the binned data would look like.
+
+        Parameters
+        ----------
+        turbinesOnly : boolean, optional
+            Whether only the turbine lists or row filters changed, in which 
+            case the wind condition bins themselves are still valid and only 
+            results that depend on the turbines or filtered rows are 
+            forgotten. The default is False.
+
+        binsOnly : boolean, optional
+            Whether only the wind condition bins changed, in which case 
+            results that don't depend on the bins (the power index, see 
+            powerIndex) are kept. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        if turbinesOnly:
+            # The unfiltered binned data only has the bin codes, which are 
+            # still valid; the filtered rows are not
+            keep = ('pmfND', ('binAdder', False))
+        elif binsOnly:
+            keep = ('powerGrid',)
+        else:
+            keep = ()
+
+        for key in list(self.__binned__):
+            if key[0] not in keep and key not in keep:
+                del self.__binned__[key]
+
+        # The bin quality flags come from the binned data (see qualityFlags)
+        if not (turbinesOnly or binsOnly):
+            self.__qualityBins__ = {}
+
+        return None
+
+    def __binCodes__(self, values, edges):
+        """
+        Integer bin number of each value (left edge inclusive, 
+        right edge exclusive), or -1 if it is outside of the bins or missing.
+
+        Parameters
+        ----------
+        values : array-like of numerics
+            Wind conditions to bin.
+
+        edges : numpy array of numerics
+            Monotonic increasing bin edges.
+
+        Returns
+        -------
+        codes : numpy array of integers
+            The smallest integer type that can hold the number of bins.
+
+        """
+        values = np.asarray(values, dtype=float)
+        nBins = edges.size - 1
+        widths = np.diff(edges)
+
+        if np.allclose(widths, widths[0]):
+            # Uniform bins: arithmetic instead of a binary search
+            with np.errstate(invalid='ignore'):
+                codes = np.floor((values - edges[0])/widths[0])
+            codes = np.clip(np.nan_to_num(codes, nan=-1), -1, nBins).astype(np.int64)
+            # Rounding can put values that sit on an edge in the neighboring bin
+            inside = (codes >= 0) & (codes < nBins)
+            codes[inside & (values < edges[np.clip(codes, 0, nBins)])] -= 1
+            codes[inside & (values >= edges[np.clip(codes+1, 0, nBins)])] += 1
+        else:
+            codes = np.searchsorted(edges, values, side='right') - 1
+
+        # Outside of the bins (missing values are sorted past the last edge)
+        codes[(codes < 0) | (codes >= nBins) | np.isnan(values)] = -1
+
+        dtype = np.int16 if nBins <= np.iinfo(np.int16).max else np.int32
+        return codes.astype(dtype)
+
     # def averagePower(self,
     #                  turbineList='all', 
     #                  controlMode=True,
@@ -1007,15 +1811,12 @@ class energyGain():
         retainControlMode: boolean, whether to keep the control mode column (True) or not (False)
         """
 
+        # Reuse the stored result if nothing has changed since it was built
+        key = ('binAll', retainControlMode, retainTurbineLabel, filterBins, long)
+        if key in self.__binned__:
+            return self.__binned__[key]
 
-        # Add bins to the data
-        df = self.binAdder(copy=True, filterBins=filterBins)
-        
-        stepVarCols = []
-        if self.directionBins is not None:
-            stepVarCols.append('directionBin')
-        if self.speedBins is not None:
-            stepVarCols.append('speedBin')
+        stepVarCols = [binCol for binCol, windCol, edges in self.__binVars__()]
             
         # Exclude undesirable turbines
         powerColumns = ["pow_{:03.0f}".format(number) for number in self.referenceTurbines + self.testTurbines]
@@ -1023,34 +1824,140 @@ class energyGain():
         colsToKeep.append("time")
         if retainControlMode:
             colsToKeep.append("control_mode")
-        df = df.loc[:,colsToKeep + powerColumns]
+
+        # Only the kept columns of the kept rows are copied
+        df = self.query(filterBins=filterBins, columns=colsToKeep + powerColumns).collect()
         
         df['totalFarmPower'] = df.loc[:,powerColumns].sum(1, skipna=True)
         
         if not long:
             
+            self.__binned__[key] = df
             return df
         
-        colsToKeep.append("totalFarmPower")
-        
-        # Pivot Longer
-        dfLong = df.melt(id_vars=colsToKeep,
-                         value_name="power", var_name="turbine")
+        # Long format is only an export of the power matrix
+        dfLong = self.turbinePowerMatrix(filterBins=filterBins).toLong(retainControlMode=retainControlMode,
+                                                                       retainTurbineLabel=retainTurbineLabel)
 
-        # Convert turbine numbers from strings to integers
-        dfLong["turbine"] = dfLong["turbine"].str.removeprefix("pow_")
-        dfLong["turbine"] = dfLong["turbine"].to_numpy(dtype=int)
+        self.__binned__[key] = dfLong
 
-        # Add turbine label column
-        if retainTurbineLabel:
-            labels = [(num in self.testTurbines) for num in dfLong["turbine"]]
-            labels = np.where(labels, "test", "reference")
-            dfLong["turbineLabel"] = labels
-            colsToKeep.append("turbineLabel")
+        return dfLong
 
-        
+    def turbinePowerMatrix(self, filterBins=True):
+        """
+        Binned scada data as a powerMatrix: a contiguous (time x turbine) 
+        array of reference and test turbine power, along with the wind 
+        condition bin codes, control mode codes and time stamps. 
+        All of the aggregation methods work on this instead of a long frame.
 
-        return dfLong
+        Parameters
+        ----------
+        filterBins : boolean, optional
+            Whether to leave out the rows that are outside of the wind 
+            condition bins. The default is True. Rows that don't pass the 
+            quality filter (see setQualityFilter) are always left out.
+
+        Returns
+        -------
+        powerMatrix object
+            Stored on the object until the scada data, bins, wind condition
+            columns or turbine lists change. Treat it as read-only.
+            Clustered by bin (see powerMatrix.clusterByBin) if the 
+            clusterBins attribute is True.
+
+        """
+        key = ('powerMatrix', filterBins)
+        if key not in self.__binned__:
+            binVars = [(binCol, edges) for binCol, windCol, edges in self.__binVars__()]
+
+            # Only the rows and columns the matrix needs are copied
+            cols = [col for col in ['time', 'control_mode'] if col in self.scada]
+            cols += [f'{name}Code' for name, edges in binVars]
+            cols += ["pow_{:03.0f}".format(number) for number in self.referenceTurbines + self.testTurbines]
+            df = self.query(filterBins=filterBins, columns=cols).collect()
+
+            self.__binned__[key] = powerMatrix(df,
+                                               referenceTurbines=self.referenceTurbines,
+                                               testTurbines=self.testTurbines,
+                                               binVars=binVars,
+                                               compact=self.compact)
+
+        if self.clusterBins:
+            self.__binned__[key].clusterByBin()
+
+        return self.__binned__[key]
+
+    def powerStatistics(self, filterBins=True):
+        """
+        Sufficient statistics of the binned power data (see powerStats):
+        for every wind condition bin, control mode and turbine, the number of
+        power observations, their mean and sum of squared deviations, and 
+        for every pair of test turbines their co-moment. Collected in one 
+        pass over the power matrix; averagePower, computeAll and the TNO 
+        statistics are all derived from it.
+
+        Parameters
+        ----------
+        filterBins : boolean, optional
+            Whether to leave out the rows that are outside of the wind 
+            condition bins (see turbinePowerMatrix). The default is True.
+
+        Returns
+        -------
+        powerStats object
+            Stored on the object until the power matrix is rebuilt. 
+            Treat it as read-only.
+
+        """
+        key = ('powerStats', filterBins)
+        if key not in self.__binned__:
+            self.__binned__[key] = powerStats(self.turbinePowerMatrix(filterBins=filterBins))
+
+        return self.__binned__[key]
+
+    def binPowerQuantiles(self, quantiles=(0.05, 0.5, 0.95), controlMode=None, turbineLabel='test'):
+        """
+        Quantiles of the power observations of a group of turbines in each
+        wind condition bin. Unlike averages and variances these can't be 
+        derived from the sufficient statistics (see powerStatistics), so 
+        each bin's rows are read from the power matrix (see 
+        powerMatrix.binRows), as contiguous slices if the clusterBins 
+        attribute is True.
+
+        Parameters
+        ----------
+        quantiles : list of floats, optional
+            Quantiles between 0 and 1. The default is (0.05, 0.5, 0.95).
+
+        controlMode : string, optional
+            e.g. 'controlled' or 'baseline'. The default None uses every 
+            control mode.
+
+        turbineLabel : string, optional
+            'reference', 'test' or None for all turbines. The default is 'test'.
+
+        Returns
+        -------
+        pandas data frame
+            Indexed by the wind condition bins (only bins with rows in the
+            control mode), with one column per quantile. Missing where a bin
+            has no power observations.
+
+        """
+        pm = self.turbinePowerMatrix(filterBins=True)
+        cols = pm.columns(turbineLabel)
+        quantiles = np.atleast_1d(np.asarray(quantiles, dtype=float))
+
+        codes = np.unique(pm.binCode[(pm.binCode >= 0) & pm.rows(controlMode)])
+        values = np.full((codes.size, quantiles.size), np.nan)
+        for i, code in enumerate(codes):
+            power = np.asarray(pm.power[pm.binRows(code, controlMode), cols], dtype=np.float64)
+            power = power[~np.isnan(power)]
+            if power.size:
+                values[i] = np.quantile(power, quantiles)
+
+        return pd.DataFrame(values, index=pm.binIndex(codes),
+                            columns=pd.Index(quantiles, name='quantile'))
 
     def averagePower(self, 
                       retainControlMode=True, 
@@ -1060,14 +1967,8 @@ class energyGain():
                       dropna=True,
                       returnWide=True):
 
-        featuresToRetain = []
-        stepVarCols = []
-        if self.directionBins is not None:
-            featuresToRetain.append('directionBin')
-            stepVarCols.append('directionBin')
-        if self.speedBins is not None:
-            featuresToRetain.append('speedBin')
-            stepVarCols.append('speedBin')
+        stepVarCols = [binCol for binCol, windCol, edges in self.__binVars__()]
+        featuresToRetain = stepVarCols[:]
 
         if retainControlMode:
             featuresToRetain.append('control_mode')
@@ -1103,12 +2004,18 @@ class energyGain():
         #                                               numObvs=pd.NamedAgg(column="totalPower",
         #                                                                   aggfunc='count'))
         # else:
-            
-        dfLong = self.binAll(retainControlMode=retainControlMode, 
-                              retainTurbineLabel=retainTurbineLabel, 
-                              retainTurbineNumbers=retainTurbineNumbers,
-                              filterBins=filterBins,
-                              long=True)
+
+        # The wide format is filled straight from the per-bin arrays
+        if returnWide:
+            return self.__averagePowerWide__(retainControlMode=retainControlMode,
+                                             retainTurbineLabel=retainTurbineLabel,
+                                             retainTurbineNumbers=retainTurbineNumbers,
+                                             filterBins=filterBins)
+
+        dfGrouped = self.__averagePowerMatrix__(retainControlMode=retainControlMode,
+                                                retainTurbineLabel=retainTurbineLabel,
+                                                retainTurbineNumbers=retainTurbineNumbers,
+                                                filterBins=filterBins)
             
         # if not retainTurbineNumbers:
         #     featuresToRetain.append('turbine')
@@ -1134,42 +2041,315 @@ class energyGain():
         #                                                               aggfunc='count'),
         #                                           numObvs=pd.NamedAgg(column="numObvs",
         #                                                               aggfunc=np.sum))
-        
-        
-        # if retainTurbineNumbers:
-        dfGrouped = dfLong.groupby(by=featuresToRetain).agg(averagePower=pd.NamedAgg(column="power",
-                                                                                     aggfunc=np.nanmean),
-                                                            sumPower=pd.NamedAgg(column="power",
-                                                                                 aggfunc=np.sum),
-                                                           numObvs=pd.NamedAgg(column="power",
-                                                                               aggfunc='count'))
-        # else:
-            
-            # dfTotal = dfLong.groupby(by=featuresToRetain).agg(averagePower=pd.NamedAgg(column="totalFarmPower",
-            #                                                                          aggfunc=np.nanmean),
-            #                                                numObvs=pd.NamedAgg(column="totalFarmPower",
-            #                                                                    aggfunc='count'))
-            
-        
-        # Convert grouping index into columns for easier pivoting
+
+        # Also keep the grouping index as columns
         for var in featuresToRetain:
             dfGrouped[var] = dfGrouped.index.get_level_values(var)
 
-        # Pivot wider
-        if returnWide:
-            optionalCols = list(set(featuresToRetain) - set(stepVarCols))
-            dfGrouped['averagePower'] = dfGrouped['averagePower'].copy()
-            dfGrouped['metric'] = 'averagePower'
-            optionalCols = ['metric'] + optionalCols
-            
-            dfWide = dfGrouped.pivot(columns=optionalCols, index=stepVarCols,
-                                       values='averagePower')
-            
-            return dfWide
+        # # Don't need these columns anymore since they are a part of the multi-index
+        # dfGrouped.drop(columns=colsToKeep, inplace=True)
+        return dfGrouped
+
+    def __averagePowerMatrix__(self,
+                               retainControlMode=True,
+                               retainTurbineLabel=True,
+                               retainTurbineNumbers=False,
+                               filterBins=True):
+        """
+        Average power, sum of power and number of power observations per 
+        wind condition bin (and control mode and turbine label/number), 
+        derived from the sufficient statistics of each turbine (see 
+        powerStatistics), which are summed over each turbine group.
+
+        Returns
+        -------
+        dfGrouped : pandas data frame
+            Indexed by the retained features, with the 'averagePower', 
+            'sumPower' and 'numObvs' columns.
+
+        """
+        ps, binCodes, controlModeCodes, colGroups = self.__averagePowerGroups__(retainControlMode,
+                                                                                retainTurbineLabel,
+                                                                                retainTurbineNumbers,
+                                                                                filterBins)
+
+        binLabels = self.turbinePowerMatrix(filterBins=filterBins).binLabels(binCodes)
+        parts = []
+        for labels, groupSums, groupCounts in colGroups:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                averages = groupSums/groupCounts
+
+            part = pd.DataFrame({'averagePower': np.where(groupCounts > 0, averages, np.nan),
+                                 'sumPower': groupSums,
+                                 'numObvs': groupCounts})
+            for name in ps.binNames:
+                part[name] = binLabels[name]
+            if retainControlMode:
+                part['control_mode'] = ps.controlModes[controlModeCodes]
+            for feature, value in labels.items():
+                part[feature] = value
+            parts.append(part)
+
+        dfGrouped = pd.concat(parts, ignore_index=True)
+
+        featuresToRetain = ps.binNames[:]
+        if retainControlMode:
+            featuresToRetain.append('control_mode')
+        if retainTurbineLabel:
+            featuresToRetain.append('turbineLabel')
+        if retainTurbineNumbers:
+            featuresToRetain.append('turbine')
+
+        dfGrouped = dfGrouped.set_index(featuresToRetain).sort_index()
+
+        return dfGrouped[['averagePower', 'sumPower', 'numObvs']]
+
+    def __averagePowerWide__(self,
+                             retainControlMode=True,
+                             retainTurbineLabel=True,
+                             retainTurbineNumbers=False,
+                             filterBins=True):
+        """
+        Average power per wind condition bin in the wide format of 
+        averagePower(returnWide=True), filled straight from the per-bin 
+        arrays instead of pivoting a long frame.
+
+        Returns
+        -------
+        dfWide : pandas data frame
+            Indexed by the wind condition bins, with one column per
+            ('averagePower', turbine label/number, control mode), in that
+            level order and sorted.
+
+        """
+        ps, binCodes, controlModeCodes, colGroups = self.__averagePowerGroups__(retainControlMode,
+                                                                                retainTurbineLabel,
+                                                                                retainTurbineNumbers,
+                                                                                filterBins)
+
+        # Row of each group in the wide frame
+        bins, rowOfGroup = np.unique(binCodes, return_inverse=True)
+        modeCodes = np.unique(controlModeCodes) if retainControlMode else [None]
+
+        dct = {}
+        for labels, groupSums, groupCounts in colGroups:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                averages = np.where(groupCounts > 0, groupSums/groupCounts, np.nan)
+
+            for code in modeCodes:
+                groups = slice(None) if code is None else controlModeCodes == code
+                column = np.full(bins.size, np.nan)
+                column[rowOfGroup[groups]] = averages[groups]
+                key = ('averagePower',) + tuple(labels.values())
+                dct[key if code is None else key + (ps.controlModes[code],)] = column
+
+        names = ['metric'] + list(colGroups[0][0]) if colGroups else ['metric']
+        if retainControlMode:
+            names.append('control_mode')
+
+        dfWide = pd.DataFrame(dct, index=self.turbinePowerMatrix(filterBins=filterBins).binIndex(bins))
+        dfWide.columns = pd.MultiIndex.from_tuples(list(dct), names=names) if len(names) > 1 \
+            else pd.Index([key[0] for key in dct], name='metric')
+
+        return dfWide.sort_index(axis=1)
+
+    def __averagePowerGroups__(self, retainControlMode, retainTurbineLabel,
+                               retainTurbineNumbers, filterBins):
+        """
+        Power sums and observation counts of every turbine group in every 
+        populated wind condition bin (and control mode), from the sufficient
+        statistics.
+
+        Returns
+        -------
+        tuple
+            (powerStats, combined bin code of each group, control mode code 
+            of each group or None, list of (labels of the turbine group, 
+            power sum of each group, number of observations of each group))
+
+        """
+        ps = self.powerStatistics(filterBins=filterBins)
+
+        # Groups without a control mode are left out, or combined with the 
+        # other groups of the same wind condition bin
+        if retainControlMode:
+            groups = ps.controlModeCodes >= 0
+            binCodes = ps.binCodes[groups]
+            controlModeCodes = ps.controlModeCodes[groups]
+            sums = ps.sums[groups]
+            counts = ps.count[groups]
+        else:
+            stats = ps.stats()
+            binCodes = stats['binCodes']
+            controlModeCodes = None
+            sums = stats['sum']
+            counts = stats['count']
+
+        colGroups = []
+        if retainTurbineNumbers:
+            for j, turbine in enumerate(ps.turbines):
+                labels = {'turbineLabel': ps.turbineLabels[j]} if retainTurbineLabel else {}
+                labels['turbine'] = turbine
+                colGroups.append((labels, slice(j, j+1)))
+        elif retainTurbineLabel:
+            for label in ['reference', 'test']:
+                cols = np.flatnonzero(ps.turbineLabels == label)
+                if cols.size:
+                    colGroups.append(({'turbineLabel': label}, cols))
+        else:
+            colGroups.append(({}, np.arange(ps.turbines.size)))
+
+        colGroups = [(labels,
+                      sums[:, cols].sum(axis=1),
+                      np.rint(counts[:, cols].sum(axis=1)).astype(np.int64))
+                     for labels, cols in colGroups]
+
+        return ps, binCodes, controlModeCodes, colGroups
+
+    def powerCube(self, filterBins=True, retainControlMode=True):
+        """
+        Average power, power sum and number of power observations of the 
+        reference and test turbines as a dense labeled array (see resultCube)
+        over every wind condition bin, control mode and turbine label, filled
+        from the sufficient statistics (see powerStatistics). Power ratios 
+        and AEP gain are computed on its arrays, and data frames are only 
+        made when exporting (see resultCube.toFrame).
+
+        Parameters
+        ----------
+        filterBins : boolean, optional
+            Whether to leave out the rows that are outside of the wind 
+            condition bins (see turbinePowerMatrix). The default is True.
+
+        retainControlMode : boolean, optional
+            Whether to keep the control modes apart. If False, all rows 
+            (also the ones without a control mode) are combined and the cube
+            has no 'control_mode' axis. The default is True.
+
+        Returns
+        -------
+        resultCube object
+            Axes are the binned variables (labeled by the lower bounds of 
+            their bins), 'control_mode', 'turbineLabel' and 'metric' 
+            ('averagePower', 'sumPower', 'numObvs'). Bins without data have
+            missing average power, and are marked in the populated attribute.
+            Stored on the object until the power matrix is rebuilt. 
+            Treat it as read-only.
+
+        """
+        key = ('powerCube', filterBins, retainControlMode)
+        if key in self.__binned__:
+            return self.__binned__[key]
+
+        ps, binCodes, controlModeCodes, colGroups = self.__averagePowerGroups__(retainControlMode,
+                                                                                True,
+                                                                                False,
+                                                                                filterBins)
+        nBins = int(np.prod(ps.binShape))
+        nModes = ps.controlModes.size if retainControlMode else 1
+        cells = binCodes*nModes + (controlModeCodes if retainControlMode else 0)
+
+        sums = np.zeros((nBins*nModes, len(colGroups)))
+        counts = np.zeros((nBins*nModes, len(colGroups)))
+        for j, (labels, groupSums, groupCounts) in enumerate(colGroups):
+            sums[cells, j] = groupSums
+            counts[cells, j] = groupCounts
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = np.where(counts > 0, sums/counts, np.nan)
+
+        shape = ps.binShape + ((nModes,) if retainControlMode else ()) + (len(colGroups), 3)
+        values = np.stack([averages, sums, counts], axis=-1).reshape(shape)
+
+        axes = [(name, edges[:-1]) for name, edges in zip(ps.binNames, ps.binEdges)]
+        if retainControlMode:
+            axes.append(('control_mode', ps.controlModes))
+        axes.append(('turbineLabel', [labels['turbineLabel'] for labels, groupSums, groupCounts in colGroups]))
+        axes.append(('metric', ['averagePower', 'sumPower', 'numObvs']))
+
+        populated = (np.bincount(binCodes, minlength=nBins) > 0).reshape(ps.binShape)
+        self.__binned__[key] = resultCube(values, axes, populated=populated)
+
+        return self.__binned__[key]
+
+    def powerIndex(self, directionStep=1.0, speedStep=0.25):
+        """
+        Per-turbine, per-control mode power statistics on a fine wind 
+        direction x speed grid, as summed-area tables (see powerGrid). 
+        Built with one pass over the scada data and kept when the bins 
+        change, so statistics for any bins that line up with the grid (or any 
+        rectangular sector, see powerGrid.sector) don't rescan the scada data.
+
+        Parameters
+        ----------
+        directionStep : float, optional
+            Width of the fine grid cells for wind direction, in degrees.
+            The default is 1.0.
+
+        speedStep : float, optional
+            Width of the fine grid cells for wind speed, in m/s.
+            The default is 0.25.
+
+        Returns
+        -------
+        powerGrid object
+            Stored on the object until the scada data, wind condition columns
+            or turbine lists change.
+
+        """
+        key = ('powerGrid', directionStep, speedStep)
+        if key not in self.__binned__:
+            rows = self.qualityRows()
+            # The binned data also has any aligned wind time series columns
+            df = self.binAdder(copy=True, filterBins=False)
+            df = df if np.all(rows) else df.loc[rows]
+            # The grid has to cover every row, or fast wind speeds would 
+            # silently go missing from the statistics
+            self.__binned__[key] = powerGrid(df,
+                                             referenceTurbines=self.referenceTurbines,
+                                             testTurbines=self.testTurbines,
+                                             wdCol=self.wdCol,
+                                             wsCol=self.wsCol,
+                                             directionStep=directionStep,
+                                             speedStep=speedStep,
+                                             speedRange=speedGridRange(df[self.wsCol], speedStep))
+        return self.__binned__[key]
+
+    def rebinnedAveragePower(self, directionBins=None, speedBins=None,
+                             directionStep=1.0, speedStep=0.25):
+        """
+        Same as averagePower(returnWide=True) with the default arguments, but
+        read from the power index (see powerIndex) instead of binning the 
+        scada data, so trying many sets of bins costs one pass over the data.
+        The result can go straight into computeAll(dfAvgPower=...).
+        Two edges for each variable give the results for a single sector.
+        Bins that don't line up with the fine grid, or go beyond it, raise a
+        ValueError (use averagePower for those).
+
+        Parameters
+        ----------
+        directionBins : numeric numpy array, optional
+            Edges for the wind direction in degrees, on the fine grid. 
+            The default None uses the directionBins attribute.
+
+        speedBins : numeric numpy array, optional
+            Edges for the wind speed in m/s, on the fine grid. 
+            The default None uses the speedBins attribute.
+
+        directionStep, speedStep : floats, optional
+            Fine grid of the power index (see powerIndex).
 
-        # # Don't need these columns anymore since they are a part of the multi-index
-        # dfGrouped.drop(columns=colsToKeep, inplace=True)
-        return dfGrouped
+        Returns
+        -------
+        pandas data frame
+
+        """
+        if directionBins is None:
+            directionBins = self.directionBins
+        if speedBins is None:
+            speedBins = self.speedBins
+
+        return self.powerIndex(directionStep, speedStep).averagePower(directionBins, speedBins)
 
     # Fix comments later
     def computeAll(self,useReference=True, dfAvgPower=None, dropna=True):
@@ -1193,12 +2373,8 @@ class energyGain():
             Nicely formatted dataframe that can go directly into aepGain.
         """
         if dfAvgPower is None:
-            dfAvgPower = self.averagePower(retainControlMode=True,
-                                     retainTurbineLabel=True,
-                                     retainTurbineNumbers=False,
-                                     filterBins=True,
-                                     dropna=dropna,
-                                     returnWide=True)
+            cube = self.powerCube(filterBins=True)
+            return self.__powerRatioFrame__(cube, self.__powerRatios__(cube, useReference))
 
         # Sometimes the order of the labels in this tuple seem to change and I haven't figured out why. This should fix the order.
         dfAvgPower = dfAvgPower.reorder_levels(["metric","turbineLabel", "control_mode"], axis=1)
@@ -1227,6 +2403,192 @@ class energyGain():
 
         return dfAvgPower
 
+    def __powerRatios__(self, cube, useReference=True):
+        """
+        Power ratios of every wind condition bin, as in computeAll, on the 
+        arrays of a power cube (see powerCube).
+
+        Returns
+        -------
+        dict of numpy arrays
+            'powerRatioBaseline', 'powerRatioControl', 'changeInPowerRatio'
+            and 'percentPowerGain', each shaped like the wind condition bins.
+
+        """
+        avgPower = cube.sel(metric='averagePower')
+
+        ratios = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name, mode in [('powerRatioBaseline', 'baseline'), ('powerRatioControl', 'controlled')]:
+                ratios[name] = avgPower.sel(turbineLabel='test', control_mode=mode)
+                if useReference:
+                    ratios[name] = ratios[name]/avgPower.sel(turbineLabel='reference', control_mode=mode)
+
+            ratios['changeInPowerRatio'] = ratios['powerRatioControl'] - ratios['powerRatioBaseline']
+            ratios['percentPowerGain'] = ratios['changeInPowerRatio']/ratios['powerRatioControl']
+
+        return ratios
+
+    def __powerRatioFrame__(self, cube, ratios):
+        """
+        Exports a power cube and its power ratios (see __powerRatios__) in 
+        the format of computeAll: one row per populated wind condition bin,
+        with the ('averagePower', turbine label, control mode) columns 
+        followed by the power ratio columns.
+        """
+        df = cube.sel(metric=['averagePower']).toFrame(columnAxes=['metric', 'turbineLabel', 'control_mode'])
+        for name, values in ratios.items():
+            df[name] = values[cube.populated]
+
+        return df
+
+    def rollingPowerRatio(self, window, step=None, start=None, end=None, useReference=None):
+        """
+        Power ratios of each wind condition bin (as in computeAll) for windows
+        of time sliding through the campaign, e.g. weekly, to watch the 
+        estimates converge or spot controller faults. The per-bin sums and
+        counts are updated by adding the rows that enter each window and 
+        subtracting the ones that leave it, so the whole trend costs about 
+        one pass over the data.
+
+        Parameters
+        ----------
+        window : time difference (e.g. '7D' or pd.Timedelta(days=7))
+            Length of each window. Numeric if the time stamps are numeric.
+
+        step : time difference, optional
+            Time between the starts of consecutive windows.
+            The default None means the window length (windows don't overlap).
+
+        start : time stamp, optional
+            Start of the first window. The default None means the first time stamp.
+
+        end : time stamp, optional
+            Data at or after end isn't used. The default None means all the data.
+
+        useReference : boolean, optional
+            Whether the power ratios divide by the reference turbines' 
+            average power. The default None uses the useReference attribute.
+
+        Returns
+        -------
+        pandas data frame
+            Indexed by 'windowStart' and the wind condition bins (only bins
+            with data in the window), with the 'powerRatioBaseline', 
+            'powerRatioControl', 'changeInPowerRatio', 'percentPowerGain', 
+            'numObvsBaseline' and 'numObvsControl' (test turbine power 
+            observations) columns.
+
+        """
+        if useReference is None:
+            useReference = self.useReference
+
+        pm = self.turbinePowerMatrix(filterBins=True)
+        order, times = pm.timeIndex()
+        limits = timeSlice(times, start, end)
+        order, times = order[limits], times[limits]
+
+        if times.dtype.kind == 'M':
+            window = pd.Timedelta(window).to_timedelta64()
+            step = window if step is None else pd.Timedelta(step).to_timedelta64()
+            zero = np.timedelta64(0, 'ns')
+        else:
+            step = window if step is None else step
+            zero = 0
+
+        # The windows would never move past the data otherwise
+        if not (window > zero and step > zero):
+            raise ValueError("window and step must be positive")
+
+        # One group per bin and control mode, plus one for rows without a control mode
+        nModes = pm.controlModes.size
+        nBins = int(np.prod(pm.binShape))
+        nGroups = nBins*nModes + 1
+        modes = pm.controlModeCodes[order].astype(np.int64)
+        groups = np.where(modes >= 0, pm.binCode[order]*nModes + modes, nGroups - 1)
+
+        # Each turbine group's power is reduced to one sum and count per row
+        labels = ['reference', 'test'] if useReference else ['test']
+        rowSums = {}
+        rowCounts = {}
+        for label in labels:
+            block = pm.power[:, pm.columns(label)]
+            rowSums[label] = np.nansum(block, axis=1, dtype=np.float64)[order]
+            rowCounts[label] = np.sum(~np.isnan(block), axis=1)[order]
+
+        sums = {label: np.zeros(nGroups) for label in labels}
+        counts = {label: np.zeros(nGroups) for label in labels}
+        rowsInGroup = np.zeros(nGroups)
+
+        def update(first, last, sign):
+            if last > first:
+                g = groups[first:last]
+                rowsInGroup[:] += sign*np.bincount(g, minlength=nGroups)
+                for label in labels:
+                    sums[label] += sign*np.bincount(g, weights=rowSums[label][first:last], minlength=nGroups)
+                    counts[label] += sign*np.bincount(g, weights=rowCounts[label][first:last], minlength=nGroups)
+
+        baseline = pm.controlModeCode('baseline')
+        controlled = pm.controlModeCode('controlled')
+
+        def ratio(mode):
+            # Average test power over average reference power in one control mode
+            if mode < 0:
+                return np.full(nBins, np.nan), np.zeros(nBins)
+            groupsOfMode = np.arange(nBins)*nModes + mode
+            with np.errstate(invalid='ignore', divide='ignore'):
+                averages = {label: sums[label][groupsOfMode]/counts[label][groupsOfMode] for label in labels}
+            if useReference:
+                return averages['test']/averages['reference'], counts['test'][groupsOfMode]
+            return averages['test'], counts['test'][groupsOfMode]
+
+        parts = []
+        lo = hi = 0
+        windowStart = times[0] if (start is None and times.size) else timeValue(start, times)
+        while times.size and windowStart <= times[-1]:
+            newLo = int(np.searchsorted(times, windowStart, side='left'))
+            newHi = int(np.searchsorted(times, windowStart + window, side='left'))
+
+            if newLo >= hi:
+                # No overlap with the last window
+                for arr in [rowsInGroup] + list(sums.values()) + list(counts.values()):
+                    arr[:] = 0
+                update(newLo, newHi, 1)
+            else:
+                update(lo, newLo, -1)
+                update(hi, newHi, 1)
+                # Exact zeros for groups that emptied out
+                for label in labels:
+                    sums[label][counts[label] == 0] = 0
+            lo, hi = newLo, newHi
+
+            populated = np.flatnonzero(rowsInGroup[:-1].reshape(nBins, nModes).sum(axis=1) > 0)
+            if populated.size:
+                ratioBaseline, countBaseline = ratio(baseline)
+                ratioControl, countControl = ratio(controlled)
+                part = pd.DataFrame({'powerRatioBaseline': ratioBaseline[populated],
+                                     'powerRatioControl': ratioControl[populated],
+                                     'numObvsBaseline': countBaseline[populated].astype(int),
+                                     'numObvsControl': countControl[populated].astype(int)})
+                part['windowStart'] = windowStart
+                for name, values in pm.binLabels(populated).items():
+                    part[name] = values
+                parts.append(part)
+
+            windowStart = windowStart + step
+
+        if not parts:
+            return pd.DataFrame(columns=['powerRatioBaseline', 'powerRatioControl',
+                                         'changeInPowerRatio', 'percentPowerGain',
+                                         'numObvsBaseline', 'numObvsControl'])
+
+        df = pd.concat(parts, ignore_index=True).set_index(['windowStart'] + pm.binNames)
+        df['changeInPowerRatio'] = df['powerRatioControl'] - df['powerRatioBaseline']
+        df['percentPowerGain'] = df['changeInPowerRatio']/df['powerRatioControl']
+
+        return df[['powerRatioBaseline', 'powerRatioControl', 'changeInPowerRatio',
+                   'percentPowerGain', 'numObvsBaseline', 'numObvsControl']]
+
     def aep(self, windDirectionSpecs=None, windSpeedSpecs=None,
             hours=8760, useReference=None, df=None):
 
@@ -1302,61 +2664,242 @@ class energyGain():
 
         
 
-        # Calculate nicely formatted df if needed
+        # Calculate nicely formatted df if needed, with the terms from the 
+        # arrays of the power cube rather than the columns of the frame
         if df is None:
-            df = self.computeAll(useReference=useReference,
-                                 dfAvgPower=df, 
-                                 dropna=dropna)
+            cube = self.powerCube(filterBins=True)
+            ratios = self.__powerRatios__(cube, useReference)
+            df = self.__powerRatioFrame__(cube, ratios)
+            gainTerms, denomTerms = self.__aepGainTermsCube__(cube, ratios,
+                                                              aepMethod=aepMethod,
+                                                              useReference=useReference)
+        else:
+            gainTerms, denomTerms = self.__aepGainTerms__(df,
+                                                          aepMethod=aepMethod,
+                                                          useReference=useReference,
+                                                          dropna=dropna)
+
+        # Probability of each wind condition bin, looked up once for all rows
+        binDensity = self.pmf(df=df)
+
+        df["aepGainContribution"] = np.multiply(gainTerms, binDensity)
+
+        if not absolute:
+            # 'hours' here doesn't really represent hours,
+            # this is just so that our percentages are reported nicely
+            hours = 100
+            denom = np.nansum(np.multiply(denomTerms, binDensity))
+            df["aepGainContribution"] = df["aepGainContribution"]*(1/denom)
+
+        aep = hours*np.nansum(df[('aepGainContribution', '', '')])
+        # print(aep)
+        return (df, aep)
+
+    def __aepGainTerms__(self, df, aepMethod=1, useReference=True, dropna=False):
+        """
+        Per-bin terms of the AEP gain formulas before they are weighted by 
+        the PMF: AEP gain is the PMF-weighted sum of gainTerms, and the 
+        relative AEP gain divides that by the PMF-weighted sum of denomTerms.
+
+        Parameters
+        ----------
+        df : pandas data frame as returned by computeAll
+
+        aepMethod : int, optional
+            See aepGain. The default is 1.
+
+        useReference : boolean, optional
+            See aepGain. The default is True.
 
+        dropna : boolean, optional
+            Only used by aepMethod 2. See averagePower. The default is False.
+
+        Returns
+        -------
+        gainTerms : numpy array
+            One entry per row of df.
+
+        denomTerms : numpy array
+            One entry per row of df.
+
+        """
         # Different AEP formulas
         if aepMethod == 1:
             if useReference:
-                df["aepGainContribution"] = np.multiply(np.multiply(df[('averagePower', 'test', 'baseline')],
-                                                                    df[('percentPowerGain', '', '')]),
-                                                        self.pmf(df=df))
+                gainTerms = np.multiply(df[('averagePower', 'test', 'baseline')],
+                                        df[('percentPowerGain', '', '')])
             else:
-                df["aepGainContribution"] = np.multiply(
-                    df["changeInPowerRatio"], self.pmf(df=df))
+                gainTerms = df[('changeInPowerRatio', '', '')]
 
-            if not absolute:
-                denomTerms = np.multiply(
-                    df[('averagePower', 'test', 'baseline')], self.pmf(df=df))
+            denomTerms = df[('averagePower', 'test', 'baseline')]
 
         else:
             
-            dfRef = self.averagePower(useReference=useReference,
-                                    dfAvgPower=None,
-                                    dropna=dropna,
-                                    retainControlMode=False)
+            dfRef = self.averagePower(dropna=dropna,
+                                      retainControlMode=False)
             dfRef = dfRef.reorder_levels(["metric","turbineLabel"], axis=1)
             
-            avgPowerRef = np.full(0,0)
-            for index in df.index:
-                p = dfRef.loc[index, ('averagePower','reference')]
-                avgPowerRef = np.concatenate((avgPowerRef,[p]))
-                
-            
-            
-            
+            # Reference average power for each wind condition bin in df
+            avgPowerRef = dfRef[('averagePower','reference')].reindex(df.index)
 
-            df["aepGainContribution"] = np.multiply(np.multiply(avgPowerRef,
-                                                                df[('changeInPowerRatio', '', '')]),
-                                                    self.pmf(df=df))
-            if not absolute:
-                denomTerms = np.multiply(np.multiply(avgPowerRef,
-                                                     df[('powerRatioBaseline', '', '')]),
-                                         self.pmf(df=df))
+            gainTerms = np.multiply(avgPowerRef,
+                                    df[('changeInPowerRatio', '', '')])
+            denomTerms = np.multiply(avgPowerRef,
+                                     df[('powerRatioBaseline', '', '')])
 
-        if not absolute:
-            # 'hours' here doesn't really represent hours,
-            # this is just so that our percentages are reported nicely
-            hours = 100
-            denom = np.nansum(denomTerms)
-            df["aepGainContribution"] = df["aepGainContribution"]*(1/denom)
+        return np.asarray(gainTerms, dtype=float), np.asarray(denomTerms, dtype=float)
 
-        aep = hours*np.nansum(df[('aepGainContribution', '', '')])
-        # print(aep)
-        return (df, aep)
+    def __aepGainTermsCube__(self, cube, ratios, aepMethod=1, useReference=True):
+        """
+        Same as __aepGainTerms__, but on the arrays of a power cube and its 
+        power ratios (see powerCube and __powerRatios__).
+
+        Returns
+        -------
+        gainTerms : numpy array
+            One entry per populated wind condition bin of the cube, in the
+            order of the rows of its export.
+
+        denomTerms : numpy array
+            One entry per populated wind condition bin of the cube.
+
+        """
+        avgPowerTest = cube.sel(metric='averagePower', turbineLabel='test', control_mode='baseline')
+
+        if aepMethod == 1:
+            if useReference:
+                gainTerms = avgPowerTest*ratios['percentPowerGain']
+            else:
+                gainTerms = ratios['changeInPowerRatio']
+
+            denomTerms = avgPowerTest
+
+        else:
+            # Reference average power over all control modes
+            avgPowerRef = self.powerCube(filterBins=True,
+                                         retainControlMode=False).sel(metric='averagePower',
+                                                                      turbineLabel='reference')
+
+            gainTerms = avgPowerRef*ratios['changeInPowerRatio']
+            denomTerms = avgPowerRef*ratios['powerRatioBaseline']
+
+        return gainTerms[cube.populated], denomTerms[cube.populated]
+
+    def aepGainDirichlet(self,
+                         nDraws=1000,
+                         hours=8760,
+                         aepMethod=1,
+                         absolute=False,
+                         useReference=None,
+                         df=None,
+                         dropna=False,
+                         counts=None,
+                         nObvs=None,
+                         prior=0,
+                         seed=None,
+                         lowerPercentile=2.5,
+                         upperPercentile=97.5):
+        """
+        Propagates the uncertainty in the PMF itself into AEP gain.
+        The long term bin counts are treated as a multinomial sample, and 
+        plausible PMFs are drawn from the Dirichlet posterior of the bin 
+        probabilities. AEP gain is evaluated for all draws at once as a 
+        matrix-vector product against the per-bin AEP gain terms, while 
+        the power ratio estimates in df are held fixed.
+
+        Parameters
+        ----------
+        nDraws : int, optional
+            Number of PMFs to draw. The default is 1000.
+
+        hours, aepMethod, absolute, useReference, df, dropna : optional
+            See aepGain.
+
+        counts : array-like of numerics, optional
+            Long term observation counts for each row of df. The default None
+            uses the PMF attribute times nObvs.
+
+        nObvs : int, optional
+            Total number of long term observations behind the PMF (including
+            any outside of the wind condition bins). The default None uses the 
+            number of rows of the wind time series (or the scada data if there
+            is no wind time series).
+
+        prior : float, optional
+            Dirichlet concentration added to every category's count (each 
+            bin, and the observations outside of the bins). The default 0
+            only allows probability in bins that were observed.
+
+        seed : int, optional
+            Seed for the random number generator. The default is None.
+
+        lowerPercentile : float, optional
+            The default is 2.5.
+
+        upperPercentile : float, optional
+            The default is 97.5.
+
+        Returns
+        -------
+        dictionary
+            The AEP gain using the PMF attribute, the AEP gain for each draw,
+            and summary statistics of the draws.
+
+        """
+        if useReference is None:
+            useReference = self.useReference
+
+        if not useReference:
+            # Both methods are equivalent when reference turbines aren't used,
+            aepMethod = 1
+
+        if df is None:
+            df = self.computeAll(useReference=useReference,
+                                 dfAvgPower=None,
+                                 dropna=dropna)
+
+        if nObvs is None:
+            nObvs = self.__windClimate__().nObvs
+
+        pmf = np.asarray(self.pmf(df=df), dtype=float)
+        if counts is None:
+            counts = pmf*nObvs
+        counts = np.asarray(counts, dtype=float)
+
+        gainTerms, denomTerms = self.__aepGainTerms__(df,
+                                                      aepMethod=aepMethod,
+                                                      useReference=useReference,
+                                                      dropna=dropna)
+
+        # Bins without an estimate don't contribute, like nansum in aepGain
+        gainTerms = np.nan_to_num(gainTerms)
+        denomTerms = np.nan_to_num(denomTerms)
+
+        # Long term observations that aren't in any of these bins still take
+        # up probability, so they are one extra Dirichlet category
+        alpha = np.append(counts, max(nObvs - np.sum(counts), 0)) + prior
+
+        # Dirichlet draws as normalized gamma draws (allows zero concentrations)
+        prng = np.random.default_rng(seed=seed)
+        draws = prng.standard_gamma(alpha, size=(nDraws, alpha.size))
+        pmfDraws = draws[:, :-1]/np.sum(draws, axis=1, keepdims=True)
+
+        aepDraws = pmfDraws @ gainTerms
+        aepPoint = np.multiply(gainTerms, pmf).sum()
+
+        if absolute:
+            aepDraws = hours*aepDraws
+            aepPoint = hours*aepPoint
+        else:
+            aepDraws = 100*aepDraws/(pmfDraws @ denomTerms)
+            aepPoint = 100*aepPoint/np.multiply(denomTerms, pmf).sum()
+
+        return {'aep gain': aepPoint,
+                'aep gain draws': aepDraws,
+                'mean': np.nanmean(aepDraws),
+                'sd': np.nanstd(aepDraws, ddof=1),
+                'lowerPercentile': np.nanpercentile(aepDraws, lowerPercentile),
+                'upperPercentile': np.nanpercentile(aepDraws, upperPercentile)}
 
     def TNOaverageTurbinePower(self, controlMode, farmStats=True):
         """
@@ -1386,28 +2929,20 @@ class energyGain():
             DESCRIPTION.
 
         """
-        groupVarCols = ['turbine']
-        if self.directionBins is not None:
-            groupVarCols.append('directionBin')
-        if self.speedBins is not None:
-                groupVarCols.append('speedBin')
-        
-        df = self.binAll(retainControlMode=True,
-                         retainTurbineLabel=True,
-                         retainTurbineNumbers=True,
-                         filterBins=True,
-                         long=True)
-        dfBinnedLong = df.loc[(df['turbineLabel']=='test') & (df['control_mode']==controlMode)]
-                   
-        # Get turbine-specific summary stats
-        #dfBinnedLong = dfBinnedLong.sort_values(by=['turbine'])
-        
-        dfBinnedTurbineStats = dfBinnedLong.groupby(by=groupVarCols).agg(averageTurbinePower=pd.NamedAgg(column='power',
-                                                                                                         aggfunc=np.mean),
-                                                                         varTurbinePower=pd.NamedAgg(column='power',
-                                                                                                     aggfunc=lambda x: np.var(x, ddof=1)),
-                                                                         nTurbineObvs=pd.NamedAgg(column="power",
-                                                                                                  aggfunc='count'))
+        pm = self.turbinePowerMatrix(filterBins=True)
+        ps = self.powerStatistics(filterBins=True)
+        stats = ps.stats(controlMode)
+        test = pm.columns('test')
+
+        # (bin x turbine) tables stacked into one row per turbine and bin
+        dfBinnedTurbineStats = pd.DataFrame({'averageTurbinePower': stats['mean'][:, test].T.ravel(),
+                                             'varTurbinePower': stats['var'][:, test].T.ravel(),
+                                             'nTurbineObvs': np.rint(stats['count'][:, test].T.ravel()).astype(np.int64)})
+        nBins = stats['binCodes'].size
+        binLabels = pm.binLabels(np.tile(stats['binCodes'], pm.turbines[test].size))
+        dfBinnedTurbineStats.index = pd.MultiIndex.from_arrays([np.repeat(pm.turbines[test], nBins)]
+                                                               + [binLabels[name] for name in pm.binNames],
+                                                               names=['turbine'] + pm.binNames)
 
         dfBinnedTurbineStats['sdTurbinePower'] = np.sqrt(dfBinnedTurbineStats['varTurbinePower'])
 
@@ -1417,11 +2952,10 @@ class energyGain():
         dfBinnedTurbineStats['seTurbinePower'] = np.sqrt(
             dfBinnedTurbineStats['varAvgTurbinePower'])
         
-        groupVarCols.pop(0)
-        
         if farmStats:
             # This dictionary contains information needed to compute other farm stats
-            return {'dfTurbine': dfBinnedTurbineStats, 'dfWithBins': df}
+            return {'dfTurbine': dfBinnedTurbineStats, 'powerMatrix': pm,
+                    'powerStats': ps, 'controlMode': controlMode}
 
         return dfBinnedTurbineStats
 
@@ -1450,25 +2984,24 @@ class energyGain():
         None.
 
         """
-        groupVarCols = []
-        if self.directionBins is not None:
-            groupVarCols.append('directionBin')
-        if self.speedBins is not None:
-                groupVarCols.append('speedBin')
+        groupVarCols = [binCol for binCol, windCol, edges in self.__binVars__()]
 
         if TNOatpDict is None:
             TNOatpDict = self.TNOaverageTurbinePower(controlMode=controlMode,
                                                      farmStats=True)
 
         dfTurbine = TNOatpDict['dfTurbine']
-        # The last index will be for the turbines, which we don't want to include here
-        groupByCols = dfTurbine.index.names[:-1]
-        dfFarm = dfTurbine.groupby(groupByCols).agg(averageFarmPower=pd.NamedAgg(column='averageTurbinePower',
+        # Sum over the turbines within each wind condition bin
+        dfFarm = dfTurbine.groupby(groupVarCols).agg(averageFarmPower=pd.NamedAgg(column='averageTurbinePower',
                                                                                  aggfunc=np.sum),
                                                     nTurbs=pd.NamedAgg(column='averageTurbinePower',
                                                                        aggfunc='count'),
                                                     sumVarAvgTurbinePower=pd.NamedAgg(column='varAvgTurbinePower',
-                                                                                      aggfunc=np.sum))
+                                                                                      aggfunc=np.sum),
+                                                    # Every turbine sees the same time stamps, so the 
+                                                    # best-covered turbine counts the bin's observations
+                                                    nObvs=pd.NamedAgg(column='nTurbineObvs',
+                                                                      aggfunc='max'))
 
         dfFarmVar = self.__TNOvarFarmPower__(TNOatpDict)
 
@@ -1481,69 +3014,54 @@ class energyGain():
     def TNOturbinePowerCovarianceMatrix(self, df):
         """
         Computes the covariance matrix of all turbine power measurements in df. 
+        Each covariance uses the rows where both turbines have a power 
+        measurement (pairwise deletion), and all pairs are computed at once 
+        with matrix products.
 
         Parameters
         ----------
-        df : TYPE
+        df : pandas data frame or 2D numpy array
             Must contain only the columns of the power measurements for 
             turbines you want to compute the covariance between (including missing power entries).
             If the covariance within a specific wind condition bin is desired, df must already be filtered for those conditions.
 
         Returns
         -------
-        covTurbPowerMat : TYPE
-            DESCRIPTION.
-        nTurbPowerPairsMat : TYPE
-            DESCRIPTION.
+        dictionary
+            'turbine power covariance matrix' : covariance between each pair 
+            of turbines (variances on the diagonal).
+            'number non-missing pairs matrix' : number of rows where both 
+            turbines have power measurements.
+            'columns used' : names of the columns of df (column numbers for arrays).
 
         """
+        if isinstance(df, pd.DataFrame):
+            columns = list(df)
+            power = df.to_numpy(dtype=np.float64)
+        else:
+            power = np.asarray(df, dtype=np.float64)
+            columns = list(range(power.shape[1]))
 
-        nTurbs = len(list(df))
-
-        # Initialize empty covariance matrix for this wind condition bin
-        covTurbPowerMat = np.full(
-            shape=(nTurbs, nTurbs), fill_value=np.nan, dtype=float)
-        nTurbPowerPairsMat = np.full(
-            shape=(nTurbs, nTurbs), fill_value=0, dtype=int)
+        observed = ~np.isnan(power)
+        present = observed.astype(np.float64)
 
-        # Indices of all entries in upper triangle of covariance matrix
-        colComboIdxs = np.triu_indices(n=nTurbs, m=nTurbs, k=0)
-        numCombos = colComboIdxs[0].size
+        # Centering first keeps the sums of products from losing precision
+        counts = present.sum(axis=0)
+        means = np.nansum(power, axis=0)/np.maximum(counts, 1)
+        centered = np.where(observed, power - means, 0)
 
-        # This will leave the diagonal alone for now
-        for combo in range(numCombos):
-            col1idx = colComboIdxs[0][combo]
-            col2idx = colComboIdxs[1][combo]
+        # Number of rows, and sums over those rows, where both turbines are present
+        nTurbPowerPairsMat = (present.T @ present).astype(int)
+        sums = centered.T @ present
+        crossProducts = centered.T @ centered
 
-            # Could have used the k=1 argument in triu_indices but I still needed to access the number of rows for the individual turbines
-            if col1idx == col2idx:
-                turbMeasurements = df.iloc[:, col1idx].dropna()
-                nTurbPairs = turbMeasurements.shape[0]
-            else:
-                # Data frame of just the two turbines in question
-                df2Turbs = df.iloc[:, [col1idx, col2idx]]
-                df2Turbs = df2Turbs.dropna()
-                covTurbPowerMat2Turbs = df2Turbs.cov(ddof=1)
-                # Covariance between these two turbines
-                turbCov = covTurbPowerMat2Turbs.iloc[0, 1]
-                nTurbPairs = df2Turbs.shape[0]
-
-                # Insert covariance in Upper triangle of covariance matrix
-                covTurbPowerMat[col1idx, col2idx] = turbCov
-                # Insert covariance in Lower triangle
-                covTurbPowerMat[col2idx, col1idx] = turbCov
-
-            # Save number of non-mising pairs
-            nTurbPowerPairsMat[col2idx, col1idx] = nTurbPairs
-            nTurbPowerPairsMat[col1idx, col2idx] = nTurbPairs
-
-        # Fill the diagonal of this bin's covariance matrix with turbine variances
-        variances = df.var(axis=0, skipna=True, ddof=1)
-        np.fill_diagonal(covTurbPowerMat, val=np.asarray(variances))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covTurbPowerMat = (crossProducts - sums*sums.T/nTurbPowerPairsMat)/(nTurbPowerPairsMat - 1)
+        covTurbPowerMat[nTurbPowerPairsMat < 2] = np.nan
 
         return {'turbine power covariance matrix': covTurbPowerMat,
                 'number non-missing pairs matrix': nTurbPowerPairsMat,
-                'columns used': list(df)}
+                'columns used': columns}
 
     def TNOaverageTurbinePowerCovarianceMatrix(self, df=None, covTurbPowerMat=None,
                                                TurbPowerPairsMat=None, variances=None, returnCovTurbPower=None):
@@ -1551,6 +3069,7 @@ class energyGain():
         if returnCovTurbPower is None:
             returnCovTurbPower = False
 
+        nTurbPowerPairsMat = TurbPowerPairsMat
         if covTurbPowerMat is None:
             dct = self.TNOturbinePowerCovarianceMatrix(df)
             covTurbPowerMat = dct['turbine power covariance matrix']
@@ -1559,7 +3078,8 @@ class energyGain():
         if variances is None:
             variances = np.diag(covTurbPowerMat)
 
-        covMatAvgTurbPower = np.divide(covTurbPowerMat, nTurbPowerPairsMat)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covMatAvgTurbPower = np.divide(covTurbPowerMat, nTurbPowerPairsMat)
 
         if returnCovTurbPower:
             return {'turbine average power covariance matrix': covMatAvgTurbPower,
@@ -1569,146 +3089,47 @@ class energyGain():
         return covMatAvgTurbPower
 
     def __TNOvarFarmPower__(self, TNOatpDict):
-        
-        stepVars = []
-        if self.directionBins is not None:
-            stepVars.append('directionBin')
-        if self.speedBins is not None:
-                stepVars.append('speedBin')
-        
-        powerColumns = ["pow_{:03.0f}".format(number) for number in self.testTurbines]
-        dfBinnedTurbineStats = TNOatpDict['dfTurbine']
-        dfWithBins = TNOatpDict['dfWithBins']
-
-        nvars = len(stepVars)
-        # Make a list of the wind condition bins
-        binList = [i[1:nvars+1] for i in dfBinnedTurbineStats.index]
-
-        # Need to compute the sum of all pairwise covariances for all the turbines in a  given wind direction
-        farmPowerVar = {}
-        farmAvgPowerVar = {}
-
-        if nvars == 2:
-            
-            indexNames = dfBinnedTurbineStats.index.names
-            if indexNames.index('directionBin') < indexNames.index('speedBin'):
-                directionIDX = 0
-                speedIDX = 1
-            else:
-                directionIDX = 1
-                speedIDX = 0
-                
-    #        print(binList)
-        # Go through each wind condition bin
-        for condition in binList:
- #           print(condition)
-
-            if nvars == 2:
-                direction = condition[directionIDX]
-                speed = condition[speedIDX]
-                # Filter for power observations in this wind condition bin
-                dfCurrent = dfWithBins.loc[(dfWithBins['directionBin'] == direction) &
-                                           (dfWithBins['speedBin'] == speed)]
-                key = f'{direction},{speed}'
-            else:
-                val = condition[0]
-                # Filter for power observations in this wind condition bin
-                dfCurrent = dfWithBins.loc[(dfWithBins[stepVars[0]] == val)]
-                key = f'{val}'
-
-            # Select only the columns with the relevant power measurements
-            dfCurrent = dfCurrent.loc[dfCurrent['turbine'].isin(self.testTurbines)]
-
-            # Get the covariance matrices for turbine power and average turbine power
-            results = self.TNOaverageTurbinePowerCovarianceMatrix(df=dfCurrent, returnCovTurbPower=True)
-
-            avgPowerCov = results['turbine average power covariance matrix']
-            powerCov = results['turbine power covariance matrix']
-
-            farmAvgPowerVar[key] = np.sum(avgPowerCov)
-            farmPowerVar[key] = np.sum(powerCov)
-
-        # Convert dictionaries to a pandas data frame
-        dfFarmPowerVar = self.__TNOvarFarmPowerDictToDf__(dctFarmPower=farmPowerVar,
-                                                          dctFarmAvgPower=farmAvgPowerVar)
-
-        return dfFarmPowerVar
-
-    def __TNOvarFarmPowerDictToDf__(self, dctFarmPower, dctFarmAvgPower):
         """
-        Converts the intermediate dictionary from TNOvarFarmPower into a pandas data frame
+        Variance of the farm power and of the average farm power in each wind 
+        condition bin, from the sum of all pairwise covariances between the 
+        test turbines. The covariances of every bin come from the pairwise
+        sufficient statistics (see powerStatistics), without going back to 
+        the power data.
 
         Parameters
         ----------
-        dctFarmPower : TYPE
-            DESCRIPTION.
-        dctAvgFarmPower : TYPE
-            DESCRIPTION.
-        stepVars : TYPE
-            DESCRIPTION.
+        TNOatpDict : dict
+            The output of TNOaverageTurbinePower when farmStats=True.
 
         Returns
         -------
-        farmPowerVarDF : TYPE
-            DESCRIPTION.
+        pandas data frame
+            'varFarmPower' and 'varAvgFarmPower' indexed by wind condition bin.
 
         """
-        stepVars = []
-        if self.directionBins is not None:
-            stepVars.append('directionBin')
-        if self.speedBins is not None:
-            stepVars.append('speedBin')
-                
-        directionBins = np.ndarray(0, dtype=float)
-        speedBins = np.ndarray(0, dtype=float)
-        varFarmPower = np.ndarray(0, dtype=float)
-        varAvgFarmPower = np.ndarray(0, dtype=float)
-
-        # Creating arrays that will become series in the df we're constructing
-        for key in dctFarmPower.keys():
-            variables = key.split(',')
-
-            # Figure out what wind condition bin this belongs in
-            if len(variables) == 2:
-                directionBins = np.append(directionBins, float(variables[0]))
-                speedBins = np.append(speedBins, float(variables[1]))
-            elif 'directionBin' in stepVars:
-                directionBins = np.append(directionBins, float(variables[0]))
-            else:
-                speedBins = np.append(speedBins, float(variables[0]))
-
-            # Store the power variance for this wind condition bin
-            varFarmPower = np.append(varFarmPower, dctFarmPower[key])
-
-            # Store the average power variance for this wind condition bin
-            if key in dctFarmAvgPower.keys():
-                varAvgFarmPower = np.append(
-                    varAvgFarmPower, dctFarmAvgPower[key])
-            else:
-                varAvgFarmPower = np.append(varAvgFarmPower, np.nan)
-
-        # After going through all bins, convert the arrays into a data frame
-        dct = {'varFarmPower': varFarmPower,
-               'varAvgFarmPower': varAvgFarmPower}
+        pm = TNOatpDict['powerMatrix']
+        ps = TNOatpDict.get('powerStats')
+        if ps is None:
+            ps = self.powerStatistics(filterBins=True)
+        stats = ps.stats(TNOatpDict['controlMode'])
+        bins = stats['binCodes']
 
-        if 'directionBin' in stepVars:
-            dct['directionBin'] = directionBins
+        # Covariance matrices for turbine power and average turbine power in every bin at once
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covMatAvgTurbPower = stats['covariance']/stats['pairCount']
 
-        if 'speedBin' in stepVars:
-            dct['speedBin'] = speedBins
+        farmPowerVar = np.sum(stats['covariance'], axis=(1, 2))
+        farmAvgPowerVar = np.sum(covMatAvgTurbPower, axis=(1, 2))
 
-        farmPowerVarDF = pd.DataFrame(dct)
-
-        # Merging later is easier if this is an index
-        if len(stepVars) == 2:
-            farmPowerVarDF.index = pd.MultiIndex.from_arrays(
-                [farmPowerVarDF[f'{var}'] for var in stepVars])
-        else:
+        dfFarmPowerVar = pd.DataFrame({'varFarmPower': farmPowerVar,
+                                       'varAvgFarmPower': farmAvgPowerVar},
+                                      index=pm.binIndex(bins))
 
-            farmPowerVarDF.index = pd.Index(
-                farmPowerVarDF[f'{stepVars[0]}'])
+        # Also keep the bins as columns
+        for name, labels in pm.binLabels(bins).items():
+            dfFarmPowerVar[name] = labels
 
-        return farmPowerVarDF
+        return dfFarmPowerVar
 
     def TNOpowerRatio(self, seMultiplier=2, one='controlled',
                       two='baseline'):
@@ -1752,34 +3173,77 @@ class energyGain():
 
         return farmStats
 
+    def sparseBinStats(self, df, columns=None, windDirectionSpecs=None, windSpeedSpecs=None):
+        """
+        Stores per-bin results (like the output of TNOpowerRatio) sparsely:
+        only the populated wind condition bins are kept.
+
+        Parameters
+        ----------
+        df : pandas data frame
+            Indexed by the lower bounds of every binned variable (see 
+            setBins), one row per bin.
+
+        columns : list of strings, optional
+            Statistics to keep. The default None keeps every column.
+
+        windDirectionSpecs : list of length 3, optional
+            [lower bound (inclusive), upper bound (exclusive), bin width] of 
+            the direction bins. The default None uses the directionBins attribute.
+
+        windSpeedSpecs : list of length 3, optional
+            Same as windDirectionSpecs, for the speed bins.
+            The default None uses the speedBins attribute.
+
+        Returns
+        -------
+        binStats object
+
+        """
+        binEdges = {binCol: edges for binCol, windCol, edges in self.__binVars__()}
+        for binCol, specs in [('directionBin', windDirectionSpecs),
+                              ('speedBin', windSpeedSpecs)]:
+            if specs is not None and binCol in binEdges:
+                lowerBounds = np.arange(*specs)
+                binEdges[binCol] = np.append(lowerBounds, lowerBounds[-1] + specs[2])
+
+        return binStatsFromFrame(df,
+                                 binNames=list(binEdges),
+                                 binEdges=list(binEdges.values()),
+                                 columns=columns)
+
     def plot2DTNOpowerRatio(self, TNOprDF, windDirectionSpecs=None, windSpeedSpecs=None):
-        if windDirectionSpecs is None:
-            windDirectionSpecs = self.defaultWindDirectionSpecs
+        """
+        Heatmap of whether the confidence interval of the power ratio in each
+        wind condition bin is above 1 (1), below 1 (-1) or contains 1 (0).
 
-        if windSpeedSpecs is None:
-            windSpeedSpecs = self.defaultWindSpeedSpecs
+        Parameters
+        ----------
+        TNOprDF : pandas data frame
+            Output of TNOpowerRatio.
+
+        windDirectionSpecs, windSpeedSpecs : lists of length 3, optional
+            See sparseBinStats. The defaults use the object's bins.
+
+        Returns
+        -------
+        None.
+
+        """
+        stats = self.sparseBinStats(TNOprDF, columns=['powerRatioCIlower', 'powerRatioCIupper'],
+                                    windDirectionSpecs=windDirectionSpecs,
+                                    windSpeedSpecs=windSpeedSpecs)
+        lower = stats['powerRatioCIlower']
+        upper = stats['powerRatioCIupper']
+
+        # Only the populated bins are classified
+        sign = np.where(upper < 1, -1.0,
+                        np.where(lower > 1, 1.0,
+                                 np.where(np.isnan(lower) | np.isnan(upper), np.nan, 0.0)))
+
+        # Speeds along the rows for plotting
+        matrix = stats.dense(sign).T
 
-        # Empty matrix to hold all possible combinations
-        directionEdges = np.arange(*windDirectionSpecs)
-        speedEdges = np.arange(*windSpeedSpecs)
-        matrix = np.full(
-            shape=(speedEdges.size, directionEdges.size), fill_value=np.nan, dtype=float)
-        idxs = [(iS, iD) for iS in range(speedEdges.size)
-                for iD in range(directionEdges.size)]
-        # Fill matrix
-        for idx in idxs:
-            try:
-
-                if TNOprDF.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['powerRatioCIupper'] < 1:
-                    matrix[idx[0], idx[1]] = -1
-
-                elif TNOprDF.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['powerRatioCIlower'] > 1:
-                    matrix[idx[0], idx[1]] = 1
-
-                elif pd.isna(TNOprDF.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['powerRatioCIlower']) == False and pd.isna(TNOprDF.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['powerRatioCIlower']) == False:
-                    matrix[idx[0], idx[1]] = 0
-            except KeyError:
-                continue
         # plot matrix
         plt.clf()
         # sns.set_theme(style="whitegrid")
@@ -1814,7 +3278,7 @@ class energyGain():
 
         return None
 
-    def TNOexpectedPowerProduction(self, dfTNOpowerRatio, controlModeNumber=1, narm=False):
+    def TNOexpectedPowerProduction(self, dfTNOpowerRatio, controlModeNumber=1, narm=False, empirical=None):
         """
         This essentailly calculate the numerator or denominator for TNO's 
         version of AEP
@@ -1847,23 +3311,19 @@ class energyGain():
         dfTNOpowerRatio : pandas data frame
             The data frame that is returned by a call to TNOpowerRatio.
 
+        empirical : boolean, optional
+            Whether to weight by the wind condition frequencies of the campaign
+            itself (see __empiricalPMF__) instead of the PMF attribute.
+            The default None does this only if there is no dedicated long term
+            wind time series (or the pmf attribute has been set to None).
+
 
         Returns
         -------
         Float
 
         """
-        # If there is no joint PMF provided, use the empirical frequencies for the campaign
-        if self.pmf is None:
-            # empirical PMF behavioris currently less than ideal
-            pmf = self.__empiricalPMF__(dfTNOpowerRatio)
-            pd.dfTNOpowerRatio.merge(pmf, how='left',
-                                     left_on=[
-                                         f'{var}_1' for var in dfTNOpowerRatio.index.names],
-                                     right_on=[var for var in dfTNOpowerRatio.index.names])
-
-        else:
-            dfTNOpowerRatio['binDensity'] = self.pmf(dfTNOpowerRatio)
+        dfTNOpowerRatio['binDensity'] = self.__TNObinDensity__(dfTNOpowerRatio, empirical)
 
         if narm:
             dfTNOpowerRatio = dfTNOpowerRatio.loc[(~dfTNOpowerRatio['averageFarmPower_1'].isna()) &
@@ -1874,25 +3334,67 @@ class energyGain():
 
         return np.nansum(avgAEPterms)
 
-    def TNOannualPowerRatio(self, dfTNOpowerRatio):
+    def __TNObinDensity__(self, dfTNOpowerRatio, empirical=None):
+        """
+        Probability of each wind condition bin in dfTNOpowerRatio, either from
+        the PMF attribute or from the campaign itself.
+
+        Parameters
+        ----------
+        dfTNOpowerRatio : pandas data frame
+            The data frame that is returned by a call to TNOpowerRatio.
+
+        empirical : boolean, optional
+            See TNOexpectedPowerProduction.
+
+        Returns
+        -------
+        numpy array
+
+        """
+        if empirical is None:
+            # If there is no long term wind data, the campaign is all we have
+            empirical = self.wind is None or self.pmf is None
+
+        if empirical:
+            return self.__empiricalPMF__(dfTNOpowerRatio)
+
+        return self.pmf(df=dfTNOpowerRatio)
+
+    def __empiricalPMF__(self, dfTNOpowerRatio):
+        """
+        Empirical PMF of the wind condition bins during the campaign.
+        Uses the per-bin observation counts that TNOaverageFarmPower already
+        computed for both control modes, so the scada data isn't revisited.
+
+        Parameters
+        ----------
+        dfTNOpowerRatio : pandas data frame
+            The data frame that is returned by a call to TNOpowerRatio.
+
+        Returns
+        -------
+        numpy array
+            Proportion of all binned observations that fall in each row's 
+            wind condition bin, in the order of the rows.
+
+        """
+        # Bins that only appear in one control mode have NaN counts for the other
+        counts = np.add(np.nan_to_num(np.asarray(dfTNOpowerRatio['nObvs_1'], dtype=float)),
+                        np.nan_to_num(np.asarray(dfTNOpowerRatio['nObvs_2'], dtype=float)))
+
+        return counts/np.sum(counts)
+
+    def TNOannualPowerRatio(self, dfTNOpowerRatio, empirical=None):
 
         # Annual Power Ratio
+        # (these also add the binDensity column to dfTNOpowerRatio)
         aap1 = self.TNOexpectedPowerProduction(
-            dfTNOpowerRatio, controlModeNumber=1, narm=True)
+            dfTNOpowerRatio, controlModeNumber=1, narm=True, empirical=empirical)
         aap2 = self.TNOexpectedPowerProduction(
-            dfTNOpowerRatio, controlModeNumber=2, narm=True)
+            dfTNOpowerRatio, controlModeNumber=2, narm=True, empirical=empirical)
         apr = aap1/aap2
 
-        if self.pmf is None:
-            # empirical PMF behavioris currently less than ideal
-            pmf = self.__empiricalPMF__(dfTNOpowerRatio)
-            pd.dfTNOpowerRatio.merge(pmf, how='left',
-                                     left_on=[
-                                         f'{var}_1' for var in dfTNOpowerRatio.index.names],
-                                     right_on=[var for var in dfTNOpowerRatio.index.names])
-        else:
-            dfTNOpowerRatio['binDensity'] = self.pmf(dfTNOpowerRatio)
-
         # Variance, TNO equation 4.28
         dfTNOpowerRatio['binDensitySquared'] = np.multiply(dfTNOpowerRatio['binDensity'],
                                                            dfTNOpowerRatio['binDensity'])
@@ -2302,9 +3804,6 @@ class energyGain():
 
         # 2d Histogram
 
-        directionEdges = np.arange(*windDirectionSpecs)
-        speedEdges = np.arange(*windSpeedSpecs)
-
         #####
         # Plotting
         fig, axs = plt.subplots(nrows=1, ncols=2,
@@ -2362,54 +3861,37 @@ class energyGain():
                              ["Interval Coverage", "SE Method", "Percentile Method"],
                              ["Confidence Interval Widths", "SE Method", "Percentile Method"]])
 
-        idxs = [(iS, iD) for iS in range(speedEdges.size)
-                for iD in range(directionEdges.size)]
         #############
 
         start1096 = default_timer()
         for dfSummary in [ppgSummary, cprSummary]:
             print("Doing stuff for new metric")
-            mCenterMean, mCenterMed, mVarSE, mVarIQR, mPosNegCI, mPosNegPerc, mIWperc, mIWci = [np.full(
-                shape=(speedEdges.size, directionEdges.size), fill_value=np.nan, dtype=float) for i in range(8)]
-            # Just in case indices are out of order
-            dfSummary.index = dfSummary.index.reorder_levels(
-                order=['directionBins', 'speedBins'])
 
             print("filling matrices")
             start1105 = default_timer()
-            for idx in idxs:
-                try:
-                    mVarSE[idx[0], idx[1]] = dfSummary.loc[(
-                        directionEdges[idx[1]], speedEdges[idx[0]])]['se']
-                    mVarIQR[idx[0], idx[1]] = dfSummary.loc[(
-                        directionEdges[idx[1]], speedEdges[idx[0]])]['iqr']
-                    mIWperc[idx[0], idx[1]] = dfSummary.loc[(directionEdges[idx[1]],
-                                                             speedEdges[idx[0]])]['upperPercentile'] - dfSummary.loc[(directionEdges[idx[1]],
-                                                                                                                      speedEdges[idx[0]])]['lowerPercentile']
-                    mIWci[idx[0], idx[1]] = dfSummary.loc[(directionEdges[idx[1]],
-                                                           speedEdges[idx[0]])]['meanPlusSE'] - dfSummary.loc[(directionEdges[idx[1]],
-                                                                                                               speedEdges[idx[0]])]['meanMinusSE']
-                    mCenterMean[idx[0], idx[1]] = dfSummary.loc[(
-                        directionEdges[idx[1]], speedEdges[idx[0]])]['mean']
-                    mCenterMed[idx[0], idx[1]] = dfSummary.loc[(
-                        directionEdges[idx[1]], speedEdges[idx[0]])]['median']
-
-                    if dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['meanPlusSE'] < 0:
-                        mPosNegCI[idx[0], idx[1]] = -1
-                    elif dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['meanMinusSE'] > 0:
-                        mPosNegCI[idx[0], idx[1]] = 1
-                    elif dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['meanMinusSE']*dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['meanPlusSE'] < 0:
-                        mPosNegCI[idx[0], idx[1]] = 0
-
-                    if dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['upperPercentile'] < 0:
-                        mPosNegPerc[idx[0], idx[1]] = -1
-                    elif dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['lowerPercentile'] > 0:
-                        mPosNegPerc[idx[0], idx[1]] = 1
-                    elif dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['lowerPercentile']*dfSummary.loc[(directionEdges[idx[1]], speedEdges[idx[0]])]['upperPercentile'] < 0:
-                        mPosNegPerc[idx[0], idx[1]] = 0
-
-                except KeyError:
-                    continue
+            # Only the populated bins are stored; grids are made for the heatmaps
+            stats = self.sparseBinStats(dfSummary,
+                                        columns=['se', 'iqr', 'mean', 'median',
+                                                 'lowerPercentile', 'upperPercentile',
+                                                 'meanMinusSE', 'meanPlusSE'],
+                                        windDirectionSpecs=windDirectionSpecs,
+                                        windSpeedSpecs=windSpeedSpecs)
+
+            def signOf(lower, upper):
+                # -1 if the interval is below 0, 1 if above, 0 if it contains 0
+                return np.where(upper < 0, -1.0,
+                                np.where(lower > 0, 1.0,
+                                         np.where(lower*upper < 0, 0.0, np.nan)))
+
+            # Speeds along the rows for plotting
+            mVarSE = stats.dense('se').T
+            mVarIQR = stats.dense('iqr').T
+            mIWperc = stats.dense(stats['upperPercentile'] - stats['lowerPercentile']).T
+            mIWci = stats.dense(stats['meanPlusSE'] - stats['meanMinusSE']).T
+            mCenterMean = stats.dense('mean').T
+            mCenterMed = stats.dense('median').T
+            mPosNegCI = stats.dense(signOf(stats['meanMinusSE'], stats['meanPlusSE'])).T
+            mPosNegPerc = stats.dense(signOf(stats['lowerPercentile'], stats['upperPercentile'])).T
             duration1105 = default_timer() - start1105
             print("Done filling matrices:", duration1105)
 
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Long-run wind condition frequencies stored on a fine base grid as
+summed-area (2D cumulative sum) tables, so that the joint or marginal PMF
+for any coarser set of bin edges can be read off without going back to
+the wind time series.
+"""
+import numpy as np
+import pandas as pd
+
+
+class pmfGrid():
+
+    def __init__(self,
+                 dfWind,
+                 wdColWind='wd',
+                 wsColWind='ws',
+                 directionStep=0.1,
+                 speedStep=0.05,
+                 directionRange=(0, 360),
+                 speedRange=None):
+        """
+        Histograms the wind condition time series once on a fine grid and
+        stores the cumulative counts.
+
+        Parameters
+        ----------
+        dfWind : pandas dataframe
+            data frame with a column for wind direction measurements and a
+            column for wind speed measurements, taken at time stamps
+
+        wdColWind : string, optional
+            Name of the wind direction column in the wind condition time series.
+            The default is 'wd'.
+
+        wsColWind : string, optional
+            Name of the wind speed column in the wind condition time series.
+            The default is 'ws'.
+
+        directionStep : float, optional
+            Width of the fine grid cells for wind direction, in degrees.
+            The default is 0.1.
+
+        speedStep : float, optional
+            Width of the fine grid cells for wind speed, in m/s.
+            The default is 0.05.
+
+        directionRange : tuple of 2 numerics, optional
+            Lower and upper bound of the fine grid for wind direction.
+            The default is (0, 360).
+
+        speedRange : tuple of 2 numerics, optional
+            Lower and upper bound of the fine grid for wind speed.
+            The default None uses (0, 40), extended to cover the fastest
+            wind speed in the data (see speedGridRange).
+
+        Returns
+        -------
+        pmfGrid object
+
+        """
+        self.wdColWind = wdColWind
+        self.wsColWind = wsColWind
+        self.directionStep = directionStep
+        self.speedStep = speedStep
+        if speedRange is None:
+            speedRange = speedGridRange(dfWind[wsColWind], speedStep)
+
+        nDirs = int(np.rint((directionRange[1]-directionRange[0])/directionStep))
+        nSpeeds = int(np.rint((speedRange[1]-speedRange[0])/speedStep))
+        self.directionEdges = directionRange[0] + directionStep*np.arange(nDirs+1)
+        self.speedEdges = speedRange[0] + speedStep*np.arange(nSpeeds+1)
+
+        # Frequencies are with respect to all wind data, including data
+        # outside of the grid (same convention as energyGain.pmfCalculator)
+        self.N = dfWind.shape[0]
+
+        dirIdx, dirValid = cellPositions(dfWind[wdColWind],
+                                         self.directionEdges,
+                                         directionStep)
+        speedIdx, speedValid = cellPositions(dfWind[wsColWind],
+                                             self.speedEdges,
+                                             speedStep)
+
+        # Marginal counts only need their own variable to be inside the grid
+        dirCounts = np.bincount(dirIdx[dirValid], minlength=nDirs)
+        speedCounts = np.bincount(speedIdx[speedValid], minlength=nSpeeds)
+
+        both = dirValid & speedValid
+        jointCounts = np.bincount(dirIdx[both]*nSpeeds + speedIdx[both],
+                                  minlength=nDirs*nSpeeds).reshape(nDirs, nSpeeds)
+
+        # Summed-area tables, padded with a leading zero so that
+        # table[i, j] is the count of observations below edge i and edge j
+        self.directionTable = np.concatenate(([0], np.cumsum(dirCounts)))
+        self.speedTable = np.concatenate(([0], np.cumsum(speedCounts)))
+        self.jointTable = np.zeros((nDirs+1, nSpeeds+1), dtype=np.int64)
+        self.jointTable[1:, 1:] = jointCounts.cumsum(axis=0).cumsum(axis=1)
+
+    def counts(self, directionBins=None, speedBins=None):
+        """
+        Number of observations in each coarse wind condition bin.
+        Cost only depends on the number of coarse bins.
+
+        Parameters
+        ----------
+        directionBins : numeric numpy array, optional
+            Edges for the wind direction in degrees. Bin membership is
+            left edge inclusive, right edge exclusive. Must be monotonic
+            INCREASING and line up with the fine grid.
+            The default None means we will ignore wind direction.
+
+        speedBins : numeric numpy array, optional
+            Edges for the wind speed in m/s. Bin membership is
+            left edge inclusive, right edge exclusive. Must be monotonic
+            INCREASING and line up with the fine grid.
+            The default None means we will ignore wind speed.
+
+        Returns
+        -------
+        numpy array of integers
+            2D (directions along the rows, speeds along the columns) if both
+            bins are given, otherwise 1D.
+
+        """
+        if directionBins is None and speedBins is None:
+            raise ValueError("Specify wind direction and/or speed bins")
+
+        if speedBins is None:
+            d = edgePositions(directionBins, self.directionEdges, self.directionStep)
+            return np.diff(self.directionTable[d])
+
+        if directionBins is None:
+            s = edgePositions(speedBins, self.speedEdges, self.speedStep)
+            return np.diff(self.speedTable[s])
+
+        d = edgePositions(directionBins, self.directionEdges, self.directionStep)
+        s = edgePositions(speedBins, self.speedEdges, self.speedStep)
+        corners = self.jointTable[np.ix_(d, s)]
+
+        # Inclusion-exclusion on the corners of each coarse bin
+        return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+    def pmf(self, directionBins=None, speedBins=None, returnDense=False):
+        """
+        Joint or marginal PMF for the coarse wind condition bins, in the
+        same format as energyGain.pmfCalculator
+
+        Parameters
+        ----------
+        directionBins : numeric numpy array, optional
+            Edges for the wind direction in degrees (see counts).
+
+        speedBins : numeric numpy array, optional
+            Edges for the wind speed in m/s (see counts).
+
+        returnDense : boolean, optional
+            Only used for the joint PMF. Whether to return a dictionary with
+            the 2D array of frequencies and the bin edges instead of a
+            pandas Series. The default is False.
+
+        Returns
+        -------
+        freqs : pandas Series or dictionary
+            Bin frequencies indexed by the lower bounds of the bins
+            ('directionBins' and/or 'speedBins').
+
+        """
+        freqs = self.counts(directionBins=directionBins, speedBins=speedBins)/self.N
+
+        if speedBins is None:
+            freqs = pd.Series(freqs)
+            freqs.index = np.asarray(directionBins, dtype=float)[:-1]
+            freqs.index.names = ["directionBins"]
+
+        elif directionBins is None:
+            freqs = pd.Series(freqs)
+            freqs.index = np.asarray(speedBins, dtype=float)[:-1]
+            freqs.index.names = ["speedBins"]
+
+        elif returnDense:
+            return {'pmf': freqs,
+                    'directionBins': np.asarray(directionBins, dtype=float),
+                    'speedBins': np.asarray(speedBins, dtype=float)}
+
+        else:
+            freqs = pd.Series(freqs.ravel())
+            freqs.index = pd.MultiIndex.from_product([np.asarray(directionBins, dtype=float)[:-1],
+                                                      np.asarray(speedBins, dtype=float)[:-1]],
+                                                     names=('directionBins',
+                                                            'speedBins'))
+
+        return freqs
+
+
+def cellPositions(values, edges, step):
+    """
+    Fine grid cell of each value (left edge inclusive, right edge exclusive)
+
+    Parameters
+    ----------
+    values : array-like of numerics
+        Observations to place on the grid.
+
+    edges : numpy array of numerics
+        Uniform fine grid edges.
+
+    step : float
+        Width of the fine grid cells.
+
+    Returns
+    -------
+    idx : numpy array of integers
+        Cell number of each value. Only meaningful where valid is True.
+
+    valid : numpy array of booleans
+        Whether each value falls inside the grid.
+
+    """
+    values = np.asarray(values, dtype=float)
+    # Rounding keeps values sitting exactly on an edge in the cell above it
+    scaled = np.round((values - edges[0])/step, 9)
+    valid = (scaled >= 0) & (scaled < edges.size-1)
+    idx = np.zeros(values.size, dtype=np.int64)
+    idx[valid] = np.floor(scaled[valid]).astype(np.int64)
+
+    return idx, valid
+
+
+def edgePositions(bins, edges, step):
+    """
+    Positions of coarse bin edges on the fine grid
+
+    Parameters
+    ----------
+    bins : array-like of numerics
+        Monotonic increasing coarse bin edges. Each edge must lie on the
+        fine grid, within its bounds.
+
+    edges : numpy array of numerics
+        Uniform fine grid edges.
+
+    step : float
+        Width of the fine grid cells.
+
+    Returns
+    -------
+    numpy array of integers
+
+    """
+    bins = np.asarray(bins, dtype=float)
+    positions = np.rint((bins - edges[0])/step)
+
+    if np.any(np.abs(edges[0] + positions*step - bins) > 1e-6*step):
+        raise ValueError("Bin edges must line up with the fine grid "
+                         f"(steps of {step} starting at {edges[0]})")
+
+    # Counts beyond the grid are unknown, so they can't be read as zeros
+    if np.any((positions < 0) | (positions > edges.size-1)):
+        raise ValueError("Bin edges must be inside the fine grid "
+                         f"(from {edges[0]} to {edges[-1]})")
+
+    return positions.astype(np.int64)
+
+
+def speedGridRange(values, step, upper=40):
+    """
+    Bounds of a fine wind speed grid starting at 0 that covers every
+    observation
+
+    Parameters
+    ----------
+    values : array-like of numerics
+        Wind speed observations.
+
+    step : float
+        Width of the fine grid cells.
+
+    upper : numeric, optional
+        Smallest upper bound of the grid. The default is 40.
+
+    Returns
+    -------
+    tuple of 2 numerics
+
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if values.size > 0:
+        # One extra cell since the upper edge is exclusive
+        upper = max(upper, step*(np.floor(np.round(values.max()/step, 9)) + 1))
+
+    return (0, upper)
@@ -4,8 +4,36 @@ Created on Tue Jul 11 12:24:38 2023
 
 @author: ctodd
 """
-import pandas as pd
-import numpy as np
+import os
+from functools import lru_cache
+from sitePMF import sitePMFRegistry, convertPickledPMF
+
+# Pickled long-run frequency tables, stored next to this module
+PMF_FILES_ALBAINCOURT = {'joint': 'jointPMFdf_albaincourt',
+                         'speed': 'speedPMFdf_albaincourt',
+                         'direction': 'directionPMFdf_albaincourt'}
+
+@lru_cache(maxsize=None)
+def sitePMF_albaincourt():
+    """
+    The SMARTE-OLE long-run PMF from the binary site PMF registry 
+    (see sitePMF). The registry entry is created from the pickled tables 
+    the first time it is needed if it doesn't exist yet.
+
+    Returns
+    -------
+    sitePMF object
+
+    """
+    registry = sitePMFRegistry()
+    if 'albaincourt' in registry.sites():
+        return registry.open('albaincourt')
+
+    moduleDir = os.path.dirname(os.path.abspath(__file__))
+    return convertPickledPMF('albaincourt',
+                             *[os.path.join(moduleDir, PMF_FILES_ALBAINCOURT[kind])
+                               for kind in ('joint', 'direction', 'speed')],
+                             registry=registry)
 
 def jointPMF_albaincourt(df):
     """
@@ -33,42 +61,7 @@ def jointPMF_albaincourt(df):
         it appears in the df (so it can be concatenated as a column directly onto df)
 
     """
-    # This lets the function infer whether the wind condition bins are by speed, direction, or both
-    indices = df.index.names
-    
-    ## Load the appropriate PMF
-    # Joint PMF
-    if len(indices)==2:
-        df = df.reorder_levels(["directionBinLowerBound", "speedBinLowerBound"], axis=0)
-        pmf = pd.read_pickle("jointPMFdf_albaincourt")
-        # This does not change the order of the rows
-        pmf = pmf.reorder_levels(["directionBinLowerBound", "speedBinLowerBound"])
-    # Marginal PMF for wind speed
-    elif indices[0]=='speedBinLowerBound':
-        pmf = np.load("speedPMFdf_albaincourt",allow_pickle=True)
-    # Marginal PMF for wind direction
-    else:
-        pmf = np.load("directionPMFdf_albaincourt",allow_pickle=True)
-        
-    # Array of all possible wind conditions in the input data    
-    X = np.asarray(df.index)
-    length = X.size
-    
-    # Create array that will hold the PMF value for each wind condition that appears in the data
-    # This will be added to the input data as a new column
-    newCol = np.full(length, np.nan)
-    
-    # Go through each wind condition present in the data
-    for i in range(length):
-        try:
-            # see if the wind condition from the data is present in the PMF's support
-            # Perhaps a more sophisticated version of this would return a marginal probability if only one of the jointly distributed variables is outside of the marginal support
-            prob = pmf.loc[X[i], 'freq']
-        except KeyError:
-            # If the wind condition that appeared in the data is not in the support, return a probability of zero
-            prob = 0
-        
-        # Save the probability
-        newCol[i] = prob
-            
-    return newCol
\ No newline at end of file
+    # The site PMF infers whether the wind condition bins are by speed, direction, or both
+    # from the names of the index levels, and returns a probability of zero 
+    # for any wind condition from the data that is not in the PMF's support
+    return sitePMF_albaincourt().lookup(df.index)
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Turbine power sufficient statistics (number of observations, sum and sum
+of squares) for each turbine and control mode, stored on a fine wind
+direction x wind speed grid as summed-area (2D cumulative sum) tables.
+Statistics for any coarser bins that line up with the grid, or for any
+rectangular sector (direction range x speed range), are read off the
+corners of the tables without going back to the scada data, so changing
+the bins doesn't mean binning and aggregating all over again.
+"""
+import numpy as np
+import pandas as pd
+from pmfGrid import cellPositions, edgePositions, speedGridRange
+
+
+class powerGrid():
+
+    def __init__(self,
+                 df,
+                 referenceTurbines,
+                 testTurbines,
+                 wdCol='wd',
+                 wsCol='ws',
+                 controlModeCol='control_mode',
+                 directionStep=1.0,
+                 speedStep=0.25,
+                 directionRange=(0, 360),
+                 speedRange=None):
+        """
+        Aggregates the scada data once on a fine grid and stores the
+        cumulative statistics. The tables hold
+        (number of control modes) x (number of turbines) x (grid size)
+        values each, so keep the grid coarse enough for the number of turbines.
+
+        Parameters
+        ----------
+        df : pandas data frame
+            scada data with the wind direction, wind speed, control mode and
+            'pow_XXX' power columns.
+
+        referenceTurbines : list of integers
+            Turbine numbers of the reference turbines.
+
+        testTurbines : list of integers
+            Turbine numbers of the test turbines.
+
+        wdCol : string, optional
+            Name of the wind direction column. The default is 'wd'.
+
+        wsCol : string, optional
+            Name of the wind speed column. The default is 'ws'.
+
+        controlModeCol : string, optional
+            Name of the control mode column. The default is 'control_mode'.
+
+        directionStep : float, optional
+            Width of the fine grid cells for wind direction, in degrees.
+            The default is 1.0.
+
+        speedStep : float, optional
+            Width of the fine grid cells for wind speed, in m/s.
+            The default is 0.25.
+
+        directionRange : tuple of 2 numerics, optional
+            Lower and upper bound of the fine grid for wind direction.
+            The default is (0, 360).
+
+        speedRange : tuple of 2 numerics, optional
+            Lower and upper bound of the fine grid for wind speed.
+            The default None uses (0, 40), extended to cover the fastest
+            wind speed in the data (see pmfGrid.speedGridRange).
+
+        Returns
+        -------
+        powerGrid object
+
+        """
+        self.turbines = np.asarray(list(referenceTurbines) + list(testTurbines), dtype=int)
+        self.turbineLabels = np.array(['reference']*len(referenceTurbines)
+                                      + ['test']*len(testTurbines))
+        self.directionStep = directionStep
+        self.speedStep = speedStep
+        if speedRange is None:
+            speedRange = speedGridRange(df[wsCol], speedStep)
+
+        nDirs = int(np.rint((directionRange[1]-directionRange[0])/directionStep))
+        nSpeeds = int(np.rint((speedRange[1]-speedRange[0])/speedStep))
+        self.directionEdges = directionRange[0] + directionStep*np.arange(nDirs+1)
+        self.speedEdges = speedRange[0] + speedStep*np.arange(nSpeeds+1)
+
+        dirIdx, dirValid = cellPositions(df[wdCol], self.directionEdges, directionStep)
+        speedIdx, speedValid = cellPositions(df[wsCol], self.speedEdges, speedStep)
+
+        modeCodes, modes = pd.factorize(np.asarray(df[controlModeCol]), sort=True)
+        self.controlModes = np.asarray(modes, dtype=object)
+        nModes = self.controlModes.size
+
+        valid = dirValid & speedValid & (modeCodes >= 0)
+        cells = (modeCodes*nDirs + dirIdx)*nSpeeds + speedIdx
+        nCells = nModes*nDirs*nSpeeds
+
+        # Each turbine's power is shifted by its overall mean so the sums of
+        # squares don't lose precision when variances are taken from them
+        self.shift = np.zeros(self.turbines.size)
+        counts = np.zeros((self.turbines.size, nCells))
+        sums = np.zeros((self.turbines.size, nCells))
+        sumSqs = np.zeros((self.turbines.size, nCells))
+        for t, number in enumerate(self.turbines):
+            power = np.asarray(df["pow_{:03.0f}".format(number)], dtype=np.float64)
+            observed = valid & ~np.isnan(power)
+            if np.any(observed):
+                self.shift[t] = np.mean(power[observed])
+            shifted = power[observed] - self.shift[t]
+
+            counts[t] = np.bincount(cells[observed], minlength=nCells)
+            sums[t] = np.bincount(cells[observed], weights=shifted, minlength=nCells)
+            sumSqs[t] = np.bincount(cells[observed], weights=shifted*shifted, minlength=nCells)
+
+        rows = np.bincount(cells[valid], minlength=nCells)
+
+        # Summed-area tables, padded with a leading zero so that
+        # table[..., i, j] is the total below direction edge i and speed edge j
+        self.rowTable = self.__cumulate__(rows.reshape(nModes, nDirs, nSpeeds))
+        self.countTable = self.__cumulate__(counts.reshape(-1, nModes, nDirs, nSpeeds).swapaxes(0, 1))
+        self.sumTable = self.__cumulate__(sums.reshape(-1, nModes, nDirs, nSpeeds).swapaxes(0, 1))
+        self.sumSqTable = self.__cumulate__(sumSqs.reshape(-1, nModes, nDirs, nSpeeds).swapaxes(0, 1))
+
+    def __cumulate__(self, values):
+        """
+        Cumulative sums over the last two (direction and speed) axes,
+        padded with a leading zero along each
+        """
+        table = np.zeros(values.shape[:-2] + (values.shape[-2]+1, values.shape[-1]+1))
+        table[..., 1:, 1:] = values.cumsum(axis=-2).cumsum(axis=-1)
+        return table
+
+    def __binTotals__(self, table, d, s):
+        """
+        Inclusion-exclusion on the corners of each coarse bin
+        """
+        corners = table[..., d[:, None], s[None, :]]
+        return corners[..., 1:, 1:] - corners[..., :-1, 1:] - corners[..., 1:, :-1] + corners[..., :-1, :-1]
+
+    def stats(self, directionBins, speedBins):
+        """
+        Turbine power statistics for coarse wind condition bins.
+        Cost only depends on the number of coarse bins.
+
+        Parameters
+        ----------
+        directionBins : numeric numpy array
+            Edges for the wind direction in degrees. Must be monotonic
+            INCREASING and line up with the fine grid. Two edges give one
+            direction sector.
+
+        speedBins : numeric numpy array
+            Edges for the wind speed in m/s. Must be monotonic
+            INCREASING and line up with the fine grid.
+            Edges outside of the fine grid raise a ValueError.
+
+        Returns
+        -------
+        dictionary
+            'rows' (number of time stamps, control mode x direction x speed),
+            and 'count', 'sum', 'mean' and 'var' of the power of each
+            turbine (control mode x turbine x direction x speed).
+
+        """
+        d = edgePositions(directionBins, self.directionEdges, self.directionStep)
+        s = edgePositions(speedBins, self.speedEdges, self.speedStep)
+
+        rows = self.__binTotals__(self.rowTable, d, s)
+        counts = self.__binTotals__(self.countTable, d, s)
+        shiftedSums = self.__binTotals__(self.sumTable, d, s)
+        shiftedSumSqs = self.__binTotals__(self.sumSqTable, d, s)
+
+        shift = self.shift[None, :, None, None]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = shiftedSums/counts + shift
+            variances = (shiftedSumSqs - shiftedSums*shiftedSums/counts)/(counts - 1)
+        means[counts == 0] = np.nan
+        variances[counts < 2] = np.nan
+
+        return {'rows': rows,
+                'count': counts,
+                'sum': shiftedSums + counts*shift,
+                'mean': means,
+                'var': np.maximum(variances, 0)}
+
+    def sector(self, directionRange, speedRange):
+        """
+        Statistics of each turbine in each control mode for one rectangular
+        sector of wind conditions.
+
+        Parameters
+        ----------
+        directionRange : list of 2 numerics
+            Lower (inclusive) and upper (exclusive) wind direction of the
+            sector. Must line up with the fine grid.
+
+        speedRange : list of 2 numerics
+            Lower (inclusive) and upper (exclusive) wind speed of the
+            sector. Must line up with the fine grid.
+
+        Returns
+        -------
+        pandas data frame
+            Indexed by control mode and turbine, with the 'turbineLabel',
+            'count', 'sum', 'mean' and 'var' columns.
+
+        """
+        stats = self.stats(directionRange, speedRange)
+        nModes = self.controlModes.size
+
+        dct = {'turbineLabel': np.tile(self.turbineLabels, nModes)}
+        for stat in ['count', 'sum', 'mean', 'var']:
+            dct[stat] = stats[stat][..., 0, 0].ravel()
+
+        index = pd.MultiIndex.from_product([self.controlModes, self.turbines],
+                                           names=['control_mode', 'turbine'])
+        return pd.DataFrame(dct, index=index)
+
+    def averagePower(self, directionBins, speedBins):
+        """
+        Average power of the reference and test turbines in each control
+        mode and coarse wind condition bin, in the same wide format as
+        energyGain.averagePower (so it can go into energyGain.computeAll).
+
+        Parameters
+        ----------
+        directionBins : numeric numpy array
+            Edges for the wind direction in degrees (see stats).
+
+        speedBins : numeric numpy array
+            Edges for the wind speed in m/s (see stats).
+
+        Returns
+        -------
+        pandas data frame
+            Indexed by 'directionBin' and 'speedBin' (bins without any
+            data are left out), with ('averagePower', turbineLabel,
+            control_mode) columns.
+
+        """
+        directionBins = np.asarray(directionBins, dtype=float)
+        speedBins = np.asarray(speedBins, dtype=float)
+        stats = self.stats(directionBins, speedBins)
+
+        populated = stats['rows'].sum(axis=0) > 0
+        dirPos, speedPos = np.nonzero(populated)
+
+        dct = {}
+        for label in ['reference', 'test']:
+            cols = self.turbineLabels == label
+            if not np.any(cols):
+                continue
+            counts = stats['count'][:, cols].sum(axis=1)
+            sums = stats['sum'][:, cols].sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                averages = np.where(counts > 0, sums/counts, np.nan)
+            for m, mode in enumerate(self.controlModes):
+                dct[('averagePower', label, mode)] = averages[m][populated]
+
+        df = pd.DataFrame(dct, index=pd.MultiIndex.from_arrays([directionBins[dirPos],
+                                                                 speedBins[speedPos]],
+                                                                names=['directionBin', 'speedBin']))
+        df.columns.names = ['metric', 'turbineLabel', 'control_mode']
+
+        return df
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar container for binned scada power data.
+Turbine power is held as one contiguous (time x turbine) float array, with
+the reference turbines' columns first and the test turbines' columns last,
+next to one-dimensional arrays for the wind condition bin codes, control
+mode codes and time stamps. Aggregations work on views of these arrays
+instead of a long (one row per time stamp and turbine) data frame, which
+is only built when explicitly exported with toLong.
+
+Rows can optionally be clustered by wind condition bin and control mode
+(see clusterByBin), like a CSR matrix: every bin's rows are then one
+contiguous slice found through an offsets array, so per-bin work doesn't
+need to mask the whole array.
+"""
+import numpy as np
+import pandas as pd
+
+
+class powerMatrix():
+
+    def __init__(self,
+                 df,
+                 referenceTurbines,
+                 testTurbines,
+                 binVars,
+                 controlModeCol='control_mode',
+                 timeCol='time',
+                 compact=False):
+        """
+        Collects the power columns of binned scada data into one array.
+
+        Parameters
+        ----------
+        df : pandas data frame
+            scada data with the '{name}Code' integer bin code columns added
+            by energyGain.binAdder.
+
+        referenceTurbines : list of integers
+            Turbine numbers of the reference turbines.
+
+        testTurbines : list of integers
+            Turbine numbers of the test turbines.
+
+        binVars : list of tuples
+            (name, edges) for each wind condition that was binned,
+            e.g. [('directionBin', directionBins), ('speedBin', speedBins)].
+
+        controlModeCol : string, optional
+            Name of the control mode column. The default is 'control_mode'.
+
+        timeCol : string, optional
+            Name of the time stamp column. The default is 'time'.
+
+        compact : boolean, optional
+            Whether to store power as float32 (and export categorical labels
+            from toLong) to save memory. Anything summed from the power 
+            array should use a float64 accumulator. The default is False.
+
+        Returns
+        -------
+        powerMatrix object
+
+        """
+        self.referenceTurbines = list(referenceTurbines)
+        self.testTurbines = list(testTurbines)
+        self.turbines = np.asarray(self.referenceTurbines + self.testTurbines, dtype=int)
+        self.nReference = len(self.referenceTurbines)
+        self.turbineLabels = np.array(['reference']*self.nReference
+                                      + ['test']*len(self.testTurbines))
+
+        powerColumns = ["pow_{:03.0f}".format(number) for number in self.turbines]
+        self.compact = compact
+        self.power = np.ascontiguousarray(df[powerColumns].to_numpy(dtype=np.float32 if compact
+                                                                     else np.float64))
+
+        self.binNames = [name for name, edges in binVars]
+        self.binEdges = [np.asarray(edges, dtype=float) for name, edges in binVars]
+        self.binShape = tuple(edges.size-1 for edges in self.binEdges)
+        self.binCodes = {name: np.asarray(df[f'{name}Code']) for name in self.binNames}
+
+        # One code for the combination of all the wind condition bins
+        codes = [self.binCodes[name] for name in self.binNames]
+        inBins = np.ones(self.power.shape[0], dtype=bool)
+        for c in codes:
+            inBins &= c >= 0
+        self.binCode = np.full(self.power.shape[0], -1, dtype=np.int64)
+        if codes:
+            self.binCode[inBins] = np.ravel_multi_index([c[inBins] for c in codes],
+                                                        self.binShape)
+
+        # Control modes as small integer codes (-1 if missing)
+        if controlModeCol in df:
+            codes, modes = pd.factorize(np.asarray(df[controlModeCol]), sort=True)
+            self.controlModes = np.asarray(modes, dtype=object)
+            self.controlModeCodes = codes.astype(np.int8)
+        else:
+            self.controlModes = np.array([], dtype=object)
+            self.controlModeCodes = np.full(self.power.shape[0], -1, dtype=np.int8)
+
+        self.time = np.asarray(df[timeCol]) if timeCol in df else None
+
+        # Set by clusterByBin
+        self.offsets = None
+        self.rowOrder = None
+        # Set by timeIndex
+        self.timeOrder = None
+        self.sortedTime = None
+
+    @property
+    def nRows(self):
+        """
+        Number of time stamps
+        """
+        return self.power.shape[0]
+
+    def columns(self, turbineLabel=None):
+        """
+        Columns of the power array for one group of turbines. These are
+        slices, so indexing power with them gives a view rather than a copy.
+
+        Parameters
+        ----------
+        turbineLabel : string, optional
+            'reference' or 'test'. The default None means all turbines.
+
+        Returns
+        -------
+        slice
+
+        """
+        if turbineLabel is None:
+            return slice(0, self.turbines.size)
+        if turbineLabel == 'reference':
+            return slice(0, self.nReference)
+        if turbineLabel == 'test':
+            return slice(self.nReference, self.turbines.size)
+
+        raise ValueError("turbineLabel must be 'reference', 'test' or None")
+
+    def controlModeCode(self, controlMode):
+        """
+        Integer code of a control mode (-1 if it never occurs)
+        """
+        matches = np.flatnonzero(self.controlModes == controlMode)
+        return int(matches[0]) if matches.size else -1
+
+    def rows(self, controlMode=None):
+        """
+        Boolean mask of the time stamps in a control mode.
+
+        Parameters
+        ----------
+        controlMode : string, optional
+            e.g. 'controlled' or 'baseline'. The default None means all rows.
+
+        Returns
+        -------
+        numpy array of booleans
+
+        """
+        if controlMode is None:
+            return np.ones(self.nRows, dtype=bool)
+        return self.controlModeCodes == self.controlModeCode(controlMode)
+
+    def clusterByBin(self):
+        """
+        Sorts the rows by combined bin code and then control mode (keeping 
+        time order within each), and stores the offsets of each 
+        (bin, control mode) group, so binRows returns contiguous slices.
+        Aggregations don't depend on row order, but toLong exports the rows
+        in this order afterwards. Does nothing if already clustered.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.offsets is not None:
+            return None
+
+        nModes = self.controlModes.size + 1
+        nKeys = (int(np.prod(self.binShape)) + 1)*nModes
+        # Rows outside the bins or without a control mode sort first
+        keys = (self.binCode + 1)*nModes + (self.controlModeCodes.astype(np.int64) + 1)
+
+        order = np.argsort(keys, kind='stable')
+        self.power = np.take(self.power, order, axis=0)
+        self.binCode = self.binCode[order]
+        self.binCodes = {name: codes[order] for name, codes in self.binCodes.items()}
+        self.controlModeCodes = self.controlModeCodes[order]
+        if self.time is not None:
+            self.time = self.time[order]
+
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(keys, minlength=nKeys))))
+        # Original position of each row
+        self.rowOrder = order
+        # The time index refers to the old row positions
+        self.timeOrder = None
+        self.sortedTime = None
+
+        return None
+
+    def binRows(self, code, controlMode=None):
+        """
+        Rows of one wind condition bin (and control mode).
+
+        Parameters
+        ----------
+        code : integer
+            Combined bin code (as in the binCode attribute).
+
+        controlMode : string, optional
+            The default None means all control modes.
+
+        Returns
+        -------
+        slice or numpy array of booleans
+            A slice (so indexing gives a view) if the rows are clustered 
+            (see clusterByBin), otherwise a boolean mask.
+
+        """
+        if self.offsets is None:
+            rows = self.binCode == code
+            if controlMode is not None:
+                rows &= self.rows(controlMode)
+            return rows
+
+        nModes = self.controlModes.size + 1
+        first = (code + 1)*nModes
+        if controlMode is None:
+            return slice(self.offsets[first], self.offsets[first + nModes])
+
+        modeCode = self.controlModeCode(controlMode)
+        if modeCode < 0:
+            return slice(0, 0)
+
+        return slice(self.offsets[first + modeCode + 1], self.offsets[first + modeCode + 2])
+
+    def timeIndex(self):
+        """
+        Sorted time index: the row order that sorts the time stamps (stable,
+        leaving out rows without a time stamp) and the sorted time stamps, 
+        stored in the timeOrder and sortedTime attributes. Built once.
+
+        Returns
+        -------
+        tuple of 2 numpy arrays
+            (timeOrder, sortedTime)
+
+        """
+        if self.time is None:
+            raise ValueError("Power matrix has no time stamps")
+
+        if self.timeOrder is None:
+            self.timeOrder, self.sortedTime = sortedTimeIndex(self.time)
+
+        return self.timeOrder, self.sortedTime
+
+    def timeRows(self, start=None, end=None):
+        """
+        Rows with start <= time < end, found by binary search on the 
+        sorted time index (see timeIndex).
+
+        Parameters
+        ----------
+        start : time stamp, optional
+            The default None means from the first time stamp.
+
+        end : time stamp, optional
+            The default None means through the last time stamp.
+
+        Returns
+        -------
+        numpy array of integers
+            Row positions, in time order.
+
+        """
+        order, times = self.timeIndex()
+
+        return order[timeSlice(times, start, end)]
+
+    def binLabels(self, codes):
+        """
+        Lower bounds of the wind condition bins for combined bin codes.
+
+        Parameters
+        ----------
+        codes : array-like of integers
+            Combined bin codes (as in the binCode attribute).
+            Must not contain -1.
+
+        Returns
+        -------
+        dictionary
+            Lower bounds for each name in binNames.
+
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        positions = np.unravel_index(codes, self.binShape)
+
+        return {name: edges[pos] for name, edges, pos in zip(self.binNames,
+                                                             self.binEdges,
+                                                             positions)}
+
+    def binIndex(self, codes):
+        """
+        pandas (Multi)Index of bin lower bounds for combined bin codes,
+        named after binNames.
+        """
+        labels = self.binLabels(codes)
+        if len(self.binNames) == 1:
+            return pd.Index(labels[self.binNames[0]], name=self.binNames[0])
+
+        return pd.MultiIndex.from_arrays([labels[name] for name in self.binNames],
+                                         names=self.binNames)
+
+    def toLong(self, retainControlMode=True, retainTurbineLabel=True):
+        """
+        Exports the data as a long data frame with one row per time stamp and
+        turbine, in the format of energyGain.binAll(long=True).
+        Only for users that explicitly need the long format, since it
+        repeats everything other than power once per turbine.
+
+        Parameters
+        ----------
+        retainControlMode : boolean, optional
+            Whether to include the control mode column. The default is True.
+
+        retainTurbineLabel : boolean, optional
+            Whether to include the 'turbineLabel' column. The default is True.
+
+        Returns
+        -------
+        pandas data frame
+
+        """
+        nTurbs = self.turbines.size
+        inBins = self.binCode >= 0
+        labels = self.binLabels(np.where(inBins, self.binCode, 0))
+
+        dct = {}
+        for name, edges in zip(self.binNames, self.binEdges):
+            if self.compact:
+                dct[name] = pd.Categorical.from_codes(np.tile(self.binCodes[name], nTurbs),
+                                                      categories=edges[:-1])
+            else:
+                dct[name] = np.tile(np.where(inBins, labels[name], np.nan), nTurbs)
+        if self.time is not None:
+            dct['time'] = np.tile(self.time, nTurbs)
+        if retainControlMode:
+            if self.compact:
+                dct['control_mode'] = pd.Categorical.from_codes(np.tile(self.controlModeCodes, nTurbs),
+                                                                categories=self.controlModes)
+            else:
+                modes = np.append(self.controlModes, None)
+                dct['control_mode'] = np.tile(modes[self.controlModeCodes], nTurbs)
+        totalFarmPower = np.nansum(self.power, axis=1, dtype=np.float64).astype(self.power.dtype)
+        dct['totalFarmPower'] = np.tile(totalFarmPower, nTurbs)
+        dct['turbine'] = np.repeat(self.turbines.astype(np.int16 if self.compact else int), self.nRows)
+        # Column-major order keeps each turbine's time stamps together
+        dct['power'] = self.power.ravel(order='F')
+        if retainTurbineLabel:
+            if self.compact:
+                dct['turbineLabel'] = pd.Categorical.from_codes(np.repeat((self.turbineLabels == 'test').astype(np.int8),
+                                                                          self.nRows),
+                                                                categories=['reference', 'test'])
+            else:
+                dct['turbineLabel'] = np.repeat(self.turbineLabels, self.nRows)
+
+        return pd.DataFrame(dct)
+
+
+def sortedTimeIndex(times):
+    """
+    Row order that sorts time stamps (stable, leaving out missing time 
+    stamps), and the sorted time stamps.
+
+    Parameters
+    ----------
+    times : numpy array
+        Time stamps (datetime64 or numeric).
+
+    Returns
+    -------
+    tuple of 2 numpy arrays
+
+    """
+    times = np.asarray(times)
+    # Missing time stamps sort last
+    order = np.argsort(times, kind='stable')
+    order = order[:np.sum(~pd.isna(times))]
+
+    return order, times[order]
+
+
+def timeSlice(sortedTimes, start=None, end=None):
+    """
+    Positions of start <= time < end in sorted time stamps, by binary search.
+
+    Parameters
+    ----------
+    sortedTimes : numpy array
+        Sorted time stamps without missing values (see sortedTimeIndex).
+
+    start : time stamp, optional
+        The default None means from the first time stamp.
+
+    end : time stamp, optional
+        The default None means through the last time stamp.
+
+    Returns
+    -------
+    slice
+
+    """
+    lo = 0 if start is None else int(np.searchsorted(sortedTimes, timeValue(start, sortedTimes), side='left'))
+    hi = sortedTimes.size if end is None else int(np.searchsorted(sortedTimes, timeValue(end, sortedTimes), side='left'))
+
+    return slice(lo, max(lo, hi))
+
+
+def timeValue(value, times):
+    """
+    A time stamp in the type of the times array, so strings and pandas
+    Timestamps can be compared with datetime64 arrays
+    """
+    if np.asarray(times).dtype.kind == 'M':
+        return pd.Timestamp(value).to_datetime64()
+
+    return value
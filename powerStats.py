@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Sufficient statistics of turbine power, collected in one pass over a
+powerMatrix. For each populated (wind condition bin, control mode) group
+this keeps, for every turbine, the number of power observations, their
+mean and their sum of squared deviations (M2), and for every pair of
+test turbines the same statistics over the rows where both have power
+(the co-moment takes the place of M2). Every per-bin metric (average
+power, turbine and farm power variances, covariances between turbines)
+is derived from these without going back to the data.
+
+Statistics are combined with Chan et al.'s pairwise update, so the
+chunks of one pass, the control modes of a bin or two separately
+collected data sets (see merge) combine exactly without precision loss.
+"""
+import copy
+import numpy as np
+
+
+class powerStats():
+
+    def __init__(self, pm, chunkSize=None):
+        """
+        Collects the statistics in one pass over the rows of a power matrix.
+
+        Parameters
+        ----------
+        pm : powerMatrix
+            Binned power data. Rows outside of the wind condition bins are
+            left out.
+
+        chunkSize : integer, optional
+            Number of rows handled at once. The default None picks it so each
+            per-chunk (row x turbine) array takes about 32 MB.
+
+        Returns
+        -------
+        powerStats object
+
+        """
+        self.turbines = pm.turbines
+        self.turbineLabels = pm.turbineLabels
+        self.nReference = pm.nReference
+        self.binNames = pm.binNames
+        self.binEdges = pm.binEdges
+        self.binShape = pm.binShape
+        self.controlModes = pm.controlModes
+        # Slot 0 of each bin is for rows without a control mode
+        self.nSlots = self.controlModes.size + 1
+
+        keys = pm.binCode*self.nSlots + (pm.controlModeCodes.astype(np.int64) + 1)
+        inBins = np.flatnonzero(pm.binCode >= 0)
+        keys = keys[inBins]
+
+        # Populated groups, sorted, so grouping by bin is a contiguous reduction
+        self.groups = np.unique(keys)
+        nGroups = self.groups.size
+        nTurbs = self.turbines.size
+        test = pm.columns('test')
+        nTest = test.stop - test.start
+
+        self.count = np.zeros((nGroups, nTurbs))
+        self.mean = np.zeros((nGroups, nTurbs))
+        self.m2 = np.zeros((nGroups, nTurbs))
+        self.pairCount = np.zeros((nGroups, nTest, nTest))
+        self.pairMean = np.zeros((nGroups, nTest, nTest))
+        self.pairM2 = np.zeros((nGroups, nTest, nTest))
+        # Means are stored relative to a shift per turbine (see stats)
+        self.shift = np.zeros(nTurbs)
+
+        if chunkSize is None:
+            chunkSize = max(1024, 2**22//max(nTurbs, 1))
+
+        # Each test turbine pair once (the diagonal is the per-turbine statistics)
+        pairI, pairJ = np.triu_indices(nTest, k=1)
+
+        for start in range(0, inBins.size, chunkSize):
+            rows = inBins[start:start + chunkSize]
+            power = np.asarray(pm.power[rows], dtype=np.float64)
+            present = ~np.isnan(power)
+            if start == 0:
+                # The first chunk's means keep the sums of squares small
+                observed = present.sum(axis=0)
+                self.shift = np.where(observed > 0, np.nansum(power, axis=0)/np.maximum(observed, 1), 0)
+
+            values = np.where(present, power - self.shift, 0)
+
+            present = present.astype(np.float64)
+
+            # Group of each row, and one bincount slot per group and turbine
+            local = np.searchsorted(self.groups, keys[start:start + chunkSize])
+            slots = (local[:, None]*nTurbs + np.arange(nTurbs)).ravel()
+            counts, sums, sumSqs = [np.bincount(slots, weights=arr.ravel(),
+                                                minlength=nGroups*nTurbs).reshape(nGroups, nTurbs)
+                                    for arr in [present, values, values*values]]
+            chunk = self.__momentsFromSums__(counts, sums, sums, sumSqs)
+            self.count, self.mean, self.m2 = chanMerge(self.count, self.mean, self.m2, *chunk)
+
+            if nTest:
+                # pairSums[g, i, j]: sum of turbine i over the rows where j is present too
+                pairCounts = np.zeros((nGroups, nTest, nTest))
+                pairSums = np.zeros((nGroups, nTest, nTest))
+                products = np.zeros((nGroups, nTest, nTest))
+                diagonal = np.arange(nTest)
+                pairCounts[:, diagonal, diagonal] = counts[:, test]
+                pairSums[:, diagonal, diagonal] = sums[:, test]
+                products[:, diagonal, diagonal] = sumSqs[:, test]
+
+                presentTest = present[:, test]
+                valuesTest = values[:, test]
+                for i, j in zip(pairI, pairJ):
+                    pairCounts[:, i, j] = pairCounts[:, j, i] = np.bincount(local, weights=presentTest[:, i]*presentTest[:, j],
+                                                                            minlength=nGroups)
+                    pairSums[:, i, j] = np.bincount(local, weights=valuesTest[:, i]*presentTest[:, j], minlength=nGroups)
+                    pairSums[:, j, i] = np.bincount(local, weights=valuesTest[:, j]*presentTest[:, i], minlength=nGroups)
+                    products[:, i, j] = products[:, j, i] = np.bincount(local, weights=valuesTest[:, i]*valuesTest[:, j],
+                                                                        minlength=nGroups)
+                chunk = self.__momentsFromSums__(pairCounts, pairSums, pairSums.swapaxes(1, 2), products)
+                self.pairCount, self.pairMean, self.pairM2 = chanMerge(self.pairCount, self.pairMean,
+                                                                       self.pairM2, *chunk, pairs=True)
+
+    def __momentsFromSums__(self, n, sumsI, sumsJ, products):
+        """
+        Count, mean and (co-)moment from plain sums (means are 0 where n is 0)
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, sumsI/n, 0)
+            m2 = np.where(n > 0, products - sumsI*sumsJ/n, 0)
+
+        return n, mean, m2
+
+    @property
+    def nGroups(self):
+        """
+        Number of populated (wind condition bin, control mode) groups
+        """
+        return self.groups.size
+
+    @property
+    def sums(self):
+        """
+        Sum of each turbine's power in each group
+        """
+        return self.count*(self.mean + self.shift)
+
+    @property
+    def binCodes(self):
+        """
+        Combined wind condition bin code of each group
+        """
+        return self.groups//self.nSlots
+
+    @property
+    def controlModeCodes(self):
+        """
+        Control mode code of each group (-1 for rows without a control mode)
+        """
+        return self.groups % self.nSlots - 1
+
+    def stats(self, controlMode=None):
+        """
+        Statistics of each populated wind condition bin in one control mode,
+        or over all rows (whatever their control mode) of each bin.
+
+        Parameters
+        ----------
+        controlMode : string, optional
+            e.g. 'controlled' or 'baseline'. The default None combines every
+            control mode (and rows without one).
+
+        Returns
+        -------
+        dictionary
+            'binCodes' (combined bin code of each bin), 'count', 'sum',
+            'mean' and 'var' (ddof=1) of each turbine's power (bin x turbine),
+            and 'pairCount' and 'covariance' (pairwise complete, ddof=1)
+            between each pair of test turbines (bin x test x test).
+
+        """
+        if controlMode is None:
+            binCodes, starts = np.unique(self.binCodes, return_index=True)
+            count, mean, m2 = chanReduce(self.count, self.mean, self.m2, starts)
+            pairCount, pairMean, pairM2 = chanReduce(self.pairCount, self.pairMean, self.pairM2,
+                                                     starts, pairs=True)
+        else:
+            matches = np.flatnonzero(self.controlModes == controlMode)
+            groups = self.controlModeCodes == (matches[0] if matches.size else -2)
+            binCodes = self.binCodes[groups]
+            count, mean, m2 = self.count[groups], self.mean[groups], self.m2[groups]
+            pairCount, pairM2 = self.pairCount[groups], self.pairM2[groups]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(count > 0, mean + self.shift, np.nan)
+            variances = np.where(count > 1, m2/(count - 1), np.nan)
+            covariances = np.where(pairCount > 1, pairM2/(pairCount - 1), np.nan)
+
+        return {'binCodes': binCodes,
+                'count': count,
+                'sum': count*(mean + self.shift),
+                'mean': means,
+                'var': variances,
+                'pairCount': pairCount,
+                'covariance': covariances}
+
+    def merge(self, other):
+        """
+        Statistics of the union of two data sets (e.g. two campaigns),
+        combined with Chan's update. Both must have the same turbines and
+        wind condition bins.
+
+        Parameters
+        ----------
+        other : powerStats
+
+        Returns
+        -------
+        powerStats object
+
+        """
+        if (not np.array_equal(self.turbines, other.turbines)
+                or self.nReference != other.nReference
+                or self.binShape != other.binShape
+                or not all(np.array_equal(a, b) for a, b in zip(self.binEdges, other.binEdges))):
+            raise ValueError("Statistics must have the same turbines and wind condition bins")
+
+        modes = np.asarray(sorted(set(self.controlModes) | set(other.controlModes)), dtype=object)
+        mine = self.__regroup__(modes)
+        theirs = other.__regroup__(modes)
+        groups = np.union1d(mine, theirs)
+        a = np.searchsorted(groups, mine)
+        b = np.searchsorted(groups, theirs)
+
+        merged = copy.copy(self)
+        merged.controlModes = modes
+        merged.nSlots = modes.size + 1
+        merged.groups = groups
+
+        # Means relative to this object's shift (turbine i's for pair statistics)
+        shiftDiff = other.shift - self.shift
+        testShiftDiff = shiftDiff[self.nReference:][None, :, None]
+        for count, mean, m2, pairs, diff in [('count', 'mean', 'm2', False, shiftDiff),
+                                             ('pairCount', 'pairMean', 'pairM2', True, testShiftDiff)]:
+            shape = (groups.size,) + getattr(self, count).shape[1:]
+            arrays = {}
+            for stat in [count, mean, m2]:
+                arrays[stat] = np.zeros(shape)
+                arrays[stat][a] = getattr(self, stat)
+            otherMean = getattr(other, mean) + diff
+            (arrays[count][b],
+             arrays[mean][b],
+             arrays[m2][b]) = chanMerge(arrays[count][b], arrays[mean][b], arrays[m2][b],
+                                        getattr(other, count), otherMean, getattr(other, m2),
+                                        pairs=pairs)
+            for stat in [count, mean, m2]:
+                setattr(merged, stat, arrays[stat])
+
+        return merged
+
+    def __regroup__(self, modes):
+        """
+        Group codes for a different (sorted, larger) list of control modes
+        """
+        slots = np.r_[0, np.searchsorted(modes, self.controlModes) + 1].astype(np.int64)
+
+        return self.binCodes*(modes.size + 1) + slots[self.groups % self.nSlots]
+
+
+def chanMerge(nA, meanA, m2A, nB, meanB, m2B, pairs=False):
+    """
+    Chan et al.'s pairwise update: count, mean and M2 of two data sets
+    combined, element by element.
+
+    Parameters
+    ----------
+    nA, meanA, m2A : numpy arrays
+        Count, mean and M2 of the first data set.
+
+    nB, meanB, m2B : numpy arrays
+        Count, mean and M2 of the second data set.
+
+    pairs : boolean, optional
+        Whether these are pair statistics (... x turbine x turbine), where
+        meanA[..., i, j] is turbine i's mean over the rows where both are
+        present and M2 is the co-moment. The default is False.
+
+    Returns
+    -------
+    tuple of 3 numpy arrays
+        Count, mean and M2 of the combination.
+
+    """
+    n = nA + nB
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(n > 0, nB/n, 0)
+    delta = meanB - meanA
+    deltaOther = delta.swapaxes(-1, -2) if pairs else delta
+
+    return n, meanA + delta*weight, m2A + m2B + delta*deltaOther*nA*weight
+
+
+def chanReduce(n, mean, m2, starts, pairs=False):
+    """
+    Chan's update over consecutive groups of rows at once: the statistics
+    of the rows from each start up to the next start combined.
+
+    Parameters
+    ----------
+    n, mean, m2 : numpy arrays
+        Count, mean and M2, one row (first axis) per data set.
+
+    starts : numpy array of integers
+        First row of each combination (increasing, starting at 0).
+
+    pairs : boolean, optional
+        Whether these are pair statistics (see chanMerge). The default is False.
+
+    Returns
+    -------
+    tuple of 3 numpy arrays
+        One row per start.
+
+    """
+    if n.shape[0] == 0:
+        return n[:0], mean[:0], m2[:0]
+
+    total = np.add.reduceat(n, starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        combinedMean = np.where(total > 0, np.add.reduceat(n*mean, starts, axis=0)/total, 0)
+
+    # Each group's deviation from its combination's mean
+    owner = np.repeat(np.arange(starts.size), np.diff(np.r_[starts, n.shape[0]]))
+    delta = mean - combinedMean[owner]
+    deltaOther = delta.swapaxes(-1, -2) if pairs else delta
+    combinedM2 = np.add.reduceat(m2 + n*delta*deltaOther, starts, axis=0)
+
+    return total, combinedMean, combinedM2
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Per-row data quality bitmask.
+Every filter (inside the wind condition bins, control mode, turbine power
+present, or any user defined flag like curtailment or icing) is one bit of
+a row's mask, so any combination of filters is a bitwise AND over a few
+integer arrays instead of a chain of copied data frames, and changing one
+flag doesn't touch the others.
+"""
+import numpy as np
+
+
+class qualityMask():
+
+    def __init__(self, nRows):
+        """
+        Empty mask (no flags) for nRows rows.
+
+        Parameters
+        ----------
+        nRows : integer
+            Number of rows (time stamps).
+
+        Returns
+        -------
+        qualityMask object
+
+        """
+        self.nRows = nRows
+        # Bit number of each flag, and 64 flags per word
+        self.bits = {}
+        self.words = []
+
+    @property
+    def names(self):
+        """
+        Names of all flags in the mask
+        """
+        return list(self.bits)
+
+    def __position__(self, name):
+        """
+        Word and bit (as a uint64 with only that bit set) of a flag
+        """
+        bit = self.bits[name]
+        return bit // 64, np.uint64(1) << np.uint64(bit % 64)
+
+    def setFlag(self, name, values):
+        """
+        Sets (or replaces) one flag for every row. Other flags are left alone.
+
+        Parameters
+        ----------
+        name : string
+            Name of the flag.
+
+        values : array-like of booleans
+            Whether each row has the flag. Missing values count as False.
+
+        Returns
+        -------
+        None.
+
+        """
+        values = np.asarray(values)
+        if values.shape != (self.nRows,):
+            raise ValueError(f"Flag '{name}' needs one value per row ({self.nRows})")
+        if values.dtype != bool:
+            values = np.nan_to_num(values.astype(float)) != 0
+
+        if name not in self.bits:
+            # Reuse the first free bit
+            used = set(self.bits.values())
+            self.bits[name] = min(set(range(len(used)+1)) - used)
+            if self.bits[name] // 64 >= len(self.words):
+                self.words.append(np.zeros(self.nRows, dtype=np.uint64))
+
+        word, bit = self.__position__(name)
+        self.words[word] &= ~bit
+        self.words[word] |= values.astype(np.uint64) << np.uint64(self.bits[name] % 64)
+
+        return None
+
+    def dropFlag(self, name):
+        """
+        Removes a flag (its bit is reused by the next new flag)
+        """
+        if name in self.bits:
+            word, bit = self.__position__(name)
+            self.words[word] &= ~bit
+            del self.bits[name]
+
+        return None
+
+    def flag(self, name):
+        """
+        Boolean array of whether each row has the flag
+        """
+        word, bit = self.__position__(name)
+        return (self.words[word] & bit) != 0
+
+    def select(self, require=(), exclude=()):
+        """
+        Rows that have every required flag and none of the excluded ones.
+
+        Parameters
+        ----------
+        require : list of strings, optional
+            Flags every selected row must have. The default is none.
+
+        exclude : list of strings, optional
+            Flags no selected row may have. The default is none.
+
+        Returns
+        -------
+        numpy array of booleans
+
+        """
+        requiredBits = [np.uint64(0)]*len(self.words)
+        excludedBits = [np.uint64(0)]*len(self.words)
+        for name in require:
+            word, bit = self.__position__(name)
+            requiredBits[word] |= bit
+        for name in exclude:
+            word, bit = self.__position__(name)
+            excludedBits[word] |= bit
+
+        rows = np.ones(self.nRows, dtype=bool)
+        for word, values in enumerate(self.words):
+            if requiredBits[word]:
+                rows &= (values & requiredBits[word]) == requiredBits[word]
+            if excludedBits[word]:
+                rows &= (values & excludedBits[word]) == 0
+
+        return rows
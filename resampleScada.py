@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Time resampling of scada data onto fixed windows (e.g. 1 Hz data to
+10-minute averages), done with one bincount per column instead of a
+pandas groupby. Wind directions are averaged as unit vectors, so that
+359 and 1 degrees average to 0 rather than 180, other numeric columns are
+averaged arithmetically, and control mode (like any other non-numeric or
+boolean column) takes the most common value in each window.
+"""
+import numpy as np
+import pandas as pd
+
+
+def resampleScada(df, period, wdCols=('wd',), timeCol='time'):
+    """
+    Averages scada data over fixed time windows.
+
+    Parameters
+    ----------
+    df : pandas data frame
+        scada data with a datetime time stamp column.
+
+    period : time difference (e.g. '10min' or pd.Timedelta(minutes=1))
+        Window length. Windows are aligned to midnight (the epoch), so
+        every period that divides a day gives the same windows as
+        pandas resample.
+
+    wdCols : list of strings, optional
+        Wind direction columns (in degrees) to average as unit vectors.
+        The default is ('wd',).
+
+    timeCol : string, optional
+        Name of the time stamp column. The default is 'time'.
+
+    Returns
+    -------
+    pandas data frame
+        One row per window with any data, in time order, with the window
+        start as the time stamp. Columns keep their order. Values are
+        missing where a window has no valid value for that column. Rows
+        without a time stamp are left out.
+
+    """
+    times = pd.DatetimeIndex(pd.to_datetime(df[timeCol])).as_unit('ns')
+    hasTime = ~np.asarray(times.isna())
+    periodNs = pd.Timedelta(period).value
+    if periodNs <= 0:
+        raise ValueError("period must be positive")
+
+    # Nanoseconds since the epoch (UTC for time zone aware stamps)
+    windows = times.asi8[hasTime]//periodNs
+
+    # Dense window numbers when the data spans few empty windows, otherwise sort
+    first = windows.min() if windows.size else 0
+    span = (windows.max() - first + 1) if windows.size else 0
+    if span <= 4*windows.size + 1024:
+        present = np.bincount(windows - first, minlength=span) > 0
+        starts = first + np.flatnonzero(present)
+        position = np.cumsum(present) - 1
+        inverse = position[windows - first]
+    else:
+        starts, inverse = np.unique(windows, return_inverse=True)
+    nWindows = starts.size
+
+    dct = {}
+    for col in df.columns:
+        values = df[col].to_numpy()[hasTime]
+
+        if col == timeCol:
+            windowStarts = pd.DatetimeIndex((starts*periodNs).astype('datetime64[ns]'))
+            if times.tz is not None:
+                windowStarts = windowStarts.tz_localize('UTC').tz_convert(times.tz)
+            dct[col] = windowStarts
+
+        elif col in wdCols:
+            # Circular (vector) mean
+            radians = np.deg2rad(values.astype(np.float64))
+            valid = ~np.isnan(radians)
+            sin = np.bincount(inverse[valid], weights=np.sin(radians[valid]), minlength=nWindows)
+            cos = np.bincount(inverse[valid], weights=np.cos(radians[valid]), minlength=nWindows)
+            counts = np.bincount(inverse[valid], minlength=nWindows)
+            dct[col] = np.where(counts > 0, np.rad2deg(np.arctan2(sin, cos)) % 360, np.nan)
+
+        elif pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+            values = values.astype(np.float64)
+            valid = ~np.isnan(values)
+            sums = np.bincount(inverse[valid], weights=values[valid], minlength=nWindows)
+            counts = np.bincount(inverse[valid], minlength=nWindows)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                dct[col] = np.where(counts > 0, sums/counts, np.nan)
+
+        else:
+            # Most common value (the first in sorted order if tied)
+            codes, uniques = pd.factorize(values, sort=True)
+            valid = codes >= 0
+            nValues = max(uniques.size, 1)
+            counts = np.bincount(inverse[valid]*nValues + codes[valid],
+                                 minlength=nWindows*nValues).reshape(nWindows, nValues)
+            modes = np.append(np.asarray(uniques, dtype=object), None)
+            dct[col] = modes[np.where(counts.max(axis=1) > 0, counts.argmax(axis=1), -1)]
+
+    return pd.DataFrame(dct, columns=df.columns)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Labeled dense array of results, e.g. wind direction bin x wind speed bin
+x control mode x turbine label x metric. Every axis has a name and one
+label per position, so results are selected by label (see sel) and
+combined with plain array arithmetic on aligned axes. Data frames are
+only made when results are exported (see toFrame).
+"""
+import numpy as np
+import pandas as pd
+
+
+class resultCube():
+
+    def __init__(self, values, axes, populated=None):
+        """
+        Parameters
+        ----------
+        values : numpy array
+            One dimension per axis.
+
+        axes : list of tuples
+            (name, labels) of each axis, in the order of the dimensions of
+            values, e.g. [('directionBin', lowerBounds), ..., ('metric',
+            ['averagePower', 'sumPower', 'numObvs'])].
+
+        populated : numpy array of booleans, optional
+            Which cells of the leading axes have data (e.g. which wind
+            condition bins have observations). Exports only keep these.
+            The default None means every cell.
+
+        Returns
+        -------
+        resultCube object
+
+        """
+        self.values = np.asarray(values)
+        self.axes = [(name, np.asarray(labels)) for name, labels in axes]
+        if self.values.ndim != len(self.axes) or any(self.values.shape[i] != labels.size
+                                                     for i, (name, labels) in enumerate(self.axes)):
+            raise ValueError("values must have one dimension per axis, with one position per label")
+        self.populated = None if populated is None else np.asarray(populated, dtype=bool)
+
+    @property
+    def names(self):
+        """
+        Name of each axis
+        """
+        return [name for name, labels in self.axes]
+
+    @property
+    def shape(self):
+        """
+        Shape of the values
+        """
+        return self.values.shape
+
+    def labels(self, name):
+        """
+        Labels of one axis
+        """
+        return self.axes[self.names.index(name)][1]
+
+    def __position__(self, name, label):
+        """
+        Position of a label on an axis
+        """
+        matches = np.flatnonzero(self.labels(name) == label)
+        if not matches.size:
+            raise KeyError(f"'{label}' is not a label of the '{name}' axis")
+        return int(matches[0])
+
+    def sel(self, **labels):
+        """
+        Selects by label. A single label drops its axis, a list of labels
+        keeps the axis with only those labels.
+
+        Parameters
+        ----------
+        **labels : label or list of labels for each axis name
+            e.g. control_mode='baseline', turbineLabel='test'.
+
+        Returns
+        -------
+        resultCube object, or numpy array
+            The values as an array if only the populated (leading) axes
+            are left, otherwise a resultCube.
+
+        """
+        index = []
+        axes = []
+        for name, axisLabels in self.axes:
+            if name not in labels:
+                index.append(slice(None))
+                axes.append((name, axisLabels))
+            elif np.ndim(labels[name]) == 0:
+                index.append(self.__position__(name, labels[name]))
+            else:
+                positions = [self.__position__(name, label) for label in labels[name]]
+                index.append(positions)
+                axes.append((name, axisLabels[positions]))
+
+        # Take one axis at a time so lists of labels don't broadcast together
+        values = self.values
+        for axis in reversed(range(len(index))):
+            values = values[(slice(None),)*axis + (index[axis],)]
+
+        nPopulated = 0 if self.populated is None else self.populated.ndim
+        if self.populated is not None and len(axes) == nPopulated:
+            return values
+
+        return resultCube(values, axes, populated=self.populated)
+
+    def toFrame(self, columnAxes=None):
+        """
+        Exports the cube as a wide data frame, with one row per populated
+        cell of the leading (populated) axes and one column per combination
+        of the labels of the other axes.
+
+        Parameters
+        ----------
+        columnAxes : list of strings, optional
+            Order of the column levels. The default None uses the order of
+            the axes.
+
+        Returns
+        -------
+        pandas data frame
+            Indexed by the labels of the leading axes (a MultiIndex if there
+            is more than one).
+
+        """
+        nRowAxes = 0 if self.populated is None else self.populated.ndim
+        rowAxes = self.names[:nRowAxes]
+        if columnAxes is None:
+            columnAxes = self.names[nRowAxes:]
+
+        order = [self.names.index(name) for name in rowAxes + list(columnAxes)]
+        values = self.values.transpose(order)
+        rowShape = values.shape[:nRowAxes]
+        values = values.reshape(int(np.prod(rowShape)), -1)
+
+        populated = np.ones(rowShape, dtype=bool) if self.populated is None else self.populated
+        positions = np.nonzero(populated)
+        values = values[np.flatnonzero(populated.ravel())]
+
+        rowLabels = [self.labels(name)[pos] for name, pos in zip(rowAxes, positions)]
+        if len(rowAxes) == 1:
+            index = pd.Index(rowLabels[0], name=rowAxes[0])
+        elif rowAxes:
+            index = pd.MultiIndex.from_arrays(rowLabels, names=rowAxes)
+        else:
+            index = None
+
+        if len(columnAxes) == 1:
+            columns = pd.Index(self.labels(columnAxes[0]), name=columnAxes[0])
+        else:
+            columns = pd.MultiIndex.from_product([self.labels(name) for name in columnAxes],
+                                                 names=list(columnAxes))
+
+        return pd.DataFrame(values, index=index, columns=columns)
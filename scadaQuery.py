@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy query plan over scada data.
+A query only records which columns are needed (projection) and which
+quality flags the rows must have or not have (predicates). Nothing is read
+until collect, which combines the predicates into one row mask (see
+qualityMask) and then copies only the selected rows of the selected
+columns in one step, so the extra signals a scada table carries and the
+rows that get filtered out are never copied or reshaped.
+"""
+import numpy as np
+
+
+class scadaQuery():
+
+    def __init__(self, source, mask=None, columns=None, require=(), exclude=()):
+        """
+        Parameters
+        ----------
+        source : pandas data frame, or a function with no arguments returning one
+            The data to query. A function is only called by collect (or rows).
+
+        mask : qualityMask, or a function with no arguments returning one, optional
+            Per-row flags of the source, used for the predicates.
+            The default None means the query can't have predicates.
+
+        columns : list of strings, optional
+            Columns to read. The default None means every column.
+
+        require : list of strings, optional
+            Flags each selected row must have. The default is none.
+
+        exclude : list of strings, optional
+            Flags no selected row may have. The default is none.
+
+        Returns
+        -------
+        scadaQuery object
+
+        """
+        self.source = source
+        self.mask = mask
+        self.columns = None if columns is None else list(dict.fromkeys(columns))
+        self.require = list(dict.fromkeys(require))
+        self.exclude = list(dict.fromkeys(exclude))
+
+    def select(self, columns):
+        """
+        New query that only reads these columns (of the ones already selected).
+
+        Parameters
+        ----------
+        columns : list of strings
+            Column names.
+
+        Returns
+        -------
+        scadaQuery object
+
+        """
+        if self.columns is not None:
+            missing = [col for col in columns if col not in self.columns]
+            if missing:
+                raise KeyError(f"Columns {missing} were projected out of the query")
+
+        return scadaQuery(self.source, self.mask, columns, self.require, self.exclude)
+
+    def where(self, require=(), exclude=()):
+        """
+        New query with more predicates. Predicates are combined with AND.
+
+        Parameters
+        ----------
+        require : list of strings, optional
+            Flags each selected row must have. The default is none.
+
+        exclude : list of strings, optional
+            Flags no selected row may have. The default is none.
+
+        Returns
+        -------
+        scadaQuery object
+
+        """
+        if self.mask is None and (require or exclude):
+            raise ValueError("Query has no quality mask to filter with")
+
+        return scadaQuery(self.source, self.mask, self.columns,
+                          self.require + list(require), self.exclude + list(exclude))
+
+    def explain(self):
+        """
+        Description of the plan, one step per line
+        """
+        lines = [f"read: {'all columns' if self.columns is None else ', '.join(self.columns)}"]
+        if self.require:
+            lines.append(f"require: {', '.join(self.require)}")
+        if self.exclude:
+            lines.append(f"exclude: {', '.join(self.exclude)}")
+        lines.append("collect: one copy of the selected rows and columns")
+
+        return "\n".join(lines)
+
+    def __resolve__(self, obj):
+        """
+        Calls obj if it's a function (the lazy source or mask)
+        """
+        return obj() if callable(obj) else obj
+
+    def rows(self):
+        """
+        Boolean mask of the selected rows of the source, or None if the query
+        has no predicates (every row is selected)
+        """
+        if not (self.require or self.exclude):
+            return None
+
+        return self.__resolve__(self.mask).select(require=self.require, exclude=self.exclude)
+
+    def collect(self):
+        """
+        Runs the query.
+
+        Returns
+        -------
+        pandas data frame
+            The selected rows (in source order, keeping the source's index)
+            and columns (in the order they were selected).
+
+        """
+        rows = self.rows()
+        df = self.__resolve__(self.source)
+        columns = list(df) if self.columns is None else self.columns
+
+        if rows is None or np.all(rows):
+            return df[columns]
+
+        return df.loc[rows, columns]
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of site-specific long-run wind condition PMFs.
+Each site is a directory of plain binary .npy arrays (joint and marginal
+frequencies plus the bin edges), which are opened as read-only memory maps
+the first time they are needed. Nothing is unpickled, so the files don't
+depend on the pandas version, opening many sites costs almost nothing, and
+processes reading the same site share it through the page cache.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+# Arrays stored for every site
+SITE_ARRAYS = ('joint', 'direction', 'speed', 'directionEdges', 'speedEdges')
+
+
+class sitePMF():
+
+    def __init__(self, path):
+        """
+        Read-only PMF for one site. Arrays are memory mapped on first access.
+
+        Parameters
+        ----------
+        path : string
+            Directory containing the site's .npy arrays.
+
+        Returns
+        -------
+        sitePMF object
+
+        """
+        self.path = path
+        self.__arrays__ = {}
+
+    def __memmap__(self, name):
+        """
+        Memory maps one of the site's arrays (only the first time it is needed)
+        """
+        if name not in self.__arrays__:
+            self.__arrays__[name] = np.load(os.path.join(self.path, f'{name}.npy'),
+                                            mmap_mode='r')
+        return self.__arrays__[name]
+
+    @property
+    def joint(self):
+        """
+        2D array of joint frequencies (directions along the rows, speeds along the columns)
+        """
+        return self.__memmap__('joint')
+
+    @property
+    def direction(self):
+        """
+        Marginal wind direction frequencies
+        """
+        return self.__memmap__('direction')
+
+    @property
+    def speed(self):
+        """
+        Marginal wind speed frequencies
+        """
+        return self.__memmap__('speed')
+
+    @property
+    def directionEdges(self):
+        """
+        Wind direction bin edges (lower bounds plus the rightmost edge)
+        """
+        return self.__memmap__('directionEdges')
+
+    @property
+    def speedEdges(self):
+        """
+        Wind speed bin edges (lower bounds plus the rightmost edge)
+        """
+        return self.__memmap__('speedEdges')
+
+    def __positions__(self, values, edges):
+        """
+        Position of each bin lower bound among the site's bins.
+        Values that aren't exactly a lower bound are outside the support.
+        """
+        values = np.asarray(values, dtype=float)
+        lowerBounds = edges[:-1]
+        idx = np.clip(np.searchsorted(lowerBounds, values), 0, lowerBounds.size-1)
+        valid = lowerBounds[idx] == values
+
+        return idx, valid
+
+    def lookup(self, index):
+        """
+        Probability of every wind condition bin in index at once.
+
+        Parameters
+        ----------
+        index : pandas Index or MultiIndex
+            Wind condition bin lower bounds. Levels whose names start with
+            'direction' or 'speed' (e.g. 'directionBinLowerBound' or
+            'directionBin') are used as directions and speeds respectively.
+            Uses the joint PMF if both are present, otherwise a marginal.
+
+        Returns
+        -------
+        probs : numpy array
+            PMF value for each wind condition, in the order of index.
+            Wind conditions outside of the PMF's support have probability zero.
+
+        """
+        directions = None
+        speeds = None
+        for level, name in enumerate(index.names):
+            if name is None:
+                continue
+            if name.startswith('direction'):
+                directions = index.get_level_values(level)
+            elif name.startswith('speed'):
+                speeds = index.get_level_values(level)
+
+        if directions is None and speeds is None:
+            raise ValueError("Index levels must be named for wind direction and/or speed")
+
+        if directions is not None and speeds is not None:
+            dirIdx, dirValid = self.__positions__(directions, self.directionEdges)
+            speedIdx, speedValid = self.__positions__(speeds, self.speedEdges)
+            valid = dirValid & speedValid
+            probs = np.zeros(valid.size, dtype=float)
+            probs[valid] = self.joint[dirIdx[valid], speedIdx[valid]]
+        elif directions is not None:
+            dirIdx, valid = self.__positions__(directions, self.directionEdges)
+            probs = np.zeros(valid.size, dtype=float)
+            probs[valid] = self.direction[dirIdx[valid]]
+        else:
+            speedIdx, valid = self.__positions__(speeds, self.speedEdges)
+            probs = np.zeros(valid.size, dtype=float)
+            probs[valid] = self.speed[speedIdx[valid]]
+
+        return probs
+
+    def __call__(self, df):
+        """
+        Same as lookup(df.index), so a sitePMF can be used as the pmf
+        attribute of an energyGain object.
+        """
+        return self.lookup(df.index)
+
+
+class sitePMFRegistry():
+
+    def __init__(self, root=None):
+        """
+        Collection of site PMFs stored under one directory, one subdirectory per site.
+
+        Parameters
+        ----------
+        root : string, optional
+            Directory holding the sites. The default None uses the sitePMFs
+            directory next to this module.
+
+        Returns
+        -------
+        sitePMFRegistry object
+
+        """
+        if root is None:
+            root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sitePMFs')
+
+        self.root = root
+        self.__opened__ = {}
+
+    def sites(self):
+        """
+        Names of all the sites in the registry
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(site for site in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, site)))
+
+    def open(self, site):
+        """
+        Returns the (lazily memory mapped) PMF for a site.
+        Opening the same site again returns the same object.
+
+        Parameters
+        ----------
+        site : string
+            Name of the site
+
+        Returns
+        -------
+        sitePMF object
+
+        """
+        if site not in self.__opened__:
+            path = os.path.join(self.root, site)
+            if not os.path.isdir(path):
+                raise KeyError(f"No PMF for site '{site}' in {self.root}")
+            self.__opened__[site] = sitePMF(path)
+
+        return self.__opened__[site]
+
+    def addSite(self, site, joint, direction, speed, directionEdges, speedEdges):
+        """
+        Writes a site's PMF arrays to the registry (overwriting any existing ones)
+
+        Parameters
+        ----------
+        site : string
+            Name of the site
+
+        joint : 2D array-like of numerics
+            Joint frequencies, with one row per direction bin and one column per speed bin
+
+        direction : array-like of numerics
+            Marginal wind direction frequencies, one per direction bin
+
+        speed : array-like of numerics
+            Marginal wind speed frequencies, one per speed bin
+
+        directionEdges : array-like of numerics
+            Monotonic increasing wind direction bin edges (one more than the number of bins)
+
+        speedEdges : array-like of numerics
+            Monotonic increasing wind speed bin edges (one more than the number of bins)
+
+        Returns
+        -------
+        sitePMF object for the new site
+
+        """
+        arrays = {'joint': np.asarray(joint, dtype=np.float64),
+                  'direction': np.asarray(direction, dtype=np.float64),
+                  'speed': np.asarray(speed, dtype=np.float64),
+                  'directionEdges': np.asarray(directionEdges, dtype=np.float64),
+                  'speedEdges': np.asarray(speedEdges, dtype=np.float64)}
+
+        nDirs = arrays['directionEdges'].size - 1
+        nSpeeds = arrays['speedEdges'].size - 1
+        if (arrays['joint'].shape != (nDirs, nSpeeds) or arrays['direction'].size != nDirs
+                or arrays['speed'].size != nSpeeds):
+            raise ValueError("PMF shapes don't match the number of bins")
+
+        path = os.path.join(self.root, site)
+        os.makedirs(path, exist_ok=True)
+        for name in SITE_ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), arrays[name], allow_pickle=False)
+
+        # Forget any stale memory maps of this site
+        self.__opened__.pop(site, None)
+
+        return self.open(site)
+
+
+def convertPickledPMF(site, joint, direction, speed, registry=None):
+    """
+    Imports PMF tables in the pickled pandas format of jointPMFdf_albaincourt,
+    directionPMFdf_albaincourt and speedPMFdf_albaincourt into a registry.
+    Bins missing from the joint table get a frequency of zero.
+
+    Parameters
+    ----------
+    site : string
+        Name of the site in the registry
+
+    joint : string or pandas data frame
+        Path to (or contents of) the joint table, indexed by
+        'directionBinLowerBound' and 'speedBinLowerBound' with a 'freq' column
+
+    direction : string or pandas data frame
+        Path to (or contents of) the marginal direction table,
+        indexed by 'directionBinLowerBound' with a 'freq' column
+
+    speed : string or pandas data frame
+        Path to (or contents of) the marginal speed table,
+        indexed by 'speedBinLowerBound' with a 'freq' column
+
+    registry : sitePMFRegistry, optional
+        The default None uses the default registry
+
+    Returns
+    -------
+    sitePMF object for the new site
+
+    """
+    if registry is None:
+        registry = sitePMFRegistry()
+
+    tables = [pd.read_pickle(table) if isinstance(table, str) else table
+              for table in (joint, direction, speed)]
+    joint, direction, speed = [table['freq'] for table in tables]
+
+    joint = joint.reorder_levels(["directionBinLowerBound", "speedBinLowerBound"])
+
+    # All lower bounds that appear in the joint or marginal tables
+    dirLower = np.union1d(joint.index.get_level_values(0), direction.index)
+    speedLower = np.union1d(joint.index.get_level_values(1), speed.index)
+
+    # Rightmost edge, assuming the last bin is as wide as the narrowest bin
+    directionEdges = np.append(dirLower, dirLower[-1] + np.min(np.diff(dirLower)))
+    speedEdges = np.append(speedLower, speedLower[-1] + np.min(np.diff(speedLower)))
+
+    dense = np.zeros((dirLower.size, speedLower.size))
+    dense[np.searchsorted(dirLower, joint.index.get_level_values(0)),
+          np.searchsorted(speedLower, joint.index.get_level_values(1))] = joint.to_numpy()
+
+    return registry.addSite(site,
+                            joint=dense,
+                            direction=direction.reindex(dirLower, fill_value=0).to_numpy(),
+                            speed=speed.reindex(speedLower, fill_value=0).to_numpy(),
+                            directionEdges=directionEdges,
+                            speedEdges=speedEdges)
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the numerical kernels behind energyGain against the pandas
+operations they replace.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from energyGain import energyGain
+from pmfGrid import pmfGrid, edgePositions
+from powerMatrix import powerMatrix, sortedTimeIndex, timeSlice
+from powerStats import powerStats, chanMerge, chanReduce
+from resampleScada import resampleScada
+from resultCube import resultCube
+from windClimate import asofPositions, histogramPMF, histogramPMFnd
+
+
+def randomTimes(n, seed=0):
+    """
+    Unsorted minute time stamps with repeats and a few missing ones
+    """
+    prng = np.random.default_rng(seed)
+    times = pd.Timestamp('2020-01-01') + pd.to_timedelta(prng.integers(0, 500, n), unit='min')
+    times = pd.Series(times)
+    times[prng.choice(n, 10, replace=False)] = pd.NaT
+
+    return times.to_numpy()
+
+
+def test_timeSlice_matches_boolean_mask():
+    times = randomTimes(1000)
+    order, sortedTimes = sortedTimeIndex(times)
+    assert sortedTimes.size == 990
+    assert np.all(np.diff(sortedTimes) >= np.timedelta64(0))
+
+    for start, end in [('2020-01-01 01:00', '2020-01-01 02:30'),
+                       (None, '2020-01-01 03:00'),
+                       ('2020-01-01 05:00', None),
+                       (None, None),
+                       ('2020-01-01 02:00', '2020-01-01 01:00'),
+                       ('2019-01-01', '2019-02-01')]:
+        expected = pd.Series(times).notna()
+        if start is not None:
+            expected &= times >= pd.Timestamp(start)
+        if end is not None:
+            expected &= times < pd.Timestamp(end)
+        rows = order[timeSlice(sortedTimes, start, end)]
+        np.testing.assert_array_equal(np.sort(rows), np.flatnonzero(expected))
+
+
+def test_resampleScada_matches_pandas_resample():
+    prng = np.random.default_rng(1)
+    n = 2000
+    # Seconds over a few hours with a gap, so some windows are empty
+    seconds = np.sort(np.r_[prng.integers(0, 3600, n//2), prng.integers(7200, 14400, n//2)])
+    df = pd.DataFrame({'time': pd.Timestamp('2020-01-01') + pd.to_timedelta(seconds, unit='s'),
+                       'wd': prng.uniform(0, 360, n),
+                       'ws': prng.uniform(0, 20, n),
+                       'pow_000': prng.normal(1000, 100, n),
+                       'control_mode': prng.choice(['baseline', 'controlled'], n)})
+    # A window with no power at all, and missing values elsewhere
+    df.loc[df['time'] < pd.Timestamp('2020-01-01 00:10'), 'pow_000'] = np.nan
+    df.loc[prng.choice(n, 100, replace=False), 'ws'] = np.nan
+
+    result = resampleScada(df, '10min').set_index('time')
+    expected = df.set_index('time').resample('10min')
+    counts = expected.size()
+    expected_means = expected[['ws', 'pow_000']].mean()[counts > 0]
+
+    np.testing.assert_array_equal(result.index, expected_means.index)
+    np.testing.assert_allclose(result[['ws', 'pow_000']], expected_means)
+    assert result['pow_000'].isna().sum() == 1
+
+    radians = np.deg2rad(df.set_index('time')['wd'])
+    sin = np.sin(radians).resample('10min').sum()[counts > 0]
+    cos = np.cos(radians).resample('10min').sum()[counts > 0]
+    np.testing.assert_allclose(result['wd'], np.rad2deg(np.arctan2(sin, cos)) % 360)
+
+    # Ties go to the first value in sorted order, like value_counts sorted by label
+    modes = df.set_index('time')['control_mode'].resample('10min').agg(
+        lambda s: s.value_counts().sort_index().idxmax() if s.size else None)[counts > 0]
+    np.testing.assert_array_equal(result['control_mode'], modes)
+
+
+def test_resampleScada_circular_mean():
+    df = pd.DataFrame({'time': pd.to_datetime(['2020-01-01 00:00', '2020-01-01 00:01']),
+                       'wd': [359.0, 1.0]})
+    result = resampleScada(df, '10min')
+    assert result.shape[0] == 1
+    assert min(result['wd'][0], 360 - result['wd'][0]) < 1e-9
+
+
+def test_asofPositions_matches_merge_asof():
+    prng = np.random.default_rng(2)
+    start = pd.Timestamp('2020-01-01')
+    # Even minutes with repeats on one side, every minute on the other,
+    # so 'nearest' has exact ties between the stamps before and after
+    sortedTimes = np.sort((start + pd.to_timedelta(2*prng.integers(0, 200, 300), unit='min')).to_numpy())
+    times = (start + pd.to_timedelta(prng.integers(-10, 410, 500), unit='min')).to_numpy()
+
+    left = pd.DataFrame({'time': times, 'row': np.arange(times.size)}).sort_values('time')
+    right = pd.DataFrame({'time': sortedTimes, 'position': np.arange(sortedTimes.size)})
+    for direction in ['backward', 'forward', 'nearest']:
+        for tolerance in [None, pd.Timedelta('1min'), pd.Timedelta(0)]:
+            expected = pd.merge_asof(left, right, on='time', direction=direction,
+                                     tolerance=tolerance).sort_values('row')['position']
+            positions = asofPositions(times, sortedTimes, tolerance=tolerance, direction=direction)
+            np.testing.assert_array_equal(positions, expected.fillna(-1).astype(np.int64))
+
+
+def test_asofPositions_missing_and_empty():
+    sortedTimes = pd.to_datetime(['2020-01-01 00:00', '2020-01-01 00:10']).to_numpy()
+    times = pd.to_datetime(['2020-01-01 00:05', None]).to_numpy()
+    np.testing.assert_array_equal(asofPositions(times, sortedTimes), [0, -1])
+    np.testing.assert_array_equal(asofPositions(times, sortedTimes[:0], direction='nearest'), [-1, -1])
+
+
+def test_chanMerge_and_chanReduce_match_full_pass():
+    prng = np.random.default_rng(3)
+    values = prng.normal(50, 5, 40)
+    sizes = [0, 0, 7, 1, 20, 12]
+    parts = np.split(values, np.cumsum(sizes)[:-1])
+    n = np.array([[part.size] for part in parts], dtype=float)
+    mean = np.array([[part.mean() if part.size else 0] for part in parts])
+    m2 = np.array([[((part - part.mean())**2).sum() if part.size else 0] for part in parts])
+
+    count, combinedMean, combinedM2 = n[0], mean[0], m2[0]
+    for i in range(1, len(parts)):
+        count, combinedMean, combinedM2 = chanMerge(count, combinedMean, combinedM2, n[i], mean[i], m2[i])
+    np.testing.assert_allclose([count[0], combinedMean[0], combinedM2[0]/(count[0] - 1)],
+                               [values.size, values.mean(), values.var(ddof=1)])
+
+    # The first two sets (both empty) and the other four
+    count, combinedMean, combinedM2 = chanReduce(n, mean, m2, np.array([0, 2]))
+    np.testing.assert_array_equal(count[:, 0], [0, values.size])
+    assert combinedMean[0, 0] == 0 and combinedM2[0, 0] == 0
+    np.testing.assert_allclose(combinedM2[1, 0]/(values.size - 1), values.var(ddof=1))
+
+
+def binnedScada(n, controlModes, seed):
+    """
+    Binned scada data with one reference and three test turbines, missing
+    power, rows outside of the bins and bins without any rows
+    """
+    prng = np.random.default_rng(seed)
+    df = pd.DataFrame({'directionBinCode': prng.choice([-1, 0, 1, 3], n),
+                       'speedBinCode': prng.choice([0, 1, 2], n),
+                       'control_mode': prng.choice(controlModes, n)})
+    for number in range(4):
+        power = prng.normal(1000 + 100*number, 50, n)
+        power[prng.random(n) < 0.2] = np.nan
+        df["pow_{:03.0f}".format(number)] = power
+    df.loc[df.index[:5], ['pow_001', 'pow_002', 'pow_003']] = np.nan
+
+    return df
+
+
+def expectedStats(df, controlMode):
+    """
+    Per-bin statistics the pandas way
+    """
+    df = df[(df['directionBinCode'] >= 0) & (df['control_mode'] == controlMode)]
+    groups = df.groupby(df['directionBinCode']*3 + df['speedBinCode'])
+    powerCols = ["pow_{:03.0f}".format(number) for number in range(4)]
+
+    return groups[powerCols], groups[powerCols[1:]].cov()
+
+
+def checkStats(stats, df, controlMode):
+    groups, covariance = expectedStats(df, controlMode)
+    np.testing.assert_array_equal(stats['binCodes'], list(groups.groups))
+    np.testing.assert_array_equal(stats['count'], groups.count())
+    np.testing.assert_allclose(stats['mean'], groups.mean())
+    np.testing.assert_allclose(stats['var'], groups.var(), equal_nan=True)
+    np.testing.assert_allclose(stats['covariance'],
+                               covariance.to_numpy().reshape(-1, 3, 3), equal_nan=True)
+
+
+def test_powerStats_matches_groupby():
+    df = binnedScada(3000, ['baseline', 'controlled'], seed=4)
+    binVars = [('directionBin', np.arange(0, 50, 10)), ('speedBin', np.arange(0, 16, 5))]
+    stats = powerStats(powerMatrix(df, [0], [1, 2, 3], binVars), chunkSize=256)
+
+    for controlMode in ['baseline', 'controlled']:
+        checkStats(stats.stats(controlMode), df, controlMode)
+
+    # Direction bin 2 never has any rows
+    assert not np.any(stats.binCodes//3 == 2)
+
+
+def test_powerStats_merge_matches_one_pass():
+    # 'wake steering' only happens in the second campaign
+    first = binnedScada(1500, ['baseline', 'controlled'], seed=5)
+    second = binnedScada(1000, ['baseline', 'wake steering'], seed=6)
+    second[["pow_{:03.0f}".format(number) for number in range(4)]] += 30
+    binVars = [('directionBin', np.arange(0, 50, 10)), ('speedBin', np.arange(0, 16, 5))]
+
+    merged = powerStats(powerMatrix(first, [0], [1, 2, 3], binVars)).merge(
+        powerStats(powerMatrix(second, [0], [1, 2, 3], binVars)))
+    both = pd.concat([first, second], ignore_index=True)
+    onePass = powerStats(powerMatrix(both, [0], [1, 2, 3], binVars))
+
+    np.testing.assert_array_equal(merged.controlModes, onePass.controlModes)
+    for controlMode in ['baseline', 'controlled', 'wake steering']:
+        checkStats(merged.stats(controlMode), both, controlMode)
+    for stat in ['count', 'sum', 'mean', 'var', 'pairCount', 'covariance']:
+        np.testing.assert_allclose(merged.stats()[stat], onePass.stats()[stat], equal_nan=True)
+
+
+def scadaFrame(n, seed):
+    """
+    10-minute scada data with one reference and two test turbines
+    """
+    prng = np.random.default_rng(seed)
+    df = pd.DataFrame({'time': pd.Timestamp('2020-01-01') + pd.to_timedelta(10*np.arange(n), unit='min'),
+                       'wd': prng.uniform(0, 360, n),
+                       'ws': prng.uniform(0, 20, n),
+                       'control_mode': prng.choice(['baseline', 'controlled'], n)})
+    for number in range(3):
+        power = prng.normal(1000 + 100*number, 100, n)
+        power[prng.random(n) < 0.1] = np.nan
+        df["pow_{:03.0f}".format(number)] = power
+
+    return df
+
+
+def energyGainObject(**kwargs):
+    return energyGain(scadaFrame(3000, seed=7), None,
+                      directionBins=np.arange(0, 361, 90),
+                      speedBins=np.arange(0, 21, 5),
+                      wind=scadaFrame(5000, seed=8)[['wd', 'ws']],
+                      wdColWind='wd',
+                      wsColWind='ws',
+                      testTurbines=[1, 2],
+                      referenceTurbines=[0],
+                      **kwargs)
+
+
+def test_binPowerQuantiles_matches_groupby():
+    eg = energyGainObject()
+    df = eg.scada.copy()
+    df['directionBin'] = pd.cut(df['wd'], eg.directionBins, right=False, labels=eg.directionBins[:-1])
+    df['speedBin'] = pd.cut(df['ws'], eg.speedBins, right=False, labels=eg.speedBins[:-1])
+    dfLong = df.melt(id_vars=['directionBin', 'speedBin', 'control_mode'],
+                     value_vars=['pow_001', 'pow_002'], value_name='power')
+
+    for controlMode in [None, 'controlled']:
+        rows = dfLong if controlMode is None else dfLong[dfLong['control_mode'] == controlMode]
+        expected = rows.groupby(['directionBin', 'speedBin'], observed=True)['power'].quantile([0.1, 0.5]).unstack()
+        for clusterBins in [False, True]:
+            eg.clusterBins = clusterBins
+            result = eg.binPowerQuantiles([0.1, 0.5], controlMode=controlMode)
+            np.testing.assert_allclose(result, expected)
+            np.testing.assert_array_equal(result.index.get_level_values('speedBin'),
+                                          expected.index.get_level_values('speedBin').astype(float))
+
+
+def test_histogramPMF_excludes_last_edge_like_histogramPMFnd():
+    wind = pd.DataFrame({'wd': [0.0, 90.0, 359.9, 360.0, 45.0, 180.0],
+                         'ws': [5.0, 20.0, 3.0, 3.0, np.nan, 0.0]})
+    directionBins = np.arange(0, 361, 90)
+    speedBins = np.arange(0, 21, 5)
+
+    joint = histogramPMF(wind, speedBins=speedBins, directionBins=directionBins, returnDense=True)
+    np.testing.assert_array_equal(joint['pmf'], histogramPMFnd(wind, ['wd', 'ws'], [directionBins, speedBins]))
+    # 90 degrees at 20 m/s and 360 degrees are on the last edges
+    assert joint['pmf'].sum() == 3/6
+    np.testing.assert_array_equal(histogramPMF(wind, speedBins=speedBins), [3/6, 1/6, 0, 0])
+    np.testing.assert_array_equal(histogramPMF(wind, directionBins=directionBins), [2/6, 1/6, 1/6, 1/6])
+
+
+def test_rebinnedAveragePower_matches_averagePower():
+    eg = energyGainObject()
+    for directionBins, speedBins in [(eg.directionBins, eg.speedBins),
+                                     (np.arange(0, 361, 30), np.arange(2, 19.5, 0.5)),
+                                     (np.array([45, 135]), np.array([5, 12.25]))]:
+        eg.setBins(directionBins=directionBins, speedBins=speedBins)
+        expected = eg.averagePower()
+        result = eg.rebinnedAveragePower(directionStep=1.0, speedStep=0.25)
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_exact=False)
+
+
+def test_pmfGrid_matches_histogram():
+    wind = scadaFrame(5000, seed=9)[['wd', 'ws']]
+    # Values exactly on fine and coarse edges, including the last ones
+    wind.loc[:3, 'wd'] = [90.0, 270.0, 360.0, 0.0]
+    wind.loc[:3, 'ws'] = [5.0, 12.5, 20.0, 0.0]
+    grid = pmfGrid(wind, directionStep=1.0, speedStep=0.5)
+
+    directionBins = np.arange(0, 361, 45)
+    speedBins = np.arange(0, 20.5, 2.5)
+    expected = histogramPMFnd(wind, ['wd', 'ws'], [directionBins, speedBins])
+    np.testing.assert_allclose(grid.pmf(directionBins, speedBins, returnDense=True)['pmf'], expected)
+    np.testing.assert_allclose(grid.pmf(speedBins=speedBins), histogramPMFnd(wind, ['ws'], [speedBins]))
+    np.testing.assert_allclose(grid.pmf(directionBins=directionBins),
+                               histogramPMFnd(wind, ['wd'], [directionBins]))
+
+
+def test_edgePositions_rejects_edges_off_or_outside_the_grid():
+    edges = np.arange(0, 40.05, 0.5)
+    np.testing.assert_array_equal(edgePositions([0, 2.5, 40], edges, 0.5), [0, 5, 80])
+    for bins in [[0, 2.25, 5], [0, 40.5], [-0.5, 5]]:
+        with pytest.raises(ValueError):
+            edgePositions(bins, edges, 0.5)
+
+
+def test_powerCube_path_matches_frame_path():
+    eg = energyGainObject()
+    for useReference in [True, False]:
+        expected = eg.computeAll(useReference=useReference, dfAvgPower=eg.averagePower().copy())
+        result = eg.computeAll(useReference=useReference)
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_exact=False)
+
+        for aepMethod in [1, 2]:
+            for absolute in [True, False]:
+                df = eg.computeAll(useReference=useReference, dfAvgPower=eg.averagePower().copy())
+                expected = eg.aepGain(aepMethod=aepMethod, absolute=absolute,
+                                      useReference=useReference, df=df)[1]
+                result = eg.aepGain(aepMethod=aepMethod, absolute=absolute,
+                                    useReference=useReference)[1]
+                assert np.isclose(result, expected)
+
+
+def test_resultCube_sel_by_scalar_and_list():
+    values = np.arange(2*3*2*4).reshape(2, 3, 2, 4)
+    populated = np.array([[True, False, True], [True, True, False]])
+    cube = resultCube(values, [('directionBin', [0.0, 180.0]),
+                               ('speedBin', [0.0, 5.0, 10.0]),
+                               ('control_mode', ['baseline', 'controlled']),
+                               ('metric', ['a', 'b', 'c', 'd'])],
+                      populated=populated)
+
+    # Scalars on every other axis leave just the populated axes, as an array
+    np.testing.assert_array_equal(cube.sel(control_mode='controlled', metric='c'), values[:, :, 1, 2])
+
+    selected = cube.sel(control_mode='baseline', metric=['d', 'a'])
+    assert selected.names == ['directionBin', 'speedBin', 'metric']
+    np.testing.assert_array_equal(selected.labels('metric'), ['d', 'a'])
+    np.testing.assert_array_equal(selected.values, values[:, :, 0][..., [3, 0]])
+
+    frame = selected.toFrame()
+    assert list(frame.index) == [(0.0, 0.0), (0.0, 10.0), (180.0, 0.0), (180.0, 5.0)]
+    np.testing.assert_array_equal(frame['a'], values[:, :, 0, 0][populated])
+
+    with pytest.raises(KeyError):
+        cube.sel(metric='e')
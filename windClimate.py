@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+Long term wind climate shared between energyGain objects.
+A windClimate owns a wind condition time series and remembers the PMFs
+computed from it, so any number of analyses can use the same data and
+histograms by holding a reference to one object.
+"""
+import numpy as np
+import pandas as pd
+from pmfGrid import pmfGrid
+from powerMatrix import sortedTimeIndex
+
+
+class windClimate():
+
+    def __init__(self,
+                 dfWind,
+                 wdColWind=None,
+                 wsColWind=None,
+                 gridSteps=None):
+        """
+        Creates a windClimate object
+
+        Parameters
+        ----------
+        dfWind : pandas dataframe
+            data frame with a column for wind direction measurements and/or a 
+            column for wind speed measurements, taken at (assumed uniform) 
+            time stamps. Treated as read-only: the PMFs computed from it are
+            remembered, so modifying it afterwards gives stale PMFs.
+
+        wdColWind : string, optional
+            Name of the wind direction column in the wind condition time series.
+            The default None means 'wd'.
+
+        wsColWind : string, optional
+            Name of the wind speed column in the wind condition time series.
+            The default None means 'ws'.
+
+        gridSteps : tuple of 2 floats, optional
+            (direction step, speed step) of a fine grid to histogram the wind
+            time series on once (see pmfGrid). PMFs for any bins that line up
+            with this grid are then read from it instead of re-histogramming
+            the time series, e.g. (0.1, 0.05).
+            The default None always histograms the time series.
+
+        Returns
+        -------
+        windClimate object
+
+        """
+        if wdColWind is None:
+            wdColWind = 'wd'
+        if wsColWind is None:
+            wsColWind = 'ws'
+
+        self.wind = dfWind
+        self.wdColWind = wdColWind
+        self.wsColWind = wsColWind
+        self.gridSteps = gridSteps
+        self.windGrid = None
+        # PMFs are only computed when they are first needed, then stored here
+        self.__pmfCache__ = {}
+        # Sorted time index of the wind time series (see align)
+        self.__timeIndex__ = {}
+
+    @property
+    def nObvs(self):
+        """
+        Number of time stamps in the wind condition time series
+        (including any outside of the wind condition bins)
+        """
+        return self.wind.shape[0]
+
+    def pmf(self, directionBins=None, speedBins=None):
+        """
+        Returns the joint or marginal PMF for the given bins, only 
+        calculating it if it has not already been calculated for these bins.
+
+        Parameters
+        ----------
+        directionBins : numeric numpy array, optional
+            Edges for the wind direction in degrees. Bin membership is 
+            left edge inclusive, right edge exclusive. The default None means
+            we will ignore wind direction.
+
+        speedBins : numeric numpy array, optional
+            Edges for the wind speed in m/s. Bin membership is 
+            left edge inclusive, right edge exclusive. The default None means
+            we will ignore wind speed.
+
+        Returns
+        -------
+        pandas Series (see histogramPMF)
+
+        """
+        if directionBins is not None:
+            directionBins = np.asarray(directionBins, dtype=float)
+        if speedBins is not None:
+            speedBins = np.asarray(speedBins, dtype=float)
+
+        key = (None if directionBins is None else directionBins.tobytes(),
+               None if speedBins is None else speedBins.tobytes())
+
+        if key not in self.__pmfCache__ and self.gridSteps is not None:
+            # The fine grid costs one pass over the time series, so it is
+            # only built once a PMF is actually needed
+            if self.windGrid is None:
+                self.windGrid = pmfGrid(self.wind,
+                                        wdColWind=self.wdColWind,
+                                        wsColWind=self.wsColWind,
+                                        directionStep=self.gridSteps[0],
+                                        speedStep=self.gridSteps[1])
+            try:
+                self.__pmfCache__[key] = self.windGrid.pmf(directionBins=directionBins,
+                                                           speedBins=speedBins)
+            except ValueError:
+                # Bins don't line up with the fine grid, so use the time series
+                pass
+
+        if key not in self.__pmfCache__:
+            self.__pmfCache__[key] = histogramPMF(dfWind=self.wind,
+                                                  speedBins=speedBins,
+                                                  directionBins=directionBins,
+                                                  wdColWind=self.wdColWind,
+                                                  wsColWind=self.wsColWind)
+
+        return self.__pmfCache__[key]
+
+    def hasColumns(self, columns):
+        """
+        Whether the wind condition time series has all of the given columns
+        """
+        return all(col in self.wind for col in columns)
+
+    def align(self, times, columns=None, timeCol='time', tolerance=None, direction='backward'):
+        """
+        Values of the wind time series at other time stamps (e.g. the scada
+        data's), like pandas.merge_asof: the wind time stamps are sorted 
+        once and each time stamp is matched by binary search.
+
+        Parameters
+        ----------
+        times : array-like of time stamps
+            Time stamps to match.
+
+        columns : list of strings, optional
+            Columns of the wind time series to return. 
+            The default None means the wind direction and speed columns.
+
+        timeCol : string, optional
+            Name of the time stamp column of the wind time series. If it 
+            isn't a column, the index is used. The default is 'time'.
+
+        tolerance : time difference, optional
+            Largest time difference to match. The default None means any.
+
+        direction : string, optional
+            'backward' matches the last wind time stamp at or before each 
+            time stamp, 'forward' the first at or after it, and 'nearest' 
+            the closest one (the earlier one if tied).
+            The default is 'backward'.
+
+        Returns
+        -------
+        pandas data frame
+            One row per time stamp, in the order of times. Values are 
+            missing where nothing matched.
+
+        """
+        if columns is None:
+            columns = [col for col in [self.wdColWind, self.wsColWind] if col in self.wind]
+
+        if timeCol not in self.__timeIndex__:
+            windTimes = self.wind[timeCol] if timeCol in self.wind else self.wind.index
+            self.__timeIndex__[timeCol] = sortedTimeIndex(np.asarray(windTimes))
+        order, windTimes = self.__timeIndex__[timeCol]
+
+        positions = asofPositions(np.asarray(times), windTimes, tolerance=tolerance, direction=direction)
+        matched = positions >= 0
+        rows = order[np.where(matched, positions, 0)]
+
+        dct = {}
+        for col in columns:
+            values = self.wind[col].to_numpy()[rows]
+            if not matched.all():
+                values = np.where(matched, values.astype(np.float64 if values.dtype.kind in 'biuf' else object), np.nan)
+            dct[col] = values
+
+        return pd.DataFrame(dct)
+
+    def pmfND(self, columns, binEdges):
+        """
+        Joint PMF over any number of binned columns of the wind time series,
+        only calculating it if it has not already been calculated for these 
+        columns and bins (see histogramPMFnd).
+
+        Parameters
+        ----------
+        columns : list of strings
+            Columns of the wind condition time series to bin.
+
+        binEdges : list of numeric numpy arrays
+            Monotonic increasing bin edges for each column.
+
+        Returns
+        -------
+        numpy array with one dimension per column
+
+        """
+        binEdges = [np.asarray(edges, dtype=float) for edges in binEdges]
+        key = ('nd',) + tuple((col, edges.tobytes()) for col, edges in zip(columns, binEdges))
+
+        if key not in self.__pmfCache__:
+            self.__pmfCache__[key] = histogramPMFnd(self.wind, columns, binEdges)
+
+        return self.__pmfCache__[key]
+
+
+def asofPositions(times, sortedTimes, tolerance=None, direction='backward'):
+    """
+    Position of the matching time stamp in sortedTimes for each time stamp,
+    by binary search (see windClimate.align).
+
+    Parameters
+    ----------
+    times : numpy array
+        Time stamps to match. Missing ones don't match anything.
+
+    sortedTimes : numpy array
+        Sorted time stamps without missing values (see sortedTimeIndex).
+
+    tolerance : time difference, optional
+        Largest time difference to match. The default None means any.
+
+    direction : string, optional
+        'backward', 'forward' or 'nearest'. The default is 'backward'.
+
+    Returns
+    -------
+    numpy array of integers
+        -1 where nothing matched.
+
+    """
+    if direction not in ['backward', 'forward', 'nearest']:
+        raise ValueError("direction must be 'backward', 'forward' or 'nearest'")
+
+    times = np.asarray(times)
+    if sortedTimes.dtype.kind == 'M':
+        times = pd.to_datetime(times).to_numpy()
+    missing = pd.isna(times)
+    n = sortedTimes.size
+    if n == 0:
+        return np.full(times.shape, -1, dtype=np.int64)
+
+    # Last sorted time stamp at or before, and first at or after, each time stamp
+    before = np.searchsorted(sortedTimes, times, side='right') - 1
+    after = np.searchsorted(sortedTimes, times, side='left')
+    hasBefore = (before >= 0) & ~missing
+    hasAfter = (after < n) & ~missing
+    before = np.clip(before, 0, n-1)
+    after = np.clip(after, 0, n-1)
+
+    # Only used where there is a match on that side
+    gapBefore = times - sortedTimes[before]
+    gapAfter = sortedTimes[after] - times
+
+    if direction == 'backward':
+        positions, gaps, found = before, gapBefore, hasBefore
+    elif direction == 'forward':
+        positions, gaps, found = after, gapAfter, hasAfter
+    else:
+        useAfter = hasAfter & (~hasBefore | (gapAfter < gapBefore))
+        positions = np.where(useAfter, after, before)
+        gaps = np.where(useAfter, gapAfter, gapBefore)
+        found = hasBefore | hasAfter
+
+    if tolerance is not None:
+        if sortedTimes.dtype.kind == 'M':
+            tolerance = pd.Timedelta(tolerance).to_timedelta64()
+        found = found & (gaps <= tolerance)
+
+    return np.where(found, positions, -1).astype(np.int64)
+
+
+def histogramPMFnd(dfWind, columns, binEdges):
+    """
+    Joint PMF over any number of binned columns, from one combined 
+    (raveled) bin code per row. Bin membership is left edge inclusive, 
+    right edge exclusive for every bin, like energyGain.binAdder.
+
+    Parameters
+    ----------
+    dfWind : pandas dataframe
+        data frame with the columns to bin
+
+    columns : list of strings
+        Columns to bin.
+
+    binEdges : list of numeric numpy arrays
+        Monotonic increasing bin edges for each column.
+
+    Returns
+    -------
+    freqs : numpy array
+        One dimension per column (in the order of columns). Frequencies are
+        with respect to all rows, including rows outside of the bins.
+
+    """
+    binEdges = [np.asarray(edges, dtype=float) for edges in binEdges]
+    shape = tuple(edges.size-1 for edges in binEdges)
+
+    inBins = np.ones(dfWind.shape[0], dtype=bool)
+    positions = []
+    for col, edges in zip(columns, binEdges):
+        pos = np.searchsorted(edges, np.asarray(dfWind[col], dtype=float), side='right') - 1
+        # Missing values get sorted past the last edge, so they are outside too
+        inBins &= (pos >= 0) & (pos < edges.size-1)
+        positions.append(pos)
+
+    codes = np.ravel_multi_index([pos[inBins] for pos in positions], shape)
+    counts = np.bincount(codes, minlength=int(np.prod(shape)))
+
+    return (counts/max(dfWind.shape[0], 1)).reshape(shape)
+
+
+def histogramPMF(dfWind,
+                 speedBins=None,
+                 directionBins=None,
+                 wdColWind=None,
+                 wsColWind=None,
+                 returnDense=False):
+    """
+    Calculates the joint or marginal PMF based on the provided 
+    wind condition bins
+
+    Parameters
+    ----------
+    dfWind : pandas dataframe
+        data frame with a column for wind direction measurements and/or a 
+        column for wind speed measurements, taken at time stamps
+
+    directionBins : numeric numpy array, optional
+        Edges for the wind direction in degrees. Bin membership is 
+        left edge inclusive, right edge exclusive. The default None means
+        we will ignore wind direction for any calculations that use 
+        wind conditions. Must be monotonic INCREASING (bins that share an 
+        edge do not need to have their edges be repeated) and on [0,360). 
+        Rightmost bin edge is expected and will be used as a maximum cutoff for direction.  
+
+    speedBins : numeric numpy array, optional
+        Edges for the wind speed in m/s. Bin membership is 
+        left edge inclusive, right edge exclusive. The default None means
+        we will ignore wind speed for any calculations that use 
+        wind conditions. Must be monotonic INCREASING (bins that share an 
+        edge do not need to have their edges be repeated) and non-negative. 
+        Rightmost bin edge is expected and will be used as a maximum cutoff for speed. 
+
+    wdColWind : string
+        Name of the wind direction column in the wind condition time series
+        Defaults to None in case you want to ignore direction
+
+    wsColWind : string
+        Name of the wind speed column in the wind condition time series
+        Defaults to None in case you  want to ignore speed
+
+    returnDense : boolean, optional
+        Only used for the joint PMF. Whether to return the frequencies as a
+        dense 2D array (directions along the rows, speeds along the columns)
+        together with the bin edges instead of a pandas Series.
+        The default is False.
+
+    Returns
+    -------
+    freq : pandas Series 
+        Joint or marginal PMF based on the new wind condition bins.
+        Will have an index or multiIndex of the wind condition bins.
+        The support of the PMF may exclude some wind or speed values that
+        were not contained in the bin specifications.
+        This gets handled by a helper function.
+        If returnDense=True and both bins are given, this is instead a 
+        dictionary with the 2D array of frequencies ('pmf') and the 
+        edges used for each axis ('directionBins', 'speedBins').
+    """
+
+    # If the correspinding bin variable for one of these is also None,
+    # then this update will get ignored
+    if wdColWind is None:
+        wdColWind = 'wd'
+    if wsColWind is None:
+        wsColWind = 'ws'
+
+    # Frequencies are with respect to all wind data and not just the data
+    # that falls in the boundaries of the wind condition bins specified
+    # (see histogramPMFnd).
+
+    # PMF calculations
+    if speedBins is None:  # speed is None
+
+        if directionBins is None:  # Both are None
+            print("Specify wind direction and/or speed bins")
+            freqs = None
+        else:  # Just speed is None
+            
+            # Calculate PMF based on only wind direction
+            freqs = pd.Series(histogramPMFnd(dfWind, [wdColWind], [directionBins]))
+            freqs.index = np.asarray(directionBins, dtype=float)[:-1] #omit rightmost edge
+            freqs.index.names = ["directionBins"]
+    else:  # Speed is not None
+
+        if directionBins is None:  # speed is not none but direction is none
+
+            # Assign bin edges
+            # Just the direction bin is None, so
+            # Calculate the PMF based on only wind speed
+            freqs = pd.Series(histogramPMFnd(dfWind, [wsColWind], [speedBins]))
+            freqs.index = np.asarray(speedBins, dtype=float)[:-1]#omit rightmost edge
+            freqs.index.names = ["speedBins"]
+
+        else:  # Neither are None
+            # Dense (direction x speed) table of bin frequencies, with the
+            # last edges excluded like every other binning (np.histogram2d
+            # would count values on them)
+            directionBins = np.asarray(directionBins, dtype=float)
+            speedBins = np.asarray(speedBins, dtype=float)
+            freqs = histogramPMFnd(dfWind, [wdColWind, wsColWind], [directionBins, speedBins])
+
+            if returnDense:
+                return {'pmf': freqs,
+                        'directionBins': directionBins,
+                        'speedBins': speedBins}
+
+            # Flatten row-major so that speed varies fastest within each
+            # direction, matching the order of the MultiIndex below
+            freqs = pd.Series(freqs.ravel())
+            freqs.index = pd.MultiIndex.from_product([directionBins[:-1], speedBins[:-1]],
+                                                     names=('directionBins',
+                                                            'speedBins'))
+
+    return freqs